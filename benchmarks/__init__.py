@@ -0,0 +1 @@
+"""Benchmarks for the The Things Network integration."""
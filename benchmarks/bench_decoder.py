@@ -0,0 +1,74 @@
+"""Microbenchmark of the local payload decoders.
+
+Decodes batches of base64 frm_payloads as the decoder stage does for the
+uplinks without decoded_payload.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_decoder [--messages N]
+"""
+import argparse
+import base64
+import struct
+import time
+
+from custom_components.thethingsnetwork.decoders import (
+    compile_struct_layout,
+    decode_cayenne_lpp,
+    decode_payloads,
+)
+
+STRUCT_LAYOUT = "> temperature:h*0.01 humidity:B*0.5 _:x battery:H*0.001 counter:I"
+
+
+def make_cayenne_lpp(index):
+    """Temperature, humidity, battery voltage and GPS like a tracker sends."""
+    return (
+        bytes([1, 103])
+        + (200 + index % 50).to_bytes(2, "big", signed=True)
+        + bytes([2, 104, 80 + index % 20])
+        + bytes([3, 2])
+        + (361).to_bytes(2, "big", signed=True)
+        + bytes([4, 136])
+        + (481000 + index % 100).to_bytes(3, "big", signed=True)
+        + (115000).to_bytes(3, "big", signed=True)
+        + (52000).to_bytes(3, "big", signed=True)
+    )
+
+
+def make_struct(index):
+    return struct.pack(">hBxHI", 2000 + index % 500, 80, 3610, index)
+
+
+def run(decoder, payloads):
+    pending = [(decoder, payload) for payload in payloads]
+    start = time.perf_counter()
+    results = decode_payloads(pending)
+    duration = time.perf_counter() - start
+    errors = sum(1 for result in results if result is None)
+    return len(results) - errors, errors, duration
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--messages", type=int, default=100000)
+    args = arg_parser.parse_args()
+
+    decoders = {
+        "cayenne_lpp": (decode_cayenne_lpp, make_cayenne_lpp),
+        "struct": (compile_struct_layout(STRUCT_LAYOUT), make_struct),
+    }
+    for name, (decoder, make_payload) in decoders.items():
+        payloads = [
+            base64.b64encode(make_payload(index)).decode()
+            for index in range(args.messages)
+        ]
+        count, errors, duration = run(decoder, payloads)
+        print(
+            f"{name:>11}: {count/duration:>10.0f} payloads/s"
+            f" ({duration:.3f} s, {errors} errors)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Scaling benchmark of the entity registration of TTN_client.
+
+Registers from 100 to 20,000 entities with a client whose platforms are set
+up - the entities are attached to hass and write their first state - and
+reports, per catalog size, the time to register all of them in one fetch,
+the time of a fetch adding nothing and of one adding a single entity to the
+full catalog, plus the async_add_entities calls made. The last two should
+not grow with the catalog.
+
+Requires Home Assistant to be installed. Run from the repository root:
+
+    python -m benchmarks.bench_entities --sizes 100 1000 5000 20000
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+from custom_components.thethingsnetwork.const import *
+from custom_components.thethingsnetwork.TTN_client import (
+    TTN_client,
+    TtnDataBinarySensor,
+    TtnDataSensor,
+)
+
+from .bench_fetch import BenchEntry, BenchPlatform, create_hass
+
+
+def create_entities(client, start, count):
+    # Mix of platforms as in a typical application
+    return [
+        (TtnDataBinarySensor if index % 4 == 0 else TtnDataSensor)(
+            client, f"device-{index // 4:05d}", f"field_{index % 4}", index
+        )
+        for index in range(start, start + count)
+    ]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+async def run_size(hass, size, repeat):
+    entry = BenchEntry(
+        {CONF_APP_ID: f"bench-{size}", CONF_ACCESS_KEY: "bench-key"},
+        {OPTIONS_MENU_EDIT_INTEGRATION: {}},
+    )
+    client = TTN_client(hass, entry)
+    add_entities = client._TTN_client__add_entities
+    platforms = BenchPlatform.set_up(hass, client).values()
+
+    def get_calls():
+        return sum(platform.calls for platform in platforms)
+
+    register_s = timed(add_entities, create_entities(client, 0, size))
+    calls_register = get_calls()
+
+    empty_s = min(timed(add_entities, []) for _ in range(repeat))
+
+    one_s = []
+    for index in range(repeat):
+        entity = create_entities(client, size + index, 1)
+        one_s.append(timed(add_entities, entity))
+
+    return {
+        "entities": size,
+        "register_s": register_s,
+        "register_calls": calls_register,
+        "empty_fetch_us": empty_s * 1e6,
+        "one_new_us": min(one_s) * 1e6,
+        "calls_per_new": (get_calls() - calls_register) / repeat,
+    }
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = await create_hass(config_dir)
+        results = [await run_size(hass, size, args.repeat) for size in args.sizes]
+        await hass.async_stop(force=True)
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 1000, 5000, 20000]
+    )
+    arg_parser.add_argument("--repeat", type=int, default=20)
+    arg_parser.add_argument("--json", action="store_true")
+    args = arg_parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(
+        f"{'entities':>9} {'register (s)':>13} {'calls':>6}"
+        f" {'empty (us)':>11} {'one new (us)':>13} {'calls/new':>10}"
+    )
+    for result in results:
+        print(
+            f"{result['entities']:>9} {result['register_s']:>13.3f}"
+            f" {result['register_calls']:>6} {result['empty_fetch_us']:>11.1f}"
+            f" {result['one_new_us']:>13.1f} {result['calls_per_new']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
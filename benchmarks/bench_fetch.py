@@ -0,0 +1,377 @@
+"""Benchmark of the Storage API polling of TTN_client against a local stand-in.
+
+Runs the first fetch and a number of polls of one application against
+benchmarks.storage_stand_in and reports, per fetch, the wall time, messages
+per second and the states written to hass, plus the peak RSS of the process.
+The entities are attached to hass as by their platforms, so the state writes
+are the real ones. Home Assistant is then restarted: the setup restores the
+saved entity catalog and the next poll resumes from the saved watermark.
+Limits can be given to use it as a regression gate: the exit code is 1 if one
+is exceeded or the client logged an error.
+
+Requires Home Assistant to be installed. Run from the repository root:
+
+    python -m benchmarks.bench_fetch --devices 100 --hours 48 --polls 5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import resource
+import socket
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity import async_generate_entity_id
+
+from custom_components.thethingsnetwork import LOGGER
+from custom_components.thethingsnetwork.const import *
+from custom_components.thethingsnetwork.TTN_client import TTN_client, TtnDataEntity
+
+from . import storage_stand_in
+
+TTN_CLIENT_MODULE = sys.modules["custom_components.thethingsnetwork.TTN_client"]
+
+
+class BenchEntry:
+    """The parts of a config entry used by TTN_client."""
+
+    def __init__(self, data, options):
+        self.entry_id = "bench"
+        self.data = data
+        self.options = options
+
+    def add_update_listener(self, listener):
+        return lambda: None
+
+
+class BenchPlatform:
+    """Stand-in for the async_add_entities of a platform.
+
+    Attaches the entities to hass and writes their first state as
+    EntityPlatform does, so later state writes go to the state machine.
+    """
+
+    def __init__(self, hass, domain):
+        self.hass = hass
+        self.domain = domain
+        self.calls = 0
+        self.entities = 0
+
+    def __call__(self, entities, update_before_add=False):
+        self.calls += 1
+        for entity in entities:
+            entity.hass = self.hass
+            entity.entity_id = async_generate_entity_id(
+                f"{self.domain}.{{}}", entity.unique_id, hass=self.hass
+            )
+            entity.async_write_ha_state()
+            self.entities += 1
+
+    @staticmethod
+    def set_up(hass, client):
+        """Set up the platforms of a client - returns them by domain."""
+        platforms = {
+            domain: BenchPlatform(hass, domain)
+            for domain in ["sensor", "binary_sensor", "device_tracker"]
+        }
+        client.add_entities(
+            async_add_sensor_entities=platforms["sensor"],
+            async_add_binary_sensor_entities=platforms["binary_sensor"],
+            async_add_device_tracker_entities=platforms["device_tracker"],
+        )
+        return platforms
+
+
+class StateWriteCounter:
+    """Count the states the entities of the client wrote to hass."""
+
+    def __init__(self):
+        self.count = 0
+
+    def install(self):
+        original = TtnDataEntity.async_write_ha_state
+
+        def async_write_ha_state(entity):
+            original(entity)
+            self.count += 1
+
+        TtnDataEntity.async_write_ha_state = async_write_ha_state
+
+
+class ErrorLogCounter(logging.Handler):
+    """Count the errors logged by the integration, such as failed writes."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+    def install(self):
+        LOGGER.addHandler(self)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(args, port):
+    stand_in = storage_stand_in.from_arguments(args)
+    web.run_app(
+        stand_in.create_app(), host="127.0.0.1", port=port, print=None
+    )
+
+
+async def wait_for_server(session, base_url):
+    for _ in range(100):
+        try:
+            async with session.get(f"{base_url}/bench/stats") as response:
+                return await response.json()
+        except aiohttp.ClientConnectionError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Storage API stand-in did not start")
+
+
+async def create_hass(config_dir):
+    try:
+        hass = HomeAssistant(config_dir)
+    except TypeError:
+        # Older Home Assistant versions
+        hass = HomeAssistant()
+        hass.config.config_dir = config_dir
+    return hass
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_result(name, duration, stats, new_stats, writes, decompress_s=None):
+    messages = new_stats["uplinks_sent"] - stats["uplinks_sent"]
+    return {
+        "fetch": name,
+        "duration_s": duration,
+        "messages": messages,
+        "messages_per_s": messages / duration if duration else 0,
+        "bytes": new_stats["bytes_sent"] - stats["bytes_sent"],
+        "bytes_uncompressed": new_stats["bytes_uncompressed"]
+        - stats["bytes_uncompressed"],
+        "decompress_s": decompress_s,
+        "state_writes": writes,
+    }
+
+
+async def get_stats(session, base_url):
+    async with session.get(f"{base_url}/bench/stats") as response:
+        return await response.json()
+
+
+async def run(args, port):
+    base_url = f"http://127.0.0.1:{port}"
+    # The stand-in does not use TLS
+    TTN_CLIENT_MODULE.TTN_DATA_STORAGE_URL = TTN_DATA_STORAGE_URL.replace(
+        "https://", "http://"
+    )
+    TTN_CLIENT_MODULE.TTN_DATA_STORAGE_DEVICE_URL = TTN_DATA_STORAGE_DEVICE_URL.replace(
+        "https://", "http://"
+    )
+
+    results = []
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = await create_hass(config_dir)
+        entry = BenchEntry(
+            {
+                CONF_APP_ID: args.app_id,
+                CONF_ACCESS_KEY: args.access_key,
+                CONF_HOSTNAME: f"127.0.0.1:{port}",
+            },
+            {
+                OPTIONS_MENU_EDIT_INTEGRATION: {
+                    OPTIONS_MENU_INTEGRATION_FIRST_FETCH_TIME_H: args.hours,
+                    OPTIONS_MENU_INTEGRATION_REFRESH_TIME_S: args.refresh,
+                }
+            },
+        )
+        client = TTN_client(hass, entry)
+        platforms = BenchPlatform.set_up(hass, client)
+        writes = StateWriteCounter()
+        writes.install()
+        errors = ErrorLogCounter()
+        errors.install()
+
+        async with aiohttp.ClientSession() as session:
+            stats = await wait_for_server(session, base_url)
+
+            for poll in range(args.polls + 1):
+                if poll:
+                    await session.post(
+                        f"{base_url}/bench/advance", params={"seconds": args.refresh}
+                    )
+                writes.count = 0
+                start = time.perf_counter()
+                await client.async_fetch()
+                duration = time.perf_counter() - start
+
+                new_stats = await get_stats(session, base_url)
+                results.append(
+                    make_result(
+                        "first" if poll == 0 else f"poll {poll}",
+                        duration,
+                        stats,
+                        new_stats,
+                        writes.count,
+                        client.telemetry.get_metric_stats("decompress_s")["last"],
+                    )
+                )
+                stats = new_stats
+
+            pipeline_stats = client.pipeline_stats
+            # Every entity added must have a state
+            entities = sum(platform.entities for platform in platforms.values())
+            states = len(hass.states.async_entity_ids())
+
+            # Restart - the final write of the stop saves the entity catalog
+            await hass.async_stop(force=True)
+            hass = await create_hass(config_dir)
+            client = TTN_client(hass, entry)
+            BenchPlatform.set_up(hass, client)
+
+            # What the setup waits for before the entities are available
+            writes.count = 0
+            start = time.perf_counter()
+            await client.async_restore()
+            duration = time.perf_counter() - start
+            results.append(make_result("setup", duration, stats, stats, writes.count))
+
+            # The background fetch after the setup
+            await session.post(
+                f"{base_url}/bench/advance", params={"seconds": args.refresh}
+            )
+            writes.count = 0
+            start = time.perf_counter()
+            await client.async_fetch()
+            duration = time.perf_counter() - start
+            new_stats = await get_stats(session, base_url)
+            results.append(
+                make_result(
+                    "resume",
+                    duration,
+                    stats,
+                    new_stats,
+                    writes.count,
+                    client.telemetry.get_metric_stats("decompress_s")["last"],
+                )
+            )
+
+        await hass.async_stop(force=True)
+
+    return results, pipeline_stats, (entities, states, errors.count)
+
+
+def report(args, results, pipeline_stats, entity_states):
+    peak_rss = peak_rss_mb()
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "fetches": results,
+                    "pipeline": pipeline_stats,
+                    "entities": entity_states[0],
+                    "states": entity_states[1],
+                    "errors": entity_states[2],
+                    "peak_rss_mb": peak_rss,
+                },
+                indent=2,
+            )
+        )
+    else:
+        print(
+            f"{'fetch':>8} {'time (s)':>9} {'messages':>9} {'msg/s':>9} {'MB':>7}"
+            f" {'body MB':>7} {'zlib ms':>7} {'writes':>7}"
+        )
+        for result in results:
+            print(
+                f"{result['fetch']:>8} {result['duration_s']:>9.3f} {result['messages']:>9}"
+                f" {result['messages_per_s']:>9.0f} {result['bytes']/1e6:>7.2f}"
+                f" {result['bytes_uncompressed']/1e6:>7.2f}"
+                f" {(result['decompress_s'] or 0) * 1000:>7.0f}"
+                f" {result['state_writes']:>7}"
+            )
+        print(f"{'stage':>10} {'items':>9} {'items/s':>9} {'max queue':>9}")
+        for name, stage in pipeline_stats.items():
+            print(
+                f"{name:>10} {stage['items']:>9} {stage['items_per_s'] or 0:>9.0f}"
+                f" {stage['queue_max_depth']:>9}"
+            )
+        print(
+            f"entities: {entity_states[0]}, with a state: {entity_states[1]},"
+            f" errors logged: {entity_states[2]}"
+        )
+        print(f"peak RSS: {peak_rss:.1f} MB")
+
+    # Regression gates
+    failures = []
+    if entity_states[1] < entity_states[0]:
+        failures.append(
+            f"only {entity_states[1]} of {entity_states[0]} entities have a state"
+        )
+    if entity_states[2]:
+        failures.append(f"{entity_states[2]} errors were logged")
+    first = results[0]
+    polls = [result for result in results if result["fetch"].startswith("poll")]
+    setup = next(result for result in results if result["fetch"] == "setup")
+    if args.max_first_fetch_s and first["duration_s"] > args.max_first_fetch_s:
+        failures.append(f"first fetch took {first['duration_s']:.3f} s")
+    if args.max_setup_s and setup["duration_s"] > args.max_setup_s:
+        failures.append(f"setup took {setup['duration_s']:.3f} s")
+    if args.min_messages_per_s and first["messages_per_s"] < args.min_messages_per_s:
+        failures.append(f"first fetch parsed {first['messages_per_s']:.0f} msg/s")
+    if args.max_rss_mb and peak_rss > args.max_rss_mb:
+        failures.append(f"peak RSS was {peak_rss:.1f} MB")
+    if args.max_writes_per_poll is not None:
+        for poll in polls:
+            if poll["state_writes"] > args.max_writes_per_poll:
+                failures.append(f"{poll['fetch']} wrote {poll['state_writes']} states")
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    storage_stand_in.add_arguments(arg_parser)
+    arg_parser.add_argument("--hours", type=int, default=DEFAULT_FIRST_FETCH_LAST_H)
+    arg_parser.add_argument("--refresh", type=int, default=DEFAULT_API_REFRESH_PERIOD_S)
+    arg_parser.add_argument("--polls", type=int, default=3)
+    arg_parser.add_argument("--json", action="store_true")
+    arg_parser.add_argument("--max-first-fetch-s", type=float)
+    arg_parser.add_argument("--max-setup-s", type=float)
+    arg_parser.add_argument("--min-messages-per-s", type=float)
+    arg_parser.add_argument("--max-rss-mb", type=float)
+    arg_parser.add_argument("--max-writes-per-poll", type=int)
+    args = arg_parser.parse_args()
+
+    # Serve from another process so it does not count in the measurements
+    port = free_port()
+    server = multiprocessing.Process(target=serve, args=(args, port), daemon=True)
+    server.start()
+    try:
+        results, pipeline_stats, entity_states = asyncio.run(run(args, port))
+    finally:
+        server.terminate()
+
+    sys.exit(report(args, results, pipeline_stats, entity_states))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Memory benchmark of the entities of TTN_client.
+
+Creates a catalog of sensors, binary sensors and GPS device trackers as a
+fetch would and reports the memory allocated per entity, measured with
+tracemalloc. Values and received_at strings are included since they are
+kept for every entity.
+
+Requires Home Assistant to be installed. Run from the repository root:
+
+    python -m benchmarks.bench_memory --entities 20000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import tempfile
+import tracemalloc
+
+from custom_components.thethingsnetwork.const import *
+from custom_components.thethingsnetwork.TTN_client import (
+    TTN_client,
+    TtnDataBinarySensor,
+    TtnDataDeviceTracker,
+    TtnDataSensor,
+)
+
+from .bench_fetch import BenchEntry, create_hass
+
+FIELDS = [
+    ("temperature", TtnDataSensor, lambda index: 20.5 + index % 10),
+    ("humidity", TtnDataSensor, lambda index: 40 + index % 50),
+    ("battery", TtnDataSensor, lambda index: 3.3),
+    ("door", TtnDataBinarySensor, lambda index: bool(index % 2)),
+    (
+        "gps",
+        TtnDataDeviceTracker,
+        lambda index: {
+            "latitude": 48.1 + index * 1e-5,
+            "longitude": 11.5 + index * 1e-5,
+            "altitude": 520.0,
+        },
+    ),
+]
+
+
+def create_entities(client, count):
+    entities = []
+    for index in range(count):
+        field_id, entity_class, make_value = FIELDS[index % len(FIELDS)]
+        device_id = f"device-{index // len(FIELDS):05d}"
+        received_at = f"2023-01-01T00:00:{index % 60:02d}.123456789Z"
+        entities.append(
+            entity_class(client, device_id, field_id, make_value(index), received_at)
+        )
+    return entities
+
+
+async def measure(hass, count):
+    entry = BenchEntry(
+        {CONF_APP_ID: "bench", CONF_ACCESS_KEY: "bench-key"},
+        {
+            OPTIONS_MENU_EDIT_INTEGRATION: {},
+            OPTIONS_MENU_EDIT_FIELDS: {
+                "temperature": {
+                    OPTIONS_FIELD_NAME: "Temperature",
+                    OPTIONS_FIELD_UNIT_MEASUREMENT: "°C",
+                    OPTIONS_FIELD_DEVICE_CLASS: "temperature",
+                },
+                "humidity": {
+                    OPTIONS_FIELD_UNIT_MEASUREMENT: "%",
+                    OPTIONS_FIELD_DEVICE_CLASS: "humidity",
+                },
+            },
+        },
+    )
+    client = TTN_client(hass, entry)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    client._TTN_client__add_entities(create_entities(client, count))
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return {
+        "entities": count,
+        "bytes": allocated,
+        "bytes_per_entity": allocated / count,
+    }
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = await create_hass(config_dir)
+        result = await measure(hass, args.entities)
+        await hass.async_stop(force=True)
+    return result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--entities", type=int, default=20000)
+    arg_parser.add_argument("--json", action="store_true")
+    args = arg_parser.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(
+            f"{result['entities']} entities: {result['bytes'] / 1e6:.1f} MB,"
+            f" {result['bytes_per_entity']:.0f} bytes per entity"
+        )
+
+
+if __name__ == "__main__":
+    main()
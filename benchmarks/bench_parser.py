@@ -0,0 +1,97 @@
+"""Microbenchmark of the Storage API uplink parser.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_parser [--messages N] [--chunk-size BYTES]
+"""
+import argparse
+import json
+import time
+
+from custom_components.thethingsnetwork.uplink_parser import (
+    HAS_ORJSON,
+    UplinkStreamParser,
+)
+
+
+def make_message(index):
+    """Return a Storage API line similar to what TTN sends."""
+    return {
+        "result": {
+            "end_device_ids": {
+                "device_id": f"device-{index % 50}",
+                "application_ids": {"application_id": "bench"},
+                "dev_eui": "0004A30B001C0530",
+                "dev_addr": "260B1234",
+            },
+            "received_at": "2021-11-22T10:15:30.123456789Z",
+            "uplink_message": {
+                "f_port": 1,
+                "f_cnt": index,
+                "frm_payload": "AWcA4AJoUAMCAWU=",
+                "decoded_payload": {
+                    "temperature": 22.4,
+                    "humidity": 40,
+                    "battery": 3.61,
+                    "gps": {"latitude": 48.1, "longitude": 11.5, "altitude": 520},
+                },
+                "rx_metadata": [
+                    {
+                        "gateway_ids": {"gateway_id": f"gw-{gw}", "eui": "B827EBFFFE000000"},
+                        "time": "2021-11-22T10:15:30.100000Z",
+                        "timestamp": 1234567890,
+                        "rssi": -100 + gw,
+                        "channel_rssi": -100 + gw,
+                        "snr": 7.5,
+                        "uplink_token": "ChsKGQoNZ3ctYjgyN2ViZmZmZTAwMDAwMBIIuCfr//4AAAA=",
+                        "location": {"latitude": 48.0, "longitude": 11.0, "source": "SOURCE_REGISTRY"},
+                    }
+                    for gw in range(3)
+                ],
+                "settings": {
+                    "data_rate": {"lora": {"bandwidth": 125000, "spreading_factor": 7}},
+                    "coding_rate": "4/5",
+                    "frequency": "868100000",
+                    "timestamp": 1234567890,
+                },
+                "received_at": "2021-11-22T10:15:30.110000Z",
+                "consumed_airtime": "0.061696s",
+            },
+        }
+    }
+
+
+def make_stream(messages):
+    return "\n\n".join(json.dumps(make_message(i)) for i in range(messages)).encode()
+
+
+def run(data, use_orjson, chunk_size):
+    parser = UplinkStreamParser(use_orjson=use_orjson)
+    count = 0
+    start = time.perf_counter()
+    for offset in range(0, len(data), chunk_size):
+        for _ in parser.feed(data[offset : offset + chunk_size]):
+            count += 1
+    for _ in parser.close():
+        count += 1
+    return count, time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--messages", type=int, default=20000)
+    arg_parser.add_argument("--chunk-size", type=int, default=64 * 1024)
+    args = arg_parser.parse_args()
+
+    data = make_stream(args.messages)
+    print(f"{args.messages} messages, {len(data)/1e6:.1f} MB")
+
+    paths = [False, True] if HAS_ORJSON else [False]
+    for use_orjson in paths:
+        count, duration = run(data, use_orjson, args.chunk_size)
+        name = "orjson" if use_orjson else "json"
+        print(f"{name:>7}: {count/duration:>10.0f} messages/s ({duration:.3f} s)")
+
+
+if __name__ == "__main__":
+    main()
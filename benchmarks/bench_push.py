@@ -0,0 +1,229 @@
+"""Benchmark of the MQTT push ingestion of TTN_client against local stand-ins.
+
+As at setup, the first fetch runs against benchmarks.storage_stand_in, then
+the client subscribes to benchmarks.mqtt_stand_in, which publishes uplinks at
+a fixed rate. Reports the push latency - from the received_at set when an
+uplink is published until its last state is written - as p50/p95/max, the
+push_latency_s of the client and the throughput of the push stage. Limits can
+be given to use it as a regression gate: the exit code is 1 if one is
+exceeded.
+
+Requires Home Assistant and paho-mqtt to be installed. Run from the
+repository root:
+
+    python -m benchmarks.bench_push --devices 100 --rate 50 --messages 2000
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from custom_components.thethingsnetwork.const import *
+from custom_components.thethingsnetwork.mqtt_client import TTN_mqtt_client
+from custom_components.thethingsnetwork.telemetry import percentile
+from custom_components.thethingsnetwork.TTN_client import TTN_client, TtnDataEntity
+
+from . import mqtt_stand_in
+from .bench_fetch import (
+    TTN_CLIENT_MODULE,
+    BenchEntry,
+    BenchPlatform,
+    create_hass,
+    free_port,
+    peak_rss_mb,
+    serve,
+    wait_for_server,
+)
+from .storage_stand_in import parse_timestamp
+
+
+class PushLatencyRecorder:
+    """Latency of the state writes from the received_at of their uplink."""
+
+    def __init__(self):
+        # (device_id, received_at) -> seconds until the last state was written
+        self.latencies = {}
+
+    def install(self):
+        original = TtnDataEntity.async_set_state
+
+        async def async_set_state(entity, value, received_at=None):
+            await original(entity, value, received_at)
+            if received_at is not None:
+                self.latencies[(entity.device_id, received_at)] = (
+                    time.time() - parse_timestamp(received_at)
+                )
+
+        TtnDataEntity.async_set_state = async_set_state
+
+
+def serve_mqtt(args, port):
+    asyncio.run(mqtt_stand_in.from_arguments(args).serve("127.0.0.1", port))
+
+
+async def run(args, storage_port, mqtt_port):
+    base_url = f"http://127.0.0.1:{storage_port}"
+    # The stand-in does not use TLS
+    TTN_CLIENT_MODULE.TTN_DATA_STORAGE_URL = TTN_DATA_STORAGE_URL.replace(
+        "https://", "http://"
+    )
+    TTN_CLIENT_MODULE.TTN_DATA_STORAGE_DEVICE_URL = TTN_DATA_STORAGE_DEVICE_URL.replace(
+        "https://", "http://"
+    )
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = await create_hass(config_dir)
+        entry = BenchEntry(
+            {
+                CONF_APP_ID: args.app_id,
+                CONF_ACCESS_KEY: args.access_key,
+                CONF_HOSTNAME: f"127.0.0.1:{storage_port}",
+            },
+            {
+                OPTIONS_MENU_EDIT_INTEGRATION: {
+                    OPTIONS_MENU_INTEGRATION_FIRST_FETCH_TIME_H: args.hours,
+                    OPTIONS_MENU_INTEGRATION_INGEST_MODE: OPTIONS_MENU_INTEGRATION_INGEST_MODE_MQTT,
+                    OPTIONS_MENU_INTEGRATION_MQTT_HOSTNAME: "127.0.0.1",
+                    OPTIONS_MENU_INTEGRATION_MQTT_PORT: mqtt_port,
+                    OPTIONS_MENU_INTEGRATION_MQTT_TLS: False,
+                }
+            },
+        )
+        client = TTN_client(hass, entry)
+        BenchPlatform.set_up(hass, client)
+
+        # Push starts once the first fetch created the entities
+        async with aiohttp.ClientSession() as session:
+            await wait_for_server(session, base_url)
+        await client.async_fetch()
+
+        recorder = PushLatencyRecorder()
+        recorder.install()
+
+        async def ignore():
+            pass
+
+        hostname, port, use_tls = client.get_mqtt_settings()
+        mqtt_client = TTN_mqtt_client(
+            hass,
+            hostname,
+            port,
+            use_tls,
+            args.app_id,
+            args.access_key,
+            on_uplink=client.queue_push_uplink,
+            on_connected=ignore,
+            on_disconnected=ignore,
+        )
+        start = time.perf_counter()
+        await mqtt_client.connect()
+        deadline = time.monotonic() + args.messages / args.rate + args.timeout
+        while len(recorder.latencies) < args.messages and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        duration = time.perf_counter() - start
+        await mqtt_client.disconnect()
+
+        result = {
+            "published": args.messages,
+            "written": len(recorder.latencies),
+            "duration_s": duration,
+            "latencies_s": sorted(recorder.latencies.values()),
+            "push_latency_s": client.push_latency_s,
+            "pipeline": client.pipeline_stats,
+        }
+        await hass.async_stop(force=True)
+
+    return result
+
+
+def report(args, result):
+    peak_rss = peak_rss_mb()
+    latencies = result.pop("latencies_s")
+    if latencies:
+        result["latency_p50_s"] = percentile(latencies, 0.5)
+        result["latency_p95_s"] = percentile(latencies, 0.95)
+        result["latency_max_s"] = latencies[-1]
+    else:
+        result["latency_p50_s"] = result["latency_p95_s"] = None
+        result["latency_max_s"] = None
+    result["peak_rss_mb"] = peak_rss
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(
+            f"uplinks written: {result['written']} of {result['published']}"
+            f" in {result['duration_s']:.3f} s"
+        )
+        if latencies:
+            print(
+                f"push latency (ms): p50 {result['latency_p50_s'] * 1000:.1f}"
+                f"  p95 {result['latency_p95_s'] * 1000:.1f}"
+                f"  max {result['latency_max_s'] * 1000:.1f}"
+            )
+        if result["push_latency_s"] is not None:
+            print(f"push_latency_s of the client: {result['push_latency_s']:.3f}")
+        print(f"{'stage':>10} {'items':>9} {'items/s':>9} {'max queue':>9}")
+        for name in [PIPELINE_STAGE_PUSH, PIPELINE_STAGE_DISPATCHER]:
+            stage = result["pipeline"][name]
+            print(
+                f"{name:>10} {stage['items']:>9} {stage['items_per_s'] or 0:>9.0f}"
+                f" {stage['queue_max_depth']:>9}"
+            )
+        print(f"peak RSS: {peak_rss:.1f} MB")
+
+    # Regression gates
+    failures = []
+    if result["written"] < result["published"]:
+        failures.append(
+            f"only {result['written']} of {result['published']} uplinks were written"
+        )
+    if (
+        args.max_p95_latency_s
+        and latencies
+        and result["latency_p95_s"] > args.max_p95_latency_s
+    ):
+        failures.append(f"p95 push latency was {result['latency_p95_s']:.3f} s")
+    if args.max_rss_mb and peak_rss > args.max_rss_mb:
+        failures.append(f"peak RSS was {peak_rss:.1f} MB")
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    mqtt_stand_in.add_arguments(arg_parser)
+    arg_parser.add_argument("--hours", type=int, default=1)
+    arg_parser.add_argument(
+        "--timeout", type=float, default=10, help="seconds to wait after the last uplink"
+    )
+    arg_parser.add_argument("--json", action="store_true")
+    arg_parser.add_argument("--max-p95-latency-s", type=float)
+    arg_parser.add_argument("--max-rss-mb", type=float)
+    args = arg_parser.parse_args()
+
+    # Serve from other processes so they do not count in the measurements
+    storage_port, mqtt_port = free_port(), free_port()
+    servers = [
+        multiprocessing.Process(target=serve, args=(args, storage_port), daemon=True),
+        multiprocessing.Process(target=serve_mqtt, args=(args, mqtt_port), daemon=True),
+    ]
+    for server in servers:
+        server.start()
+    try:
+        result = asyncio.run(run(args, storage_port, mqtt_port))
+    finally:
+        for server in servers:
+            server.terminate()
+
+    sys.exit(report(args, result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""Local stand-in for the MQTT server of The Things Stack.
+
+A minimal MQTT 3.1.1 broker for one application: it accepts the username
+{app_id}@ttn with the access key as password, answers subscriptions and
+pings, and publishes the uplinks of the devices of a StorageStandIn on
+v3/{app_id}/devices/{device_id}/up to the matching subscriptions. Only QoS 0
+is supported.
+
+Once the first subscription is made, the given number of uplinks is published
+at a fixed rate, one device after the other. received_at is the time the
+uplink is sent, so a client on the same host measures the push latency with
+the same clock.
+
+Run standalone from the repository root:
+
+    python -m benchmarks.mqtt_stand_in --port 1883 --devices 100 --rate 50
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from . import storage_stand_in
+
+TOPIC_UPLINK = "v3/{app_id}/devices/{device_id}/up"
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+CONNACK_ACCEPTED = 0
+CONNACK_BAD_CREDENTIALS = 4
+
+
+def encode_length(length):
+    """Variable length encoding of the remaining length."""
+    encoded = bytearray()
+    while True:
+        length, digit = divmod(length, 128)
+        encoded.append(digit | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(value):
+    data = value.encode()
+    return len(data).to_bytes(2, "big") + data
+
+
+def encode_packet(packet_type, body, flags=0):
+    return bytes([packet_type << 4 | flags]) + encode_length(len(body)) + body
+
+
+def decode_string(body, offset):
+    """The string at offset and the offset after it."""
+    length = int.from_bytes(body[offset : offset + 2], "big")
+    end = offset + 2 + length
+    return body[offset + 2 : end].decode(), end
+
+
+def topic_matches(topic_filter, topic):
+    """Match a topic against a subscription with + and # wildcards."""
+    filter_levels = topic_filter.split("/")
+    levels = topic.split("/")
+    for index, filter_level in enumerate(filter_levels):
+        if filter_level == "#":
+            return True
+        if index >= len(levels):
+            return False
+        if filter_level != "+" and filter_level != levels[index]:
+            return False
+    return len(filter_levels) == len(levels)
+
+
+async def read_packet(reader):
+    """Packet type, flags and body of the next packet."""
+    header = (await reader.readexactly(1))[0]
+    length = 0
+    for shift in range(0, 28, 7):
+        digit = (await reader.readexactly(1))[0]
+        length |= (digit & 0x7F) << shift
+        if not digit & 0x80:
+            break
+    body = await reader.readexactly(length) if length else b""
+    return header >> 4, header & 0x0F, body
+
+
+def parse_credentials(body):
+    """Username and password of a CONNECT packet body."""
+    _protocol, offset = decode_string(body, 0)
+    flags = body[offset + 1]
+    # Protocol level, connect flags and keep alive
+    offset += 4
+    _client_id, offset = decode_string(body, offset)
+    if flags & 0x04:
+        # Will topic and message
+        _will_topic, offset = decode_string(body, offset)
+        _will_message, offset = decode_string(body, offset)
+    username = password = None
+    if flags & 0x80:
+        username, offset = decode_string(body, offset)
+    if flags & 0x40:
+        password, offset = decode_string(body, offset)
+    return username, password
+
+
+class MqttStandIn:
+    """Publish the uplinks of a synthetic application to MQTT subscribers."""
+
+    def __init__(self, uplinks, rate=50, messages=1000):
+        self.uplinks = uplinks
+        self.rate = rate
+        self.messages = messages
+
+        # writer -> topic filters
+        self.__subscriptions = {}
+        self.__publisher = None
+
+        self.connections = 0
+        self.published = 0
+        self.bytes_sent = 0
+
+    async def handle_connection(self, reader, writer):
+        try:
+            packet_type, _flags, body = await read_packet(reader)
+            if packet_type != CONNECT:
+                return
+            username, password = parse_credentials(body)
+            if (
+                username != f"{self.uplinks.app_id}@ttn"
+                or password != self.uplinks.access_key
+            ):
+                writer.write(
+                    encode_packet(CONNACK, bytes([0, CONNACK_BAD_CREDENTIALS]))
+                )
+                return
+            writer.write(encode_packet(CONNACK, bytes([0, CONNACK_ACCEPTED])))
+            self.connections += 1
+            self.__subscriptions[writer] = set()
+
+            while True:
+                packet_type, _flags, body = await read_packet(reader)
+                if packet_type == SUBSCRIBE:
+                    self.__subscribe(writer, body)
+                elif packet_type == UNSUBSCRIBE:
+                    writer.write(encode_packet(UNSUBACK, body[:2]))
+                elif packet_type == PINGREQ:
+                    writer.write(encode_packet(PINGRESP, b""))
+                elif packet_type == DISCONNECT:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.__subscriptions.pop(writer, None)
+            writer.close()
+
+    def __subscribe(self, writer, body):
+        packet_id, offset = body[:2], 2
+        granted = bytearray()
+        while offset < len(body):
+            topic_filter, offset = decode_string(body, offset)
+            # Requested QoS - only QoS 0 is delivered
+            offset += 1
+            self.__subscriptions[writer].add(topic_filter)
+            granted.append(0)
+        writer.write(encode_packet(SUBACK, packet_id + bytes(granted)))
+
+        if self.__publisher is None:
+            self.__publisher = asyncio.get_running_loop().create_task(
+                self.__publish_uplinks()
+            )
+
+    async def __publish_uplinks(self):
+        devices = self.uplinks.devices
+        start = time.time()
+        # Frame counters continue from the uplinks stored before
+        f_cnt = int(start // self.uplinks.interval_s) + 1
+        for index in range(self.messages):
+            # Keep the rate from drifting with the time spent publishing
+            delay_s = start + index / self.rate - time.time()
+            if delay_s > 0:
+                await asyncio.sleep(delay_s)
+            device, cycle = index % devices, index // devices
+            uplink = self.uplinks.make_uplink(device, f_cnt + cycle, time.time())
+            self.publish(
+                TOPIC_UPLINK.format(
+                    app_id=self.uplinks.app_id,
+                    device_id=self.uplinks.device_id(device),
+                ),
+                json.dumps(uplink).encode(),
+            )
+
+    def publish(self, topic, payload):
+        packet = encode_packet(PUBLISH, encode_string(topic) + payload)
+        for writer, topic_filters in self.__subscriptions.items():
+            if any(topic_matches(topic_filter, topic) for topic_filter in topic_filters):
+                writer.write(packet)
+                self.bytes_sent += len(packet)
+        self.published += 1
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def add_arguments(arg_parser):
+    storage_stand_in.add_arguments(arg_parser)
+    arg_parser.add_argument("--rate", type=float, default=50, help="uplinks per second")
+    arg_parser.add_argument("--messages", type=int, default=1000)
+
+
+def from_arguments(args):
+    return MqttStandIn(
+        storage_stand_in.from_arguments(args), rate=args.rate, messages=args.messages
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(arg_parser)
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=1883)
+    args = arg_parser.parse_args()
+
+    asyncio.run(from_arguments(args).serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""Local stand-in for the uplink endpoint of the TTN Storage Integration API.
+
+Serves /api/v3/as/applications/{app_id}/packages/storage/uplink_message and
+the per device .../devices/{device_id}/packages/storage/uplink_message with
+the last, after, order, limit and field_mask query parameters and the same
+framing as TTN: one {"result": uplink} JSON object per line, separated by
+empty lines.
+
+The uplinks are generated from a virtual clock: every device sends one uplink
+per interval. POST /bench/advance?seconds=N moves the clock forward so new
+uplinks appear for the next poll.
+
+Like TTN, the body is gzip or deflate compressed if the client accepts it,
+unless compression is disabled.
+
+Run standalone from the repository root:
+
+    python -m benchmarks.storage_stand_in --port 8080 --devices 100
+"""
+import argparse
+import base64
+import heapq
+import json
+import re
+import time
+import zlib
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+STORAGE_PATH = "/api/v3/as/applications/{app_id}/packages/storage/uplink_message"
+STORAGE_DEVICE_PATH = (
+    "/api/v3/as/applications/{app_id}/devices/{device_id}/packages/storage/uplink_message"
+)
+CHUNK_SIZE = 64 * 1024
+
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(h|m|s|ms)")
+DURATION_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+
+
+def parse_field_mask(value):
+    """Parse a comma separated field_mask of up.* paths into key lists."""
+    paths = []
+    for path in value.split(","):
+        keys = path.split(".")
+        if len(keys) < 2 or keys[0] != "up":
+            raise ValueError(f"Invalid field_mask path: {path}")
+        paths.append(keys[1:])
+    return paths
+
+
+def apply_field_mask(uplink, paths):
+    """Keep the identifiers and the parsed field_mask paths of an uplink."""
+    projected = {
+        "end_device_ids": uplink["end_device_ids"],
+        "received_at": uplink["received_at"],
+    }
+    for keys in paths:
+        source, target = uplink, projected
+        for key in keys[:-1]:
+            source = source.get(key)
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(key, {})
+        else:
+            if keys[-1] in source:
+                target[keys[-1]] = source[keys[-1]]
+    return projected
+
+
+def parse_duration(value):
+    """Parse a Go duration such as 48h, 360s or 1h30m into seconds."""
+    matches = DURATION_RE.findall(value)
+    if not matches or "".join(n + u for n, u in matches) != value:
+        raise ValueError(f"Invalid duration: {value}")
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in matches)
+
+
+def parse_timestamp(value):
+    """Parse an RFC3339 timestamp with up to nanosecond precision."""
+    match = re.fullmatch(
+        r"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)", value
+    )
+    if not match:
+        raise ValueError(f"Invalid timestamp: {value}")
+    seconds, fraction, zone = match.groups()
+    zone = "+00:00" if zone == "Z" else zone
+    parsed = datetime.fromisoformat(seconds + zone).timestamp()
+    return parsed + float(f"0.{fraction}") if fraction else parsed
+
+
+def format_timestamp(timestamp):
+    """Format like TTN: RFC3339 with nanoseconds in UTC."""
+    whole = int(timestamp)
+    nanos = min(round((timestamp - whole) * 1e9), 999999999)
+    date = datetime.fromtimestamp(whole, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+    return f"{date}.{nanos:09d}Z"
+
+
+class StorageStandIn:
+    """Generate the uplinks of a synthetic application."""
+
+    def __init__(
+        self,
+        app_id="bench",
+        access_key="bench-key",
+        devices=10,
+        fields=4,
+        interval_s=300,
+        gateways=2,
+        start=None,
+        compression=True,
+        field_mask=True,
+    ):
+        self.app_id = app_id
+        self.access_key = access_key
+        self.devices = devices
+        self.fields = fields
+        self.interval_s = interval_s
+        self.gateways = gateways
+        self.compression = compression
+        self.field_mask = field_mask
+        self.now = time.time() if start is None else start
+
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_uncompressed = 0
+        self.uplinks_sent = 0
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def uplink_times(self, device, begin, end):
+        """Times of the uplinks of a device in (begin, end]."""
+        phase = device * self.interval_s / self.devices
+        k = int((begin - phase) // self.interval_s) + 1
+        while True:
+            t = phase + k * self.interval_s
+            if t > end:
+                return
+            if t > begin:
+                yield t, k, device
+            k += 1
+
+    def uplinks(self, begin, end, descending=False, limit=None, devices=None):
+        """Uplinks of the devices in (begin, end] ordered by received_at."""
+        if devices is None:
+            devices = range(self.devices)
+        merged = heapq.merge(
+            *[self.uplink_times(device, begin, end) for device in devices]
+        )
+        ordered = reversed(list(merged)) if descending else merged
+        for count, (received_at, f_cnt, device) in enumerate(ordered):
+            if limit is not None and count >= limit:
+                return
+            yield self.make_uplink(device, f_cnt, received_at)
+
+    @staticmethod
+    def device_id(device):
+        return f"device-{device:05d}"
+
+    def make_uplink(self, device, f_cnt, received_at):
+        device_id = self.device_id(device)
+        timestamp = format_timestamp(received_at)
+        decoded_payload = {
+            f"field_{field}": round(20 + ((f_cnt * (field + 1)) % 100) / 10, 2)
+            for field in range(self.fields)
+        }
+        payload = f_cnt.to_bytes(4, "big") * self.fields
+        return {
+            "end_device_ids": {
+                "device_id": device_id,
+                "application_ids": {"application_id": self.app_id},
+                "dev_eui": f"{device:016X}",
+                "dev_addr": f"{device:08X}",
+            },
+            "received_at": timestamp,
+            "uplink_message": {
+                "f_port": 1,
+                "f_cnt": f_cnt,
+                "frm_payload": base64.b64encode(payload).decode(),
+                "decoded_payload": decoded_payload,
+                "rx_metadata": [
+                    {
+                        "gateway_ids": {
+                            "gateway_id": f"gateway-{gateway}",
+                            "eui": f"B827EBFFFE{gateway:06X}",
+                        },
+                        "time": timestamp,
+                        "timestamp": f_cnt,
+                        "rssi": -90 - gateway,
+                        "channel_rssi": -90 - gateway,
+                        "snr": 8.5 - gateway,
+                        "uplink_token": "ChsKGQoNZ2F0ZXdheS0wEgi4J+v//gAAABDAhD0=",
+                        "channel_index": gateway,
+                    }
+                    for gateway in range(self.gateways)
+                ],
+                "settings": {
+                    "data_rate": {
+                        "lora": {"bandwidth": 125000, "spreading_factor": 7}
+                    },
+                    "coding_rate": "4/5",
+                    "frequency": "868100000",
+                    "timestamp": f_cnt,
+                },
+                "received_at": timestamp,
+                "consumed_airtime": "0.061696s",
+            },
+        }
+
+    # ---------------
+    # aiohttp handlers
+    # ---------------
+    async def handle_uplink_message(self, request):
+        if request.match_info["app_id"] != self.app_id:
+            raise web.HTTPNotFound()
+        if request.headers.get("Authorization") != f"Bearer {self.access_key}":
+            raise web.HTTPUnauthorized()
+        devices = None
+        if "device_id" in request.match_info:
+            devices = [
+                device
+                for device in range(self.devices)
+                if self.device_id(device) == request.match_info["device_id"]
+            ]
+            if not devices:
+                raise web.HTTPNotFound()
+
+        query = request.query
+        try:
+            begin = float("-inf")
+            if "last" in query:
+                begin = self.now - parse_duration(query["last"])
+            if "after" in query:
+                begin = max(begin, parse_timestamp(query["after"]))
+            limit = int(query["limit"]) if "limit" in query else None
+            field_mask = None
+            if self.field_mask and query.get("field_mask"):
+                field_mask = parse_field_mask(query["field_mask"])
+        except ValueError as err:
+            raise web.HTTPBadRequest(text=str(err))
+        descending = query.get("order") == "-received_at"
+        if begin == float("-inf"):
+            # TTN limits to the retention period - keep the stand-in bounded
+            begin = self.now - 24 * 3600
+
+        self.requests += 1
+        headers = {"Content-Type": "text/event-stream"}
+        compressor = None
+        accepted = request.headers.get("Accept-Encoding", "")
+        if self.compression and "gzip" in accepted:
+            headers["Content-Encoding"] = "gzip"
+            compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        elif self.compression and "deflate" in accepted:
+            headers["Content-Encoding"] = "deflate"
+            compressor = zlib.compressobj()
+        response = web.StreamResponse(headers=headers)
+        await response.prepare(request)
+
+        async def write(data, last=False):
+            self.bytes_uncompressed += len(data)
+            if compressor is not None:
+                # Flushed per chunk so the client can parse while streaming
+                data = compressor.compress(data) + compressor.flush(
+                    zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+                )
+            if data:
+                await response.write(data)
+                self.bytes_sent += len(data)
+
+        chunk = bytearray()
+        for uplink in self.uplinks(begin, self.now, descending, limit, devices):
+            if field_mask:
+                uplink = apply_field_mask(uplink, field_mask)
+            chunk += json.dumps({"result": uplink}).encode()
+            chunk += b"\n\n"
+            self.uplinks_sent += 1
+            if len(chunk) >= CHUNK_SIZE:
+                await write(bytes(chunk))
+                chunk.clear()
+        await write(bytes(chunk), last=True)
+        await response.write_eof()
+        return response
+
+    async def handle_advance(self, request):
+        self.advance(float(request.query.get("seconds", self.interval_s)))
+        return web.json_response({"now": format_timestamp(self.now)})
+
+    async def handle_stats(self, request):
+        return web.json_response(
+            {
+                "requests": self.requests,
+                "bytes_sent": self.bytes_sent,
+                "bytes_uncompressed": self.bytes_uncompressed,
+                "uplinks_sent": self.uplinks_sent,
+            }
+        )
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_get(
+            STORAGE_PATH.format(app_id="{app_id}"), self.handle_uplink_message
+        )
+        app.router.add_get(
+            STORAGE_DEVICE_PATH.format(app_id="{app_id}", device_id="{device_id}"),
+            self.handle_uplink_message,
+        )
+        app.router.add_post("/bench/advance", self.handle_advance)
+        app.router.add_get("/bench/stats", self.handle_stats)
+        return app
+
+
+def add_arguments(arg_parser):
+    arg_parser.add_argument("--app-id", default="bench")
+    arg_parser.add_argument("--access-key", default="bench-key")
+    arg_parser.add_argument("--devices", type=int, default=10)
+    arg_parser.add_argument("--fields", type=int, default=4)
+    arg_parser.add_argument("--interval", type=float, default=300, help="seconds")
+    arg_parser.add_argument("--gateways", type=int, default=2)
+    arg_parser.add_argument(
+        "--no-compression", action="store_true", help="never compress the body"
+    )
+    arg_parser.add_argument(
+        "--ignore-field-mask", action="store_true", help="always send whole uplinks"
+    )
+
+
+def from_arguments(args):
+    return StorageStandIn(
+        app_id=args.app_id,
+        access_key=args.access_key,
+        devices=args.devices,
+        fields=args.fields,
+        interval_s=args.interval,
+        gateways=args.gateways,
+        compression=not args.no_compression,
+        field_mask=not args.ignore_field_mask,
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(arg_parser)
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8080)
+    args = arg_parser.parse_args()
+
+    web.run_app(from_arguments(args).create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from homeassistant.helpers.typing import HomeAssistantType
 from homeassistant.helpers.entity import Entity
+from homeassistant.components.sensor import ATTR_STATE_CLASS, SensorStateClass
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.helpers import device_registry as dr
 from homeassistant.const import (
@@ -7,26 +8,96 @@ from homeassistant.const import (
     ATTR_GPS_ACCURACY,
     ATTR_LATITUDE,
     ATTR_LONGITUDE,
-    STATE_HOME,
-    STATE_NOT_HOME,
+    EVENT_HOMEASSISTANT_STOP,
     STATE_OFF,
     STATE_ON,
 )
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
-from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
-from homeassistant.components import zone
+from homeassistant.helpers.aiohttp_client import async_create_clientsession
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.helpers.storage import Store
+import homeassistant.util.dt as dt_util
+from homeassistant.core import callback
 
 import asyncio
-import aiohttp
-import async_timeout
 from datetime import timedelta
-from aiohttp.hdrs import ACCEPT, AUTHORIZATION
+from aiohttp.hdrs import ACCEPT, ACCEPT_ENCODING, AUTHORIZATION, CONTENT_ENCODING
 import re
-import json
-from typing import Any, Awaitable, Dict, Iterable, List, Optional
+import sys
+import time
+from urllib.parse import quote
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional
 
 from . import LOGGER
 from .const import *
+from .scheduler import TTN_scheduler
+from .cadence import TTN_cadence
+from .watermark import TTN_watermark, is_received_after
+from .pipeline import TTN_fetch, TTN_pipeline_stage
+from .telemetry import TELEMETRY_METRICS, TTN_telemetry, TtnTelemetrySensor
+from .zone_cache import TTN_zone_cache
+from .backfill import TTN_statistics_backfill
+from .write_filter import TTN_write_filter
+from .aggregation import TTN_window_aggregator
+from .dedup import TTN_uplink_dedup
+from .decoders import TtnDecodeError, compile_decoder, decode_payloads
+from .transport import (
+    TTN_circuit_breaker,
+    TTN_rate_limiter,
+    TTN_stream_decompressor,
+    TtnStorageApiError,
+    iter_chunks,
+    open_stream,
+)
+from .uplink_parser import (
+    UplinkStreamParser,
+    get_field_mask,
+    get_signal_fields,
+    uplink_from_message,
+)
+
+
+class TtnFieldRoute(NamedTuple):
+    """How the values of a field of a device are turned into entities."""
+
+    # Entity to create - None to select it from the type of the first value
+    entity_class: Optional[type]
+    # Conversion applied to every value
+    coerce: Optional[Callable[[Any], Any]]
+    # Split dict values in one entity per key
+    flatten: bool
+
+
+class TtnFieldMetadata(NamedTuple):
+    """Settings of a field from the options.
+
+    Shared by all the entities with the same settings instead of each entity
+    keeping its own copy.
+    """
+
+    name: str
+    unit_of_measurement: Optional[str]
+    device_class: Optional[str]
+    icon: Optional[str]
+    picture: Optional[str]
+    supported_features: Optional[int]
+    context_recent_time_s: float
+    # Write filter - see TTN_write_filter
+    deadband: float
+    deadband_mode: str
+    min_interval_s: float
+    only_on_change: bool
+    # Window aggregation - see TTN_window_aggregator
+    aggregate_window_s: float
+    aggregate: str
+
+
+class TtnPosition(NamedTuple):
+    """Value of a device tracker - more compact than the decoded dict."""
+
+    latitude: Optional[float]
+    longitude: Optional[float]
+    altitude: Optional[float]
 
 
 class TTN_client:
@@ -47,6 +118,10 @@ class TTN_client:
         application_id = entry.data[CONF_APP_ID]
         return TTN_client.__instances[application_id]
 
+    @staticmethod
+    def getInstanceByAppId(application_id):
+        return TTN_client.__instances.get(application_id)
+
     @staticmethod
     async def deleteInstance(hass: HomeAssistantType, entry: ConfigEntry):
         """Static access method."""
@@ -62,6 +137,19 @@ class TTN_client:
         )
 
         if unload_ok and application_id in TTN_client.__instances:
+            client = TTN_client.__instances[application_id]
+            TTN_scheduler.getInstance(hass).unregister(application_id)
+            TTN_scheduler.getInstance(hass).unregister(
+                f"{application_id} hot devices"
+            )
+            client.__remove_stop_listener()
+            await client.__stop_tasks()
+            if client.__cancel_telemetry_write is not None:
+                client.__cancel_telemetry_write()
+            if client.__session is not None:
+                # Created for this client - a reload creates a new one
+                await client.__session.close()
+                client.__session = None
             del TTN_client.__instances[application_id]
 
         return unload_ok
@@ -93,6 +181,28 @@ class TTN_client:
         else:
             return {}
 
+    def get_field_metadata(self, device_id, field_id):
+        """Settings of a field - the same instance for the same settings."""
+        field_opts = self.get_field_options(device_id, field_id)
+        metadata = TtnFieldMetadata(
+            field_opts.get(OPTIONS_FIELD_NAME, field_id),
+            field_opts.get(OPTIONS_FIELD_UNIT_MEASUREMENT, None),
+            field_opts.get(OPTIONS_FIELD_DEVICE_CLASS, None),
+            field_opts.get(OPTIONS_FIELD_ICON, None),
+            field_opts.get(OPTIONS_FIELD_PICTURE, None),
+            field_opts.get(OPTIONS_FIELD_SUPPORTED_FEATURES, None),
+            field_opts.get(OPTIONS_FIELD_CONTEXT_RECENT_TIME_S, 5),
+            field_opts.get(OPTIONS_FIELD_DEADBAND) or 0,
+            field_opts.get(
+                OPTIONS_FIELD_DEADBAND_MODE, OPTIONS_FIELD_DEADBAND_MODE_ABSOLUTE
+            ),
+            field_opts.get(OPTIONS_FIELD_MIN_INTERVAL_S) or 0,
+            field_opts.get(OPTIONS_FIELD_ONLY_ON_CHANGE, False),
+            field_opts.get(OPTIONS_FIELD_AGGREGATE_WINDOW_S) or 0,
+            field_opts.get(OPTIONS_FIELD_AGGREGATE, OPTIONS_FIELD_AGGREGATE_MEAN),
+        )
+        return self.__field_metadata.setdefault(metadata, metadata)
+
     def get_first_fetch_last_h(self):
         integration_settings = self.get_options().get(OPTIONS_MENU_EDIT_INTEGRATION, {})
         return integration_settings.get(
@@ -105,6 +215,152 @@ class TTN_client:
             OPTIONS_MENU_INTEGRATION_REFRESH_TIME_S, DEFAULT_API_REFRESH_PERIOD_S
         )
 
+    def get_replay_history(self):
+        integration_settings = self.get_options().get(OPTIONS_MENU_EDIT_INTEGRATION, {})
+        return integration_settings.get(
+            OPTIONS_MENU_INTEGRATION_REPLAY_HISTORY, DEFAULT_REPLAY_HISTORY
+        )
+
+    def get_backfill_statistics(self):
+        integration_settings = self.get_options().get(OPTIONS_MENU_EDIT_INTEGRATION, {})
+        return integration_settings.get(
+            OPTIONS_MENU_INTEGRATION_BACKFILL_STATISTICS, DEFAULT_BACKFILL_STATISTICS
+        )
+
+    def get_decoder_settings(self, device_id):
+        """Decoder and layout of the payloads of a device without decoded_payload."""
+        device_opts = self.get_device_options(device_id)
+        decoder = device_opts.get(OPTIONS_DEVICE_DECODER, OPTIONS_DECODER_DEFAULT)
+        if decoder != OPTIONS_DECODER_DEFAULT:
+            return decoder, device_opts.get(OPTIONS_DEVICE_DECODER_LAYOUT, None)
+        integration_settings = self.get_options().get(OPTIONS_MENU_EDIT_INTEGRATION, {})
+        return (
+            integration_settings.get(OPTIONS_MENU_INTEGRATION_DECODER, OPTIONS_DECODER_NONE),
+            integration_settings.get(OPTIONS_MENU_INTEGRATION_DECODER_LAYOUT, None),
+        )
+
+    def get_signal_quality(self):
+        integration_settings = self.get_options().get(OPTIONS_MENU_EDIT_INTEGRATION, {})
+        return integration_settings.get(
+            OPTIONS_MENU_INTEGRATION_SIGNAL_QUALITY, DEFAULT_SIGNAL_QUALITY
+        )
+
+    def get_adaptive_polling(self):
+        integration_settings = self.get_options().get(OPTIONS_MENU_EDIT_INTEGRATION, {})
+        return integration_settings.get(
+            OPTIONS_MENU_INTEGRATION_ADAPTIVE_POLLING, DEFAULT_ADAPTIVE_POLLING
+        )
+
+    def get_adaptive_polling_bounds_s(self):
+        integration_settings = self.get_options().get(OPTIONS_MENU_EDIT_INTEGRATION, {})
+        return (
+            integration_settings.get(
+                OPTIONS_MENU_INTEGRATION_ADAPTIVE_MIN_S, DEFAULT_ADAPTIVE_MIN_S
+            ),
+            integration_settings.get(
+                OPTIONS_MENU_INTEGRATION_ADAPTIVE_MAX_S, DEFAULT_ADAPTIVE_MAX_S
+            ),
+        )
+
+    def get_hot_refresh_period_s(self):
+        integration_settings = self.get_options().get(OPTIONS_MENU_EDIT_INTEGRATION, {})
+        return integration_settings.get(
+            OPTIONS_MENU_INTEGRATION_HOT_REFRESH_TIME_S,
+            DEFAULT_API_HOT_REFRESH_PERIOD_S,
+        )
+
+    def get_ingest_mode(self):
+        integration_settings = self.get_options().get(OPTIONS_MENU_EDIT_INTEGRATION, {})
+        return integration_settings.get(
+            OPTIONS_MENU_INTEGRATION_INGEST_MODE,
+            OPTIONS_MENU_INTEGRATION_INGEST_MODE_POLLING,
+        )
+
+    def get_mqtt_settings(self):
+        integration_settings = self.get_options().get(OPTIONS_MENU_EDIT_INTEGRATION, {})
+        return (
+            integration_settings.get(OPTIONS_MENU_INTEGRATION_MQTT_HOSTNAME)
+            or self.__hostname,
+            integration_settings.get(
+                OPTIONS_MENU_INTEGRATION_MQTT_PORT, DEFAULT_MQTT_PORT
+            ),
+            integration_settings.get(OPTIONS_MENU_INTEGRATION_MQTT_TLS, True),
+        )
+
+    def get_webhook_secret(self):
+        integration_settings = self.get_options().get(OPTIONS_MENU_EDIT_INTEGRATION, {})
+        return integration_settings.get(OPTIONS_MENU_INTEGRATION_WEBHOOK_SECRET)
+
+    @property
+    def poll_stats(self):
+        """Queue and lag statistics of the polls of this application."""
+        return TTN_scheduler.getInstance(self.__hass).get_stats().get(
+            self.__application_id
+        )
+
+    @property
+    def cadence_stats(self):
+        """Empty poll ratio and average staleness of the fetched uplinks."""
+        return self.__cadence.get_stats()
+
+    @property
+    def pipeline_stats(self):
+        """Throughput and queue depth of every stage of the ingestion pipeline."""
+        return {name: stage.get_stats() for name, stage in self.__stages.items()}
+
+    @property
+    def telemetry(self):
+        """Per fetch metrics with rolling p50/p95."""
+        return self.__telemetry
+
+    @property
+    def hot_telemetry(self):
+        """Per fetch metrics of the hot device fetches."""
+        return self.__hot_telemetry
+
+    @property
+    def backfill_stats(self):
+        """Values collected and hours imported into the long-term statistics."""
+        return self.__backfill.get_stats()
+
+    @property
+    def write_filter_stats(self):
+        """State writes passed and suppressed by the field filters."""
+        return self.__write_filter.get_stats()
+
+    @property
+    def aggregation_stats(self):
+        """Fields aggregated, samples and windows published."""
+        return self.__aggregator.get_stats()
+
+    def get_aggregate_attributes(self, unique_id):
+        """Statistics of the last window of an aggregated entity as attributes."""
+        window = self.__aggregator.get_window(unique_id)
+        if window is None:
+            return {}
+        window["window_start"] = dt_util.utc_from_timestamp(
+            window["window_start"]
+        ).isoformat()
+        return window
+
+    @property
+    def dedup_stats(self):
+        """Uplinks seen and duplicates dropped."""
+        return self.__dedup.get_stats()
+
+    @property
+    def transport_stats(self):
+        """Circuit breaker and rate limit state of the Storage API host."""
+        return {
+            **TTN_circuit_breaker.getInstance(self.__hostname).get_stats(),
+            "rate_limit": TTN_rate_limiter.getInstance(self.__hostname).get_stats(),
+        }
+
+    @property
+    def push_latency_s(self):
+        """Latency from received_at to state write of the last pushed uplink."""
+        return self.__push_latency_s
+
     @property
     def hass(self):
         return self.__hass
@@ -122,23 +378,78 @@ class TTN_client:
         LOGGER.debug(f"Creating TTN_client with application_id {self.__application_id}")
 
         self.__entities = {}
+        self.__routes = {}
+        self.__field_metadata = {}
+        self.__decoders = {}
+        self.__field_mask = None
+        self.__cadence = TTN_cadence()
+        self.__telemetry = TTN_telemetry()
+        self.__hot_telemetry = TTN_telemetry()
+        self.__telemetry_written_at = None
+        self.__cancel_telemetry_write = None
+        self.__backfill = TTN_statistics_backfill()
+        # Hour of the last import of the pushed values
+        self.__backfill_hour = None
+        self.__dedup = TTN_uplink_dedup()
+        self.__write_filter = TTN_write_filter()
+        self.__aggregator = TTN_window_aggregator()
+        self.__telemetry_entities = [
+            TtnTelemetrySensor(self, metric) for metric in TELEMETRY_METRICS
+        ]
         self.__is_connected = False
         self.__first_fetch = True
+        self.__first_fetch_done = asyncio.Event()
         self.__coordinator = None
-        self.__async_add_sensor_entities = None
-        self.__async_add_binary_sensor_entities = None
-        self.__async_add_device_tracker_entities = None
+        self.__mqtt_client = None
+        self.__push_starter = None
+        self.__session = None
+        self.__push_gap_start = None
+        self.__push_latency_s = None
+        self.__stages = {
+            PIPELINE_STAGE_PUSH: TTN_pipeline_stage(
+                PIPELINE_STAGE_PUSH, DEFAULT_PUSH_QUEUE_SIZE
+            ),
+            PIPELINE_STAGE_READER: TTN_pipeline_stage(PIPELINE_STAGE_READER),
+            PIPELINE_STAGE_PARSER: TTN_pipeline_stage(
+                PIPELINE_STAGE_PARSER, DEFAULT_PIPELINE_CHUNK_QUEUE_SIZE
+            ),
+            PIPELINE_STAGE_DECODER: TTN_pipeline_stage(PIPELINE_STAGE_DECODER),
+            PIPELINE_STAGE_DISPATCHER: TTN_pipeline_stage(
+                PIPELINE_STAGE_DISPATCHER, DEFAULT_PIPELINE_DISPATCH_QUEUE_SIZE
+            ),
+        }
+        self.__push_queue = None
+        self.__push_worker = None
+        self.__dispatch_queue = None
+        self.__dispatcher = None
+        self.__watermark = TTN_watermark()
+        self.__hot_watermarks = {}
+        # Pushed uplinks only - a fetch must still find the ones not pushed
+        self.__push_watermark = TTN_watermark()
+        self.__hot_devices = None
+        self.__store = Store(
+            hass, STORE_VERSION, STORE_KEY.format(entry_id=entry.entry_id)
+        )
+        self.__store_save_pending = False
+        # Per platform - async_add_entities once set up and entities to add
+        self.__async_add_platform_entities = {}
+        self.__pending_entities = {platform: [] for platform in COMPONENT_TYPES}
 
         # Register for entry update
         self.__update_listener_handler = entry.add_update_listener(
             TTN_client.__update_listener
         )
+        # Home Assistant waits for the tasks it created before it stops
+        self.__remove_stop_listener = hass.bus.async_listen(
+            EVENT_HOMEASSISTANT_STOP, self.__on_hass_stop
+        )
 
     def __del__(self):
         self.__disconnect()
 
     async def connect(self):
         # TBD connected
+        setup_start = time.monotonic()
 
         # Init components
         for component in COMPONENT_TYPES:
@@ -149,7 +460,13 @@ class TTN_client:
             )
 
         async def fetch_data_from_ttn():
-            await self.__fetch_data_from_ttn()
+            try:
+                await self.__fetch_data_from_ttn()
+            except TtnStorageApiError as err:
+                raise UpdateFailed(str(err)) from err
+            finally:
+                # Also after errors - push must not wait for TTN to recover
+                self.__first_fetch_done.set()
 
         # Init global settings
         self.__coordinator = DataUpdateCoordinator(
@@ -159,7 +476,8 @@ class TTN_client:
             name="The Things Network",
             update_method=fetch_data_from_ttn,
             # Polling interval. Will only be polled if there are subscribers.
-            update_interval=timedelta(seconds=self.get_refresh_period_s()),
+            # Polls are triggered by the shared TTN_scheduler
+            update_interval=None,
         )
 
         # Add dummy listener -> might change later to use it...
@@ -168,110 +486,884 @@ class TTN_client:
 
         self.__coordinator.async_add_listener(coordinator_update)
 
-        # Fetch initial data so we have data when entities subscribe
-        await self.__coordinator.async_refresh()
+        # Restore the entities and resume from the last processed uplink
+        await self.__load_store()
+        self.__start_pipeline()
+
+        # Fetch new data in the background - restored entities are available now
+        # Polls wait for the rate limit shared by the applications on the host
+        rate_limiter = TTN_rate_limiter.getInstance(self.__hostname)
+        TTN_scheduler.getInstance(self.__hass).register(
+            self.__application_id,
+            self.__get_poll_interval_s,
+            self.__coordinator.async_refresh,
+            self.__get_adaptive_poll_delay_s,
+            rate_limiter.get_delay_s,
+        )
+        TTN_scheduler.getInstance(self.__hass).register(
+            f"{self.__application_id} hot devices",
+            self.__get_hot_poll_interval_s,
+            self.__fetch_hot_devices,
+            get_defer_s=rate_limiter.get_delay_s,
+        )
+
+        # Start push ingestion once the backfill is done
+        self.__restart_push()
 
         self.__is_connected = True
+        LOGGER.info(
+            f"Setup of {self.__application_id} took {time.monotonic()-setup_start:.3f}s"
+        )
+
+    def __get_poll_interval_s(self):
+        ingest_mode = self.get_ingest_mode()
+        if ingest_mode == OPTIONS_MENU_INTEGRATION_INGEST_MODE_MQTT:
+            # Only polled for the first fetch and to backfill reconnect gaps
+            return None
+        if ingest_mode == OPTIONS_MENU_INTEGRATION_INGEST_MODE_WEBHOOK:
+            # Only polled to reconcile webhooks that TTN could not deliver
+            return DEFAULT_WEBHOOK_RECONCILIATION_PERIOD_S
+        return self.get_refresh_period_s()
+
+    def __get_adaptive_poll_delay_s(self):
+        poll_interval_s = self.__get_poll_interval_s()
+        if not self.get_adaptive_polling() or poll_interval_s is None:
+            return None
+        min_s, max_s = self.get_adaptive_polling_bounds_s()
+        return self.__cadence.get_next_delay_s(min_s, max_s)
 
-    async def __fetch_data_from_ttn(self):
+    async def __stop_push(self):
+        if self.__mqtt_client:
+            await self.__mqtt_client.disconnect()
+            self.__mqtt_client = None
+
+    def __restart_push(self):
+        if self.__push_starter is not None:
+            self.__push_starter.cancel()
+        self.__push_starter = self.__hass.async_create_task(self.__setup_push())
+
+    async def __setup_push(self):
+        """Start push ingestion once the first fetch is done.
+
+        Pushed uplinks would otherwise race the backfill for the same entities.
+        """
+        await self.__stop_push()
+        await self.__first_fetch_done.wait()
+
+        if self.get_ingest_mode() != OPTIONS_MENU_INTEGRATION_INGEST_MODE_MQTT:
+            return
+
+        # paho-mqtt is only needed in MQTT mode
+        from .mqtt_client import TTN_mqtt_client
+
+        hostname, port, use_tls = self.get_mqtt_settings()
+        self.__mqtt_client = TTN_mqtt_client(
+            self.__hass,
+            hostname,
+            port,
+            use_tls,
+            self.__application_id,
+            self.__access_key,
+            on_uplink=self.queue_push_uplink,
+            on_connected=self.__on_push_connected,
+            on_disconnected=self.__on_push_disconnected,
+        )
+        await self.__mqtt_client.connect()
+
+    async def __on_push_connected(self):
+        if self.__push_gap_start is not None:
+            # Backfill the uplinks missed while disconnected
+            TTN_scheduler.getInstance(self.__hass).poll_now(self.__application_id)
+
+    async def __on_push_disconnected(self):
+        if self.__push_gap_start is not None:
+            return
+        # The backfill resumes from the newest uplink known before the gap
+        known = [
+            watermark
+            for watermark in [self.__watermark, self.__push_watermark]
+            if watermark
+        ]
+        if known:
+            newest = max(known, key=lambda watermark: watermark.value)
+            self.__push_gap_start = TTN_watermark(newest.raw)
+        else:
+            self.__push_gap_start = TTN_watermark(dt_util.utcnow().isoformat())
+
+    async def __on_hass_stop(self, event):
+        await self.__stop_tasks()
+
+    async def __stop_tasks(self):
+        """Cancel the long running tasks of the push and the pipeline."""
+        if self.__push_starter is not None:
+            self.__push_starter.cancel()
+        await self.__stop_push()
+        self.__stop_pipeline()
+
+    def __start_pipeline(self):
+        """Start the long running stages - the fetches run their own."""
+        if self.__dispatcher is not None:
+            return
+        self.__dispatch_queue = self.__stages[PIPELINE_STAGE_DISPATCHER].open_queue()
+        self.__dispatcher = self.__hass.async_create_task(self.__run_dispatcher())
+        self.__push_queue = self.__stages[PIPELINE_STAGE_PUSH].open_queue()
+        self.__push_worker = self.__hass.async_create_task(self.__run_push_stage())
+
+    def __stop_pipeline(self):
+        for task in [self.__push_worker, self.__dispatcher]:
+            if task is not None:
+                task.cancel()
+        self.__push_worker = None
+        self.__dispatcher = None
+
+    @callback
+    def queue_push_uplink(self, message):
+        """Queue an uplink pushed by MQTT or a webhook.
+
+        Returns False if the queue is full and the uplink was dropped.
+        """
+        if self.__push_queue is None:
+            return False
+        try:
+            self.__stages[PIPELINE_STAGE_PUSH].put_nowait(self.__push_queue, message)
+        except asyncio.QueueFull:
+            LOGGER.warning(f"Push queue full for {self.__application_id}, dropping uplink")
+            return False
+        return True
+
+    async def __run_push_stage(self):
+        """Turn the pushed messages into uplinks for the dispatcher."""
+        stage = self.__stages[PIPELINE_STAGE_PUSH]
+        dispatcher = self.__stages[PIPELINE_STAGE_DISPATCHER]
+        while True:
+            message = await self.__push_queue.get()
+            start = time.monotonic()
+            try:
+                uplink = None
+                if "uplink_message" in message:
+                    uplink = uplink_from_message(message)
+                # Otherwise other message types such as join accepts
+                stage.record(start)
+
+                if uplink is None or self.__dedup.is_duplicate(uplink):
+                    continue
+                (uplink,) = await self.__decode_uplinks([uplink])
+                await dispatcher.put(self.__dispatch_queue, (None, uplink))
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pylint: disable=broad-except
+                # Keep the worker alive - a bad message must not stop the push
+                LOGGER.exception(f"Invalid pushed uplink: {message}")
+
+    async def __run_dispatcher(self):
+        """Apply the uplinks of the fetches and of the push sources in order.
+
+        Items are (fetch, uplink) - fetch is None for pushed uplinks and
+        uplink is None to mark the end of a fetch.
+        """
+        stage = self.__stages[PIPELINE_STAGE_DISPATCHER]
+        queue = self.__dispatch_queue
+        try:
+            while True:
+                fetch, uplink = await queue.get()
+                start = time.monotonic()
+                try:
+                    if fetch is None:
+                        await self.__dispatch_pushed_uplink(uplink)
+                    elif uplink is None:
+                        await self.__finish_fetch(fetch)
+                    else:
+                        await self.__dispatch_fetched_uplink(fetch, uplink)
+                except Exception:  # pylint: disable=broad-except
+                    LOGGER.exception(f"Error processing uplink: {uplink}")
+                stage.record(start)
+
+                # Do not hold the event loop while working through a backlog
+                if stage.items % DEFAULT_PIPELINE_DISPATCH_YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+        finally:
+            # Release the fetches still waiting for the dispatcher
+            while not queue.empty():
+                fetch, uplink = queue.get_nowait()
+                if fetch is not None and not fetch.done.done():
+                    fetch.done.set_result(None)
+
+    async def __dispatch_pushed_uplink(self, uplink):
+        received_at = dt_util.parse_datetime(uplink.received_at or "")
         new_entities = {}
+        statistics = self.__get_backfill()
+        await self.__process_uplink(
+            uplink, received_at, new_entities, statistics=statistics
+        )
+        self.__add_entities(new_entities.values())
+        if statistics is not None:
+            self.__import_completed_hours(statistics)
+        if self.__push_watermark.advance(received_at, uplink.received_at):
+            self.__schedule_store_save()
+
+        if received_at:
+            self.__push_latency_s = (dt_util.utcnow() - received_at).total_seconds()
+            LOGGER.debug(
+                f"Uplink from {uplink.device_id} written after {self.__push_latency_s:.3f}s"
+            )
+
+    async def __dispatch_fetched_uplink(self, fetch, uplink):
+        received_at = dt_util.parse_datetime(uplink.received_at or "")
+
+        # Skip measurements already processed - the window might overlap
+        if not self.__get_watermark(uplink.device_id).is_after(received_at):
+            return
+
+        self.__advance_watermark(uplink.device_id, received_at, uplink.received_at)
+        fetch.new_uplinks += 1
+        if received_at:
+            fetch.staleness_s += (dt_util.utcnow() - received_at).total_seconds()
+            if fetch.newest_received_at is None or received_at > fetch.newest_received_at:
+                fetch.newest_received_at = received_at
+
+        fetch.entities_updated += await self.__process_uplink(
+            uplink, received_at, fetch.new_entities, fetch.updates, fetch.statistics
+        )
+
+    async def __finish_fetch(self, fetch):
+        try:
+            LOGGER.debug(f"Parsed {fetch.lines} TTN entries")
+            if fetch.device_id is None:
+                self.__cadence.record_poll(fetch.new_uplinks, fetch.staleness_s)
+            if fetch.errors:
+                LOGGER.error(f"Skipped {fetch.errors} invalid TTN entries")
+            if fetch.duplicates:
+                LOGGER.debug(f"Skipped {fetch.duplicates} duplicated TTN entries")
+
+            if fetch.updates:
+                self.__resolve_zones(fetch.updates)
+                LOGGER.debug(f"Writing {len(fetch.updates)} coalesced states")
+                for unique_id, (value, received_at) in fetch.updates.items():
+                    entity = self.__entities[unique_id]
+                    if not is_received_after(received_at, entity.received_at):
+                        # A newer uplink was pushed while fetching
+                        continue
+                    try:
+                        await entity.async_set_state(value, received_at)
+                    except Exception:  # pylint: disable=broad-except
+                        # The other entities and the new ones are still written
+                        LOGGER.exception(f"Error writing state of {unique_id}")
+                        continue
+                    fetch.entities_updated += 1
+
+            self.__add_entities(fetch.new_entities.values())
+
+            if fetch.statistics is not None:
+                fetch.statistics.import_all(
+                    self.__hass, self.__entities, dt_util.utcnow()
+                )
+        finally:
+            self.__record_telemetry(fetch)
+            fetch.done.set_result(None)
+
+    def __import_completed_hours(self, statistics):
+        """Import the statistics once an hour rolled over.
+
+        Without polls there is no end of fetch to import them at.
+        """
+        now = dt_util.utcnow()
+        hour = statistics.get_hour(now)
+        if hour == self.__backfill_hour:
+            return
+        self.__backfill_hour = hour
+        statistics.import_all(self.__hass, self.__entities, now)
+
+    def __resolve_zones(self, updates):
+        """Resolve the zones of all trackers about to be written in one go."""
+        positions = []
+        for unique_id, (value, received_at) in updates.items():
+            if type(self.__entities[unique_id]) is TtnDataDeviceTracker:
+                position = TtnDataDeviceTracker.get_position(value)
+                if position is not None:
+                    positions.append(position)
+        if positions:
+            TTN_zone_cache.getInstance(self.__hass).resolve(positions)
+
+    def __record_telemetry(self, fetch):
+        metrics = fetch.get_metrics(dt_util.utcnow())
+        LOGGER.debug(f"Fetch of {fetch.device_id or self.__application_id}: {metrics}")
+        if fetch.device_id is not None:
+            # Kept apart - the frequent small hot fetches would skew the p50/p95
+            self.__hot_telemetry.record_fetch(metrics)
+            return
+        self.__telemetry.record_fetch(metrics)
+        self.__schedule_telemetry_write()
+
+    def __schedule_telemetry_write(self):
+        """Write the telemetry sensors at most once per interval."""
+        if self.__cancel_telemetry_write is not None:
+            # The pending write shows the latest metrics
+            return
+        delay_s = 0
+        if self.__telemetry_written_at is not None:
+            delay_s = (
+                self.__telemetry_written_at
+                + DEFAULT_TELEMETRY_WRITE_INTERVAL_S
+                - time.monotonic()
+            )
+        if delay_s <= 0:
+            self.__write_telemetry()
+            return
+
+        async def write(now):
+            self.__cancel_telemetry_write = None
+            self.__write_telemetry()
+
+        self.__cancel_telemetry_write = async_call_later(self.__hass, delay_s, write)
 
-        if self.__first_fetch:
+    def __write_telemetry(self):
+        self.__telemetry_written_at = time.monotonic()
+        for entity in self.__telemetry_entities:
+            if entity.hass:
+                entity.async_write_ha_state()
+
+    def get_telemetry_entities(self):
+        return self.__telemetry_entities
+
+    async def async_fetch(self):
+        """Fetch and process the new uplinks from the Storage API."""
+        await self.__fetch_data_from_ttn()
+
+    async def async_restore(self):
+        """Restore the entities and watermarks saved before a restart."""
+        await self.__load_store()
+
+    async def __fetch_data_from_ttn(self, device_id=None):
+        """Fetch the application - or only one hot device if device_id is given.
+
+        The response is read, parsed and dispatched by separate stages
+        connected by bounded queues, so slow state writes hold back the read
+        instead of piling up uplinks.
+        """
+        self.__start_pipeline()
+        dispatcher = self.__dispatcher
+        statistics = self.__get_backfill()
+        fetch = TTN_fetch(
+            device_id,
+            # The history goes to the statistics - only the latest value is written
+            coalesce=statistics is not None or not self.get_replay_history(),
+            statistics=statistics,
+        )
+
+        # See API docs at https://www.thethingsindustries.com/docs/reference/api/storage_integration/
+        push_gap_start = self.__push_gap_start
+        response = await self.storage_api_call(
+            self.__get_fetch_options(device_id), device_id
+        )
+        if device_id is None:
+            # Only once TTN answered - otherwise the next fetch retries it
             self.__first_fetch = False
+            if self.__push_gap_start is push_gap_start:
+                self.__push_gap_start = None
+
+        parser_stage = self.__stages[PIPELINE_STAGE_PARSER]
+        chunks = parser_stage.open_queue()
+        reader = self.__hass.async_create_task(
+            self.__read_stage(fetch, response, chunks)
+        )
+        try:
+            await self.__parse_stage(fetch, chunks)
+            await reader
+        finally:
+            if not reader.done():
+                reader.cancel()
+            parser_stage.close_queue(chunks)
+
+            # Also after errors - the entities created so far are added
+            await self.__stages[PIPELINE_STAGE_DISPATCHER].put(
+                self.__dispatch_queue, (fetch, None)
+            )
+            await asyncio.wait(
+                [fetch.done, dispatcher], return_when=asyncio.FIRST_COMPLETED
+            )
+
+    async def __read_stage(self, fetch, response, chunks):
+        """Read the response chunks for the parser - None ends the stream."""
+        stage = self.__stages[PIPELINE_STAGE_READER]
+        parser_stage = self.__stages[PIPELINE_STAGE_PARSER]
+        encoding = response.headers.get(CONTENT_ENCODING, "identity").lower()
+        decompressor = None
+        try:
+            if encoding != "identity":
+                decompressor = TTN_stream_decompressor(encoding)
+            start = time.monotonic()
+            async for chunk in iter_chunks(response, self.__hostname):
+                stage.record(start)
+                if fetch.ttfb_s is None:
+                    fetch.ttfb_s = time.monotonic() - fetch.started_at
+                fetch.wire_bytes += len(chunk)
+                if decompressor is None:
+                    fetch.bytes += len(chunk)
+                    await parser_stage.put(chunks, chunk)
+                else:
+                    for piece in decompressor.decompress(chunk):
+                        fetch.bytes += len(piece)
+                        await parser_stage.put(chunks, piece)
+                start = time.monotonic()
+            if decompressor is not None:
+                piece = decompressor.flush()
+                if piece:
+                    fetch.bytes += len(piece)
+                    await parser_stage.put(chunks, piece)
+        except asyncio.CancelledError:
+            # The parser is gone
+            raise
+        except Exception:
+            # Let the parser finish what was read so far - it is kept
+            await parser_stage.put(chunks, None)
+            raise
+        finally:
+            if decompressor is not None:
+                fetch.decompress_s += decompressor.cpu_s
+        await parser_stage.put(chunks, None)
+
+    async def __parse_stage(self, fetch, chunks):
+        """Parse the chunks read into uplinks for the dispatcher."""
+        stage = self.__stages[PIPELINE_STAGE_PARSER]
+        dispatcher = self.__stages[PIPELINE_STAGE_DISPATCHER]
+        parser = UplinkStreamParser()
+        try:
+            while True:
+                chunk = await chunks.get()
+                start = time.monotonic()
+                if chunk is None:
+                    uplinks = list(parser.close())
+                else:
+                    uplinks = list(parser.feed(chunk))
+                stage.record(start, len(uplinks))
+
+                uplinks = await self.__decode_uplinks(
+                    self.__filter_fetched_uplinks(fetch, uplinks)
+                )
+                for uplink in uplinks:
+                    await dispatcher.put(self.__dispatch_queue, (fetch, uplink))
+
+                if chunk is None:
+                    return
+        finally:
+            fetch.lines = parser.lines
+            fetch.errors = parser.errors
+
+    def __filter_fetched_uplinks(self, fetch, uplinks):
+        """Drop the uplinks of other tiers and the duplicates before decoding."""
+        hot_devices = self.__get_hot_devices() if fetch.device_id is None else ()
+        filtered = []
+        for uplink in uplinks:
+            # Hot devices are only fetched by their own tier
+            if uplink.device_id in hot_devices:
+                continue
+            if self.__dedup.is_duplicate(uplink):
+                fetch.duplicates += 1
+                continue
+            filtered.append(uplink)
+        return filtered
+
+    def __get_decoder(self, device_id):
+        """Compiled decoder of a device - None to keep the payloads undecoded."""
+        if device_id in self.__decoders:
+            return self.__decoders[device_id]
+        decoder, layout = self.get_decoder_settings(device_id)
+        try:
+            decode = compile_decoder(decoder, layout)
+        except TtnDecodeError as err:
+            LOGGER.error(f"Invalid decoder layout of {device_id}: {err}")
+            decode = None
+        self.__decoders[device_id] = decode
+        return decode
+
+    async def __decode_uplinks(self, uplinks):
+        """Decode the frm_payload of the uplinks TTN sent without decoded_payload.
+
+        Large batches, such as the chunks of a fetch, are decoded in an
+        executor so they do not hold the event loop.
+        """
+        pending = []
+        indexes = []
+        for index, uplink in enumerate(uplinks):
+            if uplink.decoded_payload is not None or not uplink.frm_payload:
+                continue
+            decode = self.__get_decoder(uplink.device_id)
+            if decode is None:
+                continue
+            pending.append((decode, uplink.frm_payload))
+            indexes.append(index)
+        if not pending:
+            return uplinks
+
+        stage = self.__stages[PIPELINE_STAGE_DECODER]
+        start = time.monotonic()
+        if len(pending) >= DEFAULT_DECODER_EXECUTOR_MIN_BATCH:
+            decoded_payloads = await self.__hass.async_add_executor_job(
+                decode_payloads, pending
+            )
+        else:
+            decoded_payloads = decode_payloads(pending)
+        stage.record(start, len(pending))
+
+        uplinks = list(uplinks)
+        for index, decoded_payload in zip(indexes, decoded_payloads):
+            if decoded_payload is None:
+                stage.errors += 1
+                LOGGER.warning(
+                    f"Could not decode payload of {uplinks[index].device_id}"
+                )
+                continue
+            uplinks[index] = uplinks[index]._replace(decoded_payload=decoded_payload)
+        return uplinks
+
+    async def __fetch_hot_devices(self):
+        for device_id in sorted(self.__get_hot_devices()):
+            try:
+                await self.__fetch_data_from_ttn(device_id)
+            except TtnStorageApiError as err:
+                LOGGER.error(f"Fetch of hot device {device_id} failed: {err}")
+
+    def __get_hot_devices(self):
+        if self.__hot_devices is None:
+            devices = self.get_options().get(OPTIONS_MENU_EDIT_DEVICES, {})
+            self.__hot_devices = frozenset(
+                device_id
+                for device_id, device_opts in devices.items()
+                if device_opts.get(OPTIONS_DEVICE_HOT, False)
+            )
+        return self.__hot_devices
+
+    def __get_hot_poll_interval_s(self):
+        if not self.__get_hot_devices() or self.__get_poll_interval_s() is None:
+            return None
+        return self.get_hot_refresh_period_s()
+
+    def __get_watermark(self, device_id):
+        """Each tier has its own watermark so they never apply an uplink twice.
+
+        Only the fetched uplinks move them - pushed ones would hide the
+        uplinks TTN could not push from the next fetch.
+        """
+        if device_id in self.__get_hot_devices():
+            watermark = self.__hot_watermarks.get(device_id)
+            if watermark is None:
+                # Newly hot - continue where the application tier is
+                watermark = TTN_watermark(self.__watermark.raw)
+                self.__hot_watermarks[device_id] = watermark
+            return watermark
+        return self.__watermark
+
+    def __get_field_mask(self):
+        """Only request the parts of the uplinks the enabled features use."""
+        if self.__field_mask is None:
+            integration_settings = self.get_options().get(
+                OPTIONS_MENU_EDIT_INTEGRATION, {}
+            )
+            devices = self.get_options().get(OPTIONS_MENU_EDIT_DEVICES, {})
+            decoders = {
+                integration_settings.get(
+                    OPTIONS_MENU_INTEGRATION_DECODER, OPTIONS_DECODER_NONE
+                )
+            }
+            decoders.update(
+                device_opts.get(OPTIONS_DEVICE_DECODER, OPTIONS_DECODER_DEFAULT)
+                for device_opts in devices.values()
+            )
+            self.__field_mask = quote(
+                get_field_mask(
+                    frm_payload=bool(
+                        decoders - {OPTIONS_DECODER_NONE, OPTIONS_DECODER_DEFAULT}
+                    ),
+                    rx_metadata=self.get_signal_quality(),
+                ),
+                safe=",",
+            )
+        return self.__field_mask
+
+    def __get_fetch_options(self, device_id=None):
+        if device_id is None:
+            first_fetch = self.__first_fetch
+            refresh_period_s = self.get_refresh_period_s()
+        else:
+            # The application fetches leave out hot devices, so a hot device
+            # with nothing fetched yet needs its own first fetch window
+            first_fetch = not self.__get_watermark(device_id)
+            refresh_period_s = self.get_hot_refresh_period_s()
+        watermark = self.__get_watermark(device_id)
+        if (
+            first_fetch
+            and self.__push_watermark
+            and self.__push_watermark.is_after(watermark.value)
+        ):
+            # The uplinks pushed before a restart need not be fetched again
+            watermark = self.__push_watermark
+        elif device_id is None and self.__push_gap_start is not None:
+            # Backfill the uplinks missed while the push connection was down
+            watermark = self.__push_gap_start
+            LOGGER.info(f"Backfill of ttn data after push reconnect: {watermark.raw}")
+
+        # Do not resume from a watermark older than the first fetch window
+        if watermark and (
+            dt_util.utcnow() - watermark.value
+            < timedelta(hours=self.get_first_fetch_last_h())
+        ):
+            # Fetch new measurements since the last processed one
+            LOGGER.debug(f"Fetch of ttn data after: {watermark.raw}")
+            return (
+                f"?after={quote(watermark.raw)}&order=received_at"
+                f"&field_mask={self.__get_field_mask()}"
+            )
+
+        if first_fetch or watermark:
             fetch_last = f"{self.get_first_fetch_last_h()}h"
             LOGGER.info(f"First fetch of tth data: {fetch_last}")
         else:
-            # Fetch new measurements since last time (with an extra minute margin)
-            fetch_last = f"{self.get_refresh_period_s()+60}s"
+            # Nothing received yet - fetch since last time (with an extra minute margin)
+            fetch_last = f"{refresh_period_s+60}s"
             LOGGER.debug(f"Fetch of ttn data: {fetch_last}")
-
-        # Discover entities
-        # See API docs at https://www.thethingsindustries.com/docs/reference/api/storage_integration/
-        measurements = await self.storage_api_call(
+        return (
             f"?last={fetch_last}&order=received_at"
+            f"&field_mask={self.__get_field_mask()}"
         )
-        async for measurement_raw in measurements:
-            # Skip empty lines not containing a result
-            if len(measurement_raw) < len("result"):
-                continue
 
-            LOGGER.debug(f"TTN entry: {measurement_raw}")
+    def __advance_watermark(self, device_id, received_at, received_at_raw):
+        if self.__get_watermark(device_id).advance(received_at, received_at_raw):
+            self.__schedule_store_save()
 
-            # Parse line with json dictionary
-            measurement_json = json.loads(measurement_raw)
+    def __get_backfill(self):
+        """The statistics backfill if enabled - None otherwise."""
+        if self.get_backfill_statistics():
+            return self.__backfill
+        return None
 
-            if "result" not in measurement_json:
-                LOGGER.error(f"TTN entry without result: {measurement_json}")
+    def entity_added(self, entity):
+        """Import the statistics collected before the entity had an entity_id."""
+        self.__backfill.import_entity(self.__hass, entity, dt_util.utcnow())
+
+    def entity_updated(self):
+        """Persist the entity catalog after an entity got a new value."""
+        self.__schedule_store_save()
+
+    def __schedule_store_save(self):
+        # Each call restarts the delay - only arm it once per save, so the
+        # catalog is saved even if values keep coming
+        if self.__store_save_pending:
+            return
+        self.__store_save_pending = True
+        self.__store.async_delay_save(self.__get_store_data, STORE_SAVE_DELAY_S)
+
+    async def __load_store(self):
+        data = await self.__store.async_load()
+        if not data:
+            return
+
+        self.__watermark = TTN_watermark(data.get(STORE_WATERMARK))
+        self.__push_watermark = TTN_watermark(data.get(STORE_PUSH_WATERMARK))
+        self.__hot_watermarks = {
+            device_id: TTN_watermark(raw)
+            for device_id, raw in data.get(STORE_HOT_WATERMARKS, {}).items()
+        }
+        LOGGER.debug(f"Restored watermark {self.__watermark.raw}")
+
+        # Restore the entities known before the restart
+        entities = []
+        for device_id, field_id, entity_type, value, received_at in data.get(
+            STORE_ENTITIES, []
+        ):
+            entity_class = TTN_ENTITY_CLASSES.get(entity_type)
+            unique_id = TtnDataEntity.get_unique_id(device_id, field_id)
+            if entity_class is None or unique_id in self.__entities:
                 continue
+            entities.append(
+                entity_class(self, device_id, field_id, value, received_at)
+            )
+        LOGGER.debug(f"Restored {len(entities)} entities")
+        self.__add_entities(entities)
 
-            measurement = measurement_json["result"]
+    def __get_store_data(self):
+        self.__store_save_pending = False
+        return {
+            STORE_WATERMARK: self.__watermark.raw,
+            STORE_PUSH_WATERMARK: self.__push_watermark.raw,
+            STORE_HOT_WATERMARKS: {
+                device_id: watermark.raw
+                for device_id, watermark in self.__hot_watermarks.items()
+            },
+            STORE_ENTITIES: [
+                [
+                    entity.device_id,
+                    entity.field_id,
+                    entity.ENTITY_TYPE,
+                    # Positions as plain lists for the JSON encoder
+                    list(entity._state)
+                    if isinstance(entity._state, tuple)
+                    else entity._state,
+                    entity.received_at,
+                ]
+                for entity in self.__entities.values()
+            ],
+        }
 
-            # Get device_id and uplink_message from measurement
-            device_id = measurement["end_device_ids"]["device_id"]
-            uplink_message = measurement["uplink_message"]
+    async def __process_uplink(
+        self, uplink, received_at, new_entities, updates=None, statistics=None
+    ):
+        """Update or create the entities for one uplink.
 
-            # Skip not decoded measurements
-            if not "decoded_payload" in uplink_message:
-                continue
+        received_at is the parsed uplink.received_at. If updates is given the
+        new values are collected there, keyed by unique_id, instead of being
+        written to the existing entities. If statistics is given the numeric
+        values are also added to its hourly buckets. Returns the number of
+        states written.
+        """
+        device_id = uplink.device_id
 
-            for field_id, value in uplink_message["decoded_payload"].items():
-                if value is None:
-                    continue
+        if received_at and device_id not in self.__get_hot_devices():
+            self.__cadence.record_uplink(device_id, received_at.timestamp())
 
-                async def process(field_id, value):
-                    unique_id = TtnDataSensor.get_unique_id(device_id, field_id)
-                    if unique_id not in self.__entities:
-                        # Create
-                        if type(value) == bool:
-                            # Binary Sensor
-                            new_entities[unique_id] = TtnDataBinarySensor(
-                                self, device_id, field_id, value
-                            )
-                        elif type(value) == dict:
-                            # GPS
-                            new_entities[unique_id] = TtnDataDeviceTracker(
-                                self, device_id, field_id, value
-                            )
-                        else:
-                            # Sensor
-                            new_entities[unique_id] = TtnDataSensor(
-                                self, device_id, field_id, value
-                            )
-                    else:
-                        # Update value in existing entitity
-                        await self.__entities[unique_id].async_set_state(value)
-
-                async def process_gps(field_id, value):
-                    # position = {}
-                    # map_value = map_value_re.findall(value)
-                    # for (key,value) in map_value:
-                    #    position[key] = float(value)
-                    # await process(field_id, position)
-                    await process(field_id, value)
-
-                entity_type = self.get_field_options(device_id, field_id).get(
-                    OPTIONS_FIELD_ENTITY_TYPE, None
+        payload = uplink.decoded_payload
+        if uplink.rx_metadata and self.get_signal_quality():
+            payload = {**(payload or {}), **get_signal_fields(uplink.rx_metadata)}
+
+        # Skip not decoded measurements
+        if payload is None:
+            return 0
+
+        hour = None
+        if statistics is not None and received_at is not None:
+            hour = statistics.get_hour(received_at)
+        timestamp = received_at.timestamp() if received_at else None
+
+        written = 0
+        routes = self.__routes
+        for field_id, value in payload.items():
+            if value is None:
+                continue
+
+            route = routes.get((device_id, field_id))
+            if route is None:
+                route = self.__compile_route(device_id, field_id)
+
+            if route.coerce is not None:
+                value = route.coerce(value)
+
+            if route.flatten and type(value) is dict:
+                # Other - such as accelerator
+                for key, value_item in value.items():
+                    written += await self.__apply_value(
+                        device_id,
+                        f"{field_id}_{key}",
+                        value_item,
+                        uplink.received_at,
+                        None,
+                        new_entities,
+                        updates,
+                        statistics,
+                        hour,
+                        timestamp,
+                    )
+            else:
+                written += await self.__apply_value(
+                    device_id,
+                    field_id,
+                    value,
+                    uplink.received_at,
+                    route.entity_class,
+                    new_entities,
+                    updates,
+                    statistics,
+                    hour,
+                    timestamp,
                 )
-                if entity_type == OPTIONS_FIELD_ENTITY_TYPE_SENSOR:
-                    await process(field_id, value)
-                elif entity_type == OPTIONS_FIELD_ENTITY_TYPE_BINARY_SENSOR:
-                    await process(field_id, bool(value))
-                elif entity_type == OPTIONS_FIELD_ENTITY_TYPE_DEVICE_TRACKER:
-                    await process_gps(field_id, value)
-                else:
-                    if type(value) is dict:
-                        if "gps" in field_id:
-                            # GPS
-                            await process_gps(field_id, value)
-                        else:
-                            # Other - such as accelerator
-                            for key, value_item in value.items():
-                                await process(f"{field_id}_{key}", value_item)
-                    else:
-                        # Regular sensor
-                        await process(field_id, value)
+        return written
 
-        self.__add_entities(new_entities.values())
+    def __compile_route(self, device_id, field_id):
+        """Resolve the field options of a field once, until options change."""
+        entity_type = self.get_field_options(device_id, field_id).get(
+            OPTIONS_FIELD_ENTITY_TYPE, None
+        )
+        if entity_type == OPTIONS_FIELD_ENTITY_TYPE_SENSOR:
+            route = TtnFieldRoute(TtnDataSensor, None, False)
+        elif entity_type == OPTIONS_FIELD_ENTITY_TYPE_BINARY_SENSOR:
+            route = TtnFieldRoute(TtnDataBinarySensor, bool, False)
+        elif entity_type == OPTIONS_FIELD_ENTITY_TYPE_DEVICE_TRACKER:
+            route = TtnFieldRoute(TtnDataDeviceTracker, None, False)
+        else:
+            # Auto - dicts other than GPS are split in one sensor per key
+            route = TtnFieldRoute(None, None, "gps" not in field_id)
+
+        self.__routes[(device_id, field_id)] = route
+        return route
+
+    async def __apply_value(
+        self,
+        device_id,
+        field_id,
+        value,
+        received_at,
+        entity_class,
+        new_entities,
+        updates,
+        statistics=None,
+        hour=None,
+        timestamp=None,
+    ):
+        """Returns 1 if the state was written, 0 if created, collected or filtered.
+
+        timestamp is received_at in seconds, for the minimum write interval.
+        """
+        unique_id = TtnDataEntity.get_unique_id(device_id, field_id)
+        if hour is not None and type(value) in (int, float):
+            statistics.add(unique_id, hour, value)
+
+        if unique_id in new_entities:
+            # Created earlier in this fetch - keep latest value
+            entity = new_entities[unique_id]
+            entity._state = entity.compact_value(value)
+            entity.received_at = received_at
+        elif unique_id not in self.__entities:
+            # Create
+            if entity_class is None:
+                if type(value) == bool:
+                    # Binary Sensor
+                    entity_class = TtnDataBinarySensor
+                elif type(value) == dict:
+                    # GPS
+                    entity_class = TtnDataDeviceTracker
+                else:
+                    # Sensor
+                    entity_class = TtnDataSensor
+            new_entities[unique_id] = entity_class(
+                self, device_id, field_id, value, received_at
+            )
+        else:
+            entity = self.__entities[unique_id]
+            if not is_received_after(received_at, entity.received_at):
+                # Older than the state - such as a backfill behind the pushes
+                return 0
+            field = entity.field_metadata
+            if field.aggregate_window_s and type(value) in (int, float):
+                if not self.__aggregator.add(
+                    unique_id,
+                    field.aggregate_window_s,
+                    value,
+                    time.time() if timestamp is None else timestamp,
+                ):
+                    # Accumulated until its window is complete
+                    return 0
+                value = self.__aggregator.get_value(unique_id, field.aggregate)
+            if TTN_write_filter.is_enabled(field) and not self.__write_filter.accept(
+                unique_id, field, value, timestamp, entity._state
+            ):
+                # No new information
+                return 0
+            if updates is not None:
+                # Coalesce - only the latest value is written
+                updates[unique_id] = (entity.compact_value(value), received_at)
+            else:
+                # Update value in existing entitity
+                await entity.async_set_state(value, received_at)
+                return 1
+        return 0
 
     @staticmethod
     async def __update_listener(hass, entry):
@@ -281,28 +1373,46 @@ class TTN_client:
         self.__hass = hass
         self.__entry = entry
 
-        if self.__coordinator:
-            self.__coordinator.update_interval = timedelta(
-                seconds=self.get_refresh_period_s()
-            )
+        # Field and device options might have changed
+        self.__routes = {}
+        self.__field_metadata = {}
+        self.__decoders = {}
+        self.__field_mask = None
+        self.__hot_devices = None
+
+        # Refresh data - the poll interval might have changed too
+        self.__first_fetch = True
+        self.__first_fetch_done.clear()
+        TTN_scheduler.getInstance(hass).poll_now(self.__application_id)
+        TTN_scheduler.getInstance(hass).poll_now(
+            f"{self.__application_id} hot devices"
+        )
+
+        # Ingest mode or MQTT settings might have changed
+        self.__restart_push()
 
+        # After the restarts - a failing entity must not stop the ingestion
         for entitiy in self.__entities.values():
             await entitiy.refresh_options()
 
-        # Refresh data
-        self.__first_fetch = True
-        await self.__coordinator.async_request_refresh()
-
     def __disconnect(self):
         # TBD
         self.__is_connected = False
 
     def __add_entities(self, entities=[]):
+        added = 0
         for entity in entities:
-            assert entity.unique_id not in self.__entities
+            if entity.unique_id in self.__entities:
+                # Created meanwhile by a pushed uplink - that one is newer
+                continue
             self.__entities[entity.unique_id] = entity
+            self.__pending_entities[entity.ENTITY_TYPE].append(entity)
+            added += 1
 
-        self.add_entities()
+        if added:
+            # New entities for the catalog
+            self.__schedule_store_save()
+            self.__flush_pending_entities()
 
     def add_entities(
         self,
@@ -310,45 +1420,30 @@ class TTN_client:
         async_add_binary_sensor_entities=None,
         async_add_device_tracker_entities=None,
     ):
-        if async_add_sensor_entities:
-            # Remember handling for dynamic adds later
-            self.__async_add_sensor_entities = async_add_sensor_entities
-
-        if async_add_binary_sensor_entities:
-            # Remember handling for dynamic adds later
-            self.__async_add_binary_sensor_entities = async_add_binary_sensor_entities
-
-        if async_add_device_tracker_entities:
-            # Remember handling for dynamic adds later
-            self.__async_add_device_tracker_entities = async_add_device_tracker_entities
-
-        sensors_to_be_added = []
-        binary_sensors_to_be_added = []
-        device_tracker_to_be_added = []
-        for entity in self.__entities.values():
-            if entity.to_be_added:
-                if self.__async_add_sensor_entities and (type(entity) == TtnDataSensor):
-                    sensors_to_be_added.append(entity)
-                    entity.to_be_added = False
-                if self.__async_add_binary_sensor_entities and (
-                    type(entity) == TtnDataBinarySensor
-                ):
-                    binary_sensors_to_be_added.append(entity)
-                    entity.to_be_added = False
-                if self.__async_add_device_tracker_entities and (
-                    type(entity) == TtnDataDeviceTracker
-                ):
-                    device_tracker_to_be_added.append(entity)
-                    entity.to_be_added = False
-
-        if self.__async_add_sensor_entities:
-            self.__async_add_sensor_entities(sensors_to_be_added, True)
+        """Remember the async_add_entities of a platform once it is set up.
 
-        if self.__async_add_binary_sensor_entities:
-            self.__async_add_binary_sensor_entities(binary_sensors_to_be_added, True)
-
-        if self.__async_add_device_tracker_entities:
-            self.__async_add_device_tracker_entities(device_tracker_to_be_added, True)
+        Entities found before are added then, later ones as they are found.
+        """
+        for platform, async_add_entities in [
+            (TtnDataSensor.ENTITY_TYPE, async_add_sensor_entities),
+            (TtnDataBinarySensor.ENTITY_TYPE, async_add_binary_sensor_entities),
+            (TtnDataDeviceTracker.ENTITY_TYPE, async_add_device_tracker_entities),
+        ]:
+            if async_add_entities:
+                self.__async_add_platform_entities[platform] = async_add_entities
+
+        self.__flush_pending_entities()
+
+    def __flush_pending_entities(self):
+        # One batch per platform - only the new entities are visited
+        for platform, async_add_entities in self.__async_add_platform_entities.items():
+            pending = self.__pending_entities[platform]
+            if not pending:
+                continue
+            for entity in pending:
+                entity.to_be_added = False
+            self.__pending_entities[platform] = []
+            async_add_entities(pending, True)
 
     async def remove_all_entities(self):
         for entity in self.__entities.values():
@@ -363,64 +1458,78 @@ class TTN_client:
                 unload_ok = await entitiy.async_remove() and unload_ok
         return unload_ok
 
-    async def storage_api_call(self, options):
-        url = TTN_DATA_STORAGE_URL.format(
-            app_id=self.__application_id, hostname=self.__hostname, options=options
-        )
+    async def storage_api_call(self, options, device_id=None):
+        """Open the Storage API stream - the caller reads the response."""
+        if device_id is None:
+            url = TTN_DATA_STORAGE_URL.format(
+                app_id=self.__application_id, hostname=self.__hostname, options=options
+            )
+        else:
+            url = TTN_DATA_STORAGE_DEVICE_URL.format(
+                app_id=self.__application_id,
+                device_id=device_id,
+                hostname=self.__hostname,
+                options=options,
+            )
         LOGGER.debug(f"URL: {url}")
         headers = {
             ACCEPT: "text/event-stream",
+            ACCEPT_ENCODING: "gzip, deflate",
             AUTHORIZATION: f"Bearer {self.__access_key}",
         }
 
-        try:
-            session = async_get_clientsession(self.__hass)
-            with async_timeout.timeout(DEFAULT_TIMEOUT):
-                response = await session.get(url, headers=headers)
-
-        except (asyncio.TimeoutError, aiohttp.ClientError):
-            LOGGER.error("Error while accessing: %s", url)
-            return None
-
-        status = response.status
-
-        if status == 401:
-            LOGGER.error("Not authorized for Application ID: %s", self.__application_id)
-            return None
-
-        if status == 404:
-            LOGGER.error("Application ID is not available: %s", self.__application_id)
-            return None
+        # The body is decompressed by the read stage to count the bytes on the wire
+        if self.__session is None:
+            self.__session = async_create_clientsession(
+                self.__hass, auto_decompress=False
+            )
 
-        return response.content
+        # Raises TtnStorageApiError if TTN cannot be reached after retries
+        return await open_stream(self.__session, self.__hostname, url, headers)
 
 
 class TtnDataEntity(Entity):
     """Representation of a The Things Network Data Storage sensor."""
 
+    # Home Assistant's Entity has a __dict__ but the attributes of every
+    # TTN entity are kept in slots - large fleets have many of them
+    __slots__ = (
+        "__client",
+        "__device_id",
+        "__field_id",
+        "__unique_id",
+        "__device_name",
+        "__field",
+        "_state",
+        "received_at",
+        "to_be_added",
+        "to_be_removed",
+    )
+
     @staticmethod
     def get_unique_id(device_id, field_id):
         return f"{device_id}_{field_id}"
 
-    def __init__(self, client: TTN_client, device_id, field_id, state=None):
+    @staticmethod
+    def compact_value(value):
+        """Representation in which the entity keeps a value."""
+        return value
+
+    def __init__(
+        self, client: TTN_client, device_id, field_id, state=None, received_at=None
+    ):
         """Initialize a The Things Network Data Storage sensor."""
         self.__client = client
-        self.__device_id = device_id
-        self.__field_id = field_id
-        self._state = state
+        # Shared by the entities of the same device and field
+        self.__device_id = sys.intern(device_id)
+        self.__field_id = sys.intern(field_id)
+        self._state = self.compact_value(state)
+        self.received_at = received_at
 
         self.__unique_id = self.get_unique_id(self.__device_id, self.__field_id)
         self.to_be_added = True
         self.to_be_removed = False
 
-        # Values from options
-        self._unit_of_measurement = None
-        self.__device_class = None
-        self.__icon = None
-        self.__picture = None
-        self.__supported_features = None
-        self.__context_recent_time_s = 5
-
         self.__refresh_names()
 
     # ---------------
@@ -442,7 +1551,7 @@ class TtnDataEntity(Entity):
     @property
     def name(self) -> Optional[str]:
         """Return the name of the entity."""
-        return self.__name
+        return f"{self.__device_name} {self.__field.name}"
 
     @property
     def state(self):
@@ -481,12 +1590,8 @@ class TtnDataEntity(Entity):
 
     @property
     def extra_state_attributes(self) -> Optional[Dict[str, Any]]:
-        """Return device specific state attributes.
-
-        Implemented by platform classes. Convention for attribute names
-        is lowercase snake_case.
-        """
-        return {}
+        """Return the statistics of the last window of an aggregated field."""
+        return self.__client.get_aggregate_attributes(self.__unique_id)
 
     @property
     def device_info(self) -> Optional[Dict[str, Any]]:
@@ -510,17 +1615,17 @@ class TtnDataEntity(Entity):
     @property
     def device_class(self) -> Optional[str]:
         """Return the class of this device, from component DEVICE_CLASSES."""
-        return self.__device_class
+        return self.__field.device_class
 
     @property
     def icon(self) -> Optional[str]:
         """Return the icon to use in the frontend, if any."""
-        return self.__icon
+        return self.__field.icon
 
     @property
     def entity_picture(self) -> Optional[str]:
         """Return the entity picture to use in the frontend, if any."""
-        return self.__picture
+        return self.__field.picture
 
     @property
     def available(self) -> bool:
@@ -544,12 +1649,12 @@ class TtnDataEntity(Entity):
     @property
     def supported_features(self) -> Optional[int]:
         """Flag supported features."""
-        return self.__supported_features
+        return self.__field.supported_features
 
     @property
     def context_recent_time(self) -> timedelta:
         """Time that a context is considered recent."""
-        return timedelta(seconds=self.__context_recent_time_s)
+        return timedelta(seconds=self.__field.context_recent_time_s)
 
     @property
     def entity_registry_enabled_default(self) -> bool:
@@ -571,58 +1676,76 @@ class TtnDataEntity(Entity):
     def field_id(self):
         return self.__field_id
 
-    async def async_set_state(self, value):
+    @property
+    def field_metadata(self):
+        return self.__field
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
+        self.__client.entity_added(self)
+
+    async def async_set_state(self, value, received_at=None):
+        self.received_at = received_at
+        self.__client.entity_updated()
         if self.hass:
-            self._state = value
-            await self.async_write_ha_state()
+            self._state = self.compact_value(value)
+            self.async_write_ha_state()
 
     def __refresh_names(self):
-        device_name = self.__device_id
-        field_name = self.__field_id
-
         # Device options
         device_opts = self.__client.get_device_options(self.__device_id)
-        device_name = device_opts.get(OPTIONS_DEVICE_NAME, device_name)
+        self.__device_name = device_opts.get(OPTIONS_DEVICE_NAME, self.__device_id)
 
         # Field options
-        field_opts = self.__client.get_field_options(self.__device_id, self.__field_id)
-        field_name = field_opts.get(OPTIONS_FIELD_NAME, field_name)
-        self._unit_of_measurement = field_opts.get(OPTIONS_FIELD_UNIT_MEASUREMENT, None)
-        self.__device_class = field_opts.get(OPTIONS_FIELD_DEVICE_CLASS, None)
-        self.__icon = field_opts.get(OPTIONS_FIELD_ICON, None)
-        self.__picture = field_opts.get(OPTIONS_FIELD_PICTURE, None)
-        self.__supported_features = field_opts.get(
-            OPTIONS_FIELD_SUPPORTED_FEATURES, None
-        )
-        self.__context_recent_time_s = field_opts.get(
-            OPTIONS_FIELD_CONTEXT_RECENT_TIME_S, 5
+        self.__field = self.__client.get_field_metadata(
+            self.__device_id, self.__field_id
         )
 
-        self.__device_name = device_name
-        self.__field_name = field_name
-        self.__name = f"{device_name} {field_name}"
-
     async def refresh_options(self):
         self.__refresh_names()
 
-        await self.async_write_ha_state()
+        if self.hass:
+            self.async_write_ha_state()
 
-        device_registry = await dr.async_get_registry(self.__client.hass)
+        device_registry = dr.async_get(self.__client.hass)
         device_registry.async_get_or_create(
             config_entry_id=self.__client.entry.entry_id, **self.device_info
         )
 
 
 class TtnDataSensor(TtnDataEntity):
+    __slots__ = ()
+
+    ENTITY_TYPE = "sensor"
+
     @property
     def unit_of_measurement(self) -> Optional[str]:
         """Return the unit of measurement of this entity, if any."""
-        return self._unit_of_measurement
+        return self.field_metadata.unit_of_measurement
+
+    @property
+    def state_class(self) -> Optional[str]:
+        """Numeric values are measurements, with long-term statistics."""
+        if type(self._state) in (int, float):
+            return SensorStateClass.MEASUREMENT
+        return None
+
+    @property
+    def capability_attributes(self) -> Optional[Dict[str, Any]]:
+        """Return the state class for the statistics."""
+        state_class = self.state_class
+        if state_class is None:
+            return {}
+        return {ATTR_STATE_CLASS: state_class}
 
 
 class TtnDataBinarySensor(TtnDataEntity):
     """Represent a binary sensor."""
 
+    __slots__ = ()
+
+    ENTITY_TYPE = "binary_sensor"
+
     @property
     def is_on(self):
         """Return true if the binary sensor is on."""
@@ -635,6 +1758,26 @@ class TtnDataBinarySensor(TtnDataEntity):
 
 
 class TtnDataDeviceTracker(TtnDataSensor):
+    # (zone cache generation, position, state)
+    __slots__ = ("__zone",)
+
+    ENTITY_TYPE = "device_tracker"
+
+    def __init__(self, *args, **kwargs):
+        self.__zone = None
+        super().__init__(*args, **kwargs)
+
+    @staticmethod
+    def compact_value(value):
+        if value is None or isinstance(value, TtnPosition):
+            return value
+        if isinstance(value, dict):
+            return TtnPosition(
+                value.get("latitude"), value.get("longitude"), value.get("altitude")
+            )
+        # Restored from .storage, where it is saved as a list
+        return TtnPosition(*value)
+
     @property
     def location_accuracy(self):
         """Return the location accuracy of the device.
@@ -651,17 +1794,24 @@ class TtnDataDeviceTracker(TtnDataSensor):
     @property
     def latitude(self) -> float:
         """Return latitude value of the device."""
-        return self._state["latitude"]
+        return self._state.latitude
 
     @property
     def longitude(self) -> float:
         """Return longitude value of the device."""
-        return self._state["longitude"]
+        return self._state.longitude
 
     @property
     def altitude(self) -> float:
         """Return altitude value of the device."""
-        return self._state["altitude"]
+        return self._state.altitude
+
+    @staticmethod
+    def get_position(value):
+        """(latitude, longitude, accuracy) of a TtnPosition - None if no fix."""
+        if value is not None and value.latitude is not None and value.latitude > 0:
+            return (value.latitude, value.longitude, 0)
+        return None
 
     @property
     def state(self):
@@ -669,19 +1819,18 @@ class TtnDataDeviceTracker(TtnDataSensor):
         if self.location_name:
             return self.location_name
 
-        if self._state["latitude"] > 0:
-            zone_state = zone.async_active_zone(
-                self.hass, self.latitude, self.longitude, self.location_accuracy
-            )
-            if zone_state is None:
-                state = STATE_NOT_HOME
-            elif zone_state.entity_id == zone.ENTITY_ID_HOME:
-                state = STATE_HOME
-            else:
-                state = zone_state.name
-            return state
+        position = self.get_position(self._state)
+        if position is None:
+            return None
 
-        return None
+        # Cached until the tracker moves or the zones change
+        zones = TTN_zone_cache.getInstance(self.hass)
+        cached = self.__zone
+        if cached and cached[0] == zones.generation and cached[1] == position:
+            return cached[2]
+        state = zones.get_state(position)
+        self.__zone = (zones.generation, position, state)
+        return state
 
     @property
     def state_attributes(self):
@@ -705,3 +1854,9 @@ class TtnDataDeviceTracker(TtnDataSensor):
             # ATTR_RAW: self._state["raw"],
             # ATTR_TIME: self._state["time"],
         }
+
+
+TTN_ENTITY_CLASSES = {
+    entity_class.ENTITY_TYPE: entity_class
+    for entity_class in [TtnDataSensor, TtnDataBinarySensor, TtnDataDeviceTracker]
+}
@@ -13,7 +13,7 @@ print(__name__)
 
 from .const import *
 from .TTN_client import TTN_client
-
+from .webhook import TtnWebhookView
 
 
 CONFIG_SCHEMA = vol.Schema(
@@ -48,6 +48,8 @@ async def async_setup(hass, config):
     #         )
     #     )
 
+    hass.http.register_view(TtnWebhookView())
+
     return True
 
 
@@ -0,0 +1,136 @@
+"""Windowed aggregation of the numeric fields sent at a high rate."""
+from array import array
+
+from .const import *
+
+
+class TTN_window_aggregator:
+    """Running min, max, mean and last value of fields over time windows.
+
+    Windows are aligned to multiples of their length on received_at. The
+    values of a window are only accumulated; the window is published when
+    the first value of a later window arrives, and the chosen aggregate then
+    becomes the state. Every field is a slot in a few arrays of doubles
+    instead of Python objects, so thousands of fields stay cheap.
+    """
+
+    def __init__(self):
+        # unique_id -> index in the arrays
+        self.__slots = {}
+
+        # Window being accumulated
+        self.__start = array("d")
+        self.__count = array("d")
+        self.__sum = array("d")
+        self.__min = array("d")
+        self.__max = array("d")
+        self.__last = array("d")
+
+        # Last published window
+        self.__published_start = array("d")
+        self.__published_count = array("d")
+        self.__published_mean = array("d")
+        self.__published_min = array("d")
+        self.__published_max = array("d")
+        self.__published_last = array("d")
+
+        self.samples = 0
+        self.windows = 0
+
+    def __columns(self):
+        return (
+            self.__start,
+            self.__count,
+            self.__sum,
+            self.__min,
+            self.__max,
+            self.__last,
+            self.__published_start,
+            self.__published_count,
+            self.__published_mean,
+            self.__published_min,
+            self.__published_max,
+            self.__published_last,
+        )
+
+    def __reset(self, index, start):
+        self.__start[index] = start
+        self.__count[index] = 0
+        self.__sum[index] = 0
+
+    def add(self, unique_id, window_s, value, timestamp):
+        """Add a value received at timestamp (seconds).
+
+        Returns True if this closed the previous window of the field, which
+        is then published.
+        """
+        self.samples += 1
+        start = timestamp - timestamp % window_s
+        index = self.__slots.get(unique_id)
+        published = False
+        if index is None:
+            index = self.__slots[unique_id] = len(self.__start)
+            for column in self.__columns():
+                column.append(0.0)
+            self.__reset(index, start)
+        elif start > self.__start[index]:
+            if self.__count[index]:
+                self.__publish(index)
+                published = True
+            self.__reset(index, start)
+        # Values late for their window are added to the current one
+
+        count = self.__count[index]
+        if not count or value < self.__min[index]:
+            self.__min[index] = value
+        if not count or value > self.__max[index]:
+            self.__max[index] = value
+        self.__count[index] = count + 1
+        self.__sum[index] += value
+        self.__last[index] = value
+        return published
+
+    def __publish(self, index):
+        self.windows += 1
+        count = self.__count[index]
+        self.__published_start[index] = self.__start[index]
+        self.__published_count[index] = count
+        self.__published_mean[index] = self.__sum[index] / count
+        self.__published_min[index] = self.__min[index]
+        self.__published_max[index] = self.__max[index]
+        self.__published_last[index] = self.__last[index]
+
+    def get_value(self, unique_id, aggregate):
+        """The aggregate of the last published window of a field."""
+        index = self.__slots[unique_id]
+        if aggregate == OPTIONS_FIELD_AGGREGATE_MIN:
+            return self.__published_min[index]
+        if aggregate == OPTIONS_FIELD_AGGREGATE_MAX:
+            return self.__published_max[index]
+        if aggregate == OPTIONS_FIELD_AGGREGATE_LAST:
+            return self.__published_last[index]
+        return self.__published_mean[index]
+
+    def get_window(self, unique_id):
+        """Statistics of the last published window - None if there is none."""
+        index = self.__slots.get(unique_id)
+        if index is None or not self.__published_count[index]:
+            return None
+        return {
+            "window_start": self.__published_start[index],
+            "count": int(self.__published_count[index]),
+            "mean": self.__published_mean[index],
+            "min": self.__published_min[index],
+            "max": self.__published_max[index],
+            "last": self.__published_last[index],
+        }
+
+    def get_stats(self):
+        return {
+            "fields": len(self.__slots),
+            "samples": self.samples,
+            "windows": self.windows,
+            "array_bytes": sum(
+                len(column) * column.itemsize for column in self.__columns()
+            ),
+        }
@@ -0,0 +1,101 @@
+"""Backfill of the fetched history into the recorder long-term statistics."""
+from datetime import timedelta
+
+from homeassistant.components.recorder.statistics import async_import_statistics
+
+from . import LOGGER
+
+HOUR = timedelta(hours=1)
+
+
+class TTN_statistics_backfill:
+    """Hourly mean, min and max of the numeric values fetched per entity.
+
+    Writing every fetched value as a state is slow and records it at the
+    write time. Instead the values are bucketed by the hour of their
+    received_at and imported as statistics once the hour is complete and the
+    entity has an entity_id. Only the latest value is written as state.
+    """
+
+    def __init__(self):
+        # unique_id -> {hour start: [sum, count, min, max]}
+        self.__buckets = {}
+
+        self.values = 0
+        self.imported_hours = 0
+
+    @staticmethod
+    def get_hour(received_at):
+        """Start of the statistics hour of a received_at datetime."""
+        return received_at.replace(minute=0, second=0, microsecond=0)
+
+    def add(self, unique_id, hour, value):
+        self.values += 1
+        buckets = self.__buckets.setdefault(unique_id, {})
+        bucket = buckets.get(hour)
+        if bucket is None:
+            buckets[hour] = [value, 1, value, value]
+        else:
+            bucket[0] += value
+            bucket[1] += 1
+            if value < bucket[2]:
+                bucket[2] = value
+            if value > bucket[3]:
+                bucket[3] = value
+
+    def import_entity(self, hass, entity, now):
+        """Import the complete hours of an entity, once it has an entity_id."""
+        buckets = self.__buckets.get(entity.unique_id)
+        if not buckets or entity.entity_id is None:
+            return
+        if "recorder" not in hass.config.components:
+            LOGGER.warning("Statistics backfill needs the recorder")
+            self.__buckets.clear()
+            return
+
+        # The current hour is still being filled
+        hours = sorted(hour for hour in buckets if hour + HOUR <= now)
+        if not hours:
+            return
+
+        statistics = []
+        for hour in hours:
+            value_sum, count, value_min, value_max = buckets.pop(hour)
+            statistics.append(
+                {
+                    "start": hour,
+                    "mean": value_sum / count,
+                    "min": value_min,
+                    "max": value_max,
+                }
+            )
+        if not buckets:
+            del self.__buckets[entity.unique_id]
+
+        metadata = {
+            "has_mean": True,
+            "has_sum": False,
+            "name": entity.name,
+            "source": "recorder",
+            "statistic_id": entity.entity_id,
+            "unit_of_measurement": entity.unit_of_measurement,
+        }
+        async_import_statistics(hass, metadata, statistics)
+        self.imported_hours += len(statistics)
+        LOGGER.debug(f"Imported {len(statistics)} hours of {entity.entity_id}")
+
+    def import_all(self, hass, entities, now):
+        for unique_id in list(self.__buckets):
+            entity = entities.get(unique_id)
+            if entity is None:
+                # Removed
+                del self.__buckets[unique_id]
+            else:
+                self.import_entity(hass, entity, now)
+
+    def get_stats(self):
+        return {
+            "values": self.values,
+            "pending_entities": len(self.__buckets),
+            "imported_hours": self.imported_hours,
+        }
@@ -0,0 +1,87 @@
+"""Learn the uplink cadence of the devices of an application."""
+from collections import deque
+import statistics
+
+from .const import *
+from .telemetry import percentile
+
+
+class TTN_cadence:
+    """Track the inter-arrival times of the uplinks of each device.
+
+    Used by the adaptive polling to poll as often as the devices send instead
+    of at a fixed period.
+    """
+
+    def __init__(self):
+        # device_id -> (last received_at timestamp, recent intervals)
+        self.__devices = {}
+
+        self.polls = 0
+        self.empty_polls = 0
+        self.__staleness_s = 0.0
+        self.__uplinks = 0
+
+    def record_uplink(self, device_id, received_at_ts):
+        device = self.__devices.get(device_id)
+        if device is None:
+            self.__devices[device_id] = (
+                received_at_ts,
+                deque(maxlen=DEFAULT_ADAPTIVE_SAMPLES),
+            )
+            return
+
+        last_ts, intervals = device
+        if received_at_ts <= last_ts:
+            # Duplicated or out of order
+            return
+        intervals.append(received_at_ts - last_ts)
+        self.__devices[device_id] = (received_at_ts, intervals)
+
+    def record_poll(self, uplinks, staleness_s):
+        """Record a poll with its new uplinks and their summed staleness.
+
+        The staleness of an uplink is the time from received_at until it was
+        fetched.
+        """
+        self.polls += 1
+        if uplinks == 0:
+            self.empty_polls += 1
+        self.__uplinks += uplinks
+        self.__staleness_s += staleness_s
+
+    def get_next_delay_s(self, min_s, max_s):
+        """Seconds until the next poll, from the typical cadence of the devices.
+
+        The median interval of each device is taken, and of those the
+        DEFAULT_ADAPTIVE_PERCENTILE, so one fast device does not set the pace
+        of the application. Returns None while no device has sent enough
+        uplinks to estimate it.
+        """
+        intervals_s = sorted(
+            interval_s
+            for interval_s in (
+                statistics.median(intervals)
+                for _last_ts, intervals in self.__devices.values()
+                if intervals
+            )
+            if interval_s > 0
+        )
+        if not intervals_s:
+            return None
+
+        delay_s = percentile(intervals_s, DEFAULT_ADAPTIVE_PERCENTILE)
+        return min(max(delay_s, min_s), max_s)
+
+    def get_stats(self):
+        return {
+            "devices": len(self.__devices),
+            "polls": self.polls,
+            "empty_polls": self.empty_polls,
+            "empty_poll_ratio": round(self.empty_polls / self.polls, 3)
+            if self.polls
+            else None,
+            "average_staleness_s": round(self.__staleness_s / self.__uplinks, 3)
+            if self.__uplinks
+            else None,
+        }
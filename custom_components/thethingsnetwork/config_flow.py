@@ -1,12 +1,14 @@
 from collections import OrderedDict
 import voluptuous as vol
 import copy
+import secrets
 from homeassistant import data_entry_flow
 from homeassistant import config_entries
 import homeassistant.helpers.config_validation as cv
 from homeassistant.config_entries import ConfigEntry
 
 from .const import *
+from .decoders import TtnDecodeError, compile_struct_layout
 from .TTN_client import TTN_client
 
 
@@ -71,6 +73,19 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
     def get_field_ids(self):
         return self.client.get_field_ids()
 
+    @staticmethod
+    def _validate_decoder_layout(decoder, layout, field):
+        """Form errors of the layout of a decoder - empty if it is valid."""
+        if decoder != OPTIONS_DECODER_STRUCT:
+            return {}
+        if not layout:
+            return {field: "decoder_layout_missing"}
+        try:
+            compile_struct_layout(layout)
+        except TtnDecodeError:
+            return {field: "invalid_decoder_layout"}
+        return {}
+
     def _update_entry(self, title="", data=None):
         """Update entry."""
         if data:
@@ -111,7 +126,15 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
             OPTIONS_MENU_EDIT_INTEGRATION, {}
         )
 
+        errors = {}
         if user_input is not None:
+            errors = self._validate_decoder_layout(
+                user_input[OPTIONS_MENU_INTEGRATION_DECODER],
+                user_input.get(OPTIONS_MENU_INTEGRATION_DECODER_LAYOUT),
+                OPTIONS_MENU_INTEGRATION_DECODER_LAYOUT,
+            )
+
+        if user_input is not None and not errors:
             # Update options
             integration_settings[OPTIONS_MENU_INTEGRATION_FIRST_FETCH_TIME_H] = user_input[
                 OPTIONS_MENU_INTEGRATION_FIRST_FETCH_TIME_H
@@ -119,6 +142,48 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
             integration_settings[OPTIONS_MENU_INTEGRATION_REFRESH_TIME_S] = user_input[
                 OPTIONS_MENU_INTEGRATION_REFRESH_TIME_S
             ]
+            integration_settings[OPTIONS_MENU_INTEGRATION_HOT_REFRESH_TIME_S] = user_input[
+                OPTIONS_MENU_INTEGRATION_HOT_REFRESH_TIME_S
+            ]
+            integration_settings[OPTIONS_MENU_INTEGRATION_REPLAY_HISTORY] = user_input[
+                OPTIONS_MENU_INTEGRATION_REPLAY_HISTORY
+            ]
+            integration_settings[OPTIONS_MENU_INTEGRATION_BACKFILL_STATISTICS] = user_input[
+                OPTIONS_MENU_INTEGRATION_BACKFILL_STATISTICS
+            ]
+            integration_settings[OPTIONS_MENU_INTEGRATION_SIGNAL_QUALITY] = user_input[
+                OPTIONS_MENU_INTEGRATION_SIGNAL_QUALITY
+            ]
+            integration_settings[OPTIONS_MENU_INTEGRATION_DECODER] = user_input[
+                OPTIONS_MENU_INTEGRATION_DECODER
+            ]
+            integration_settings[OPTIONS_MENU_INTEGRATION_DECODER_LAYOUT] = user_input.get(
+                OPTIONS_MENU_INTEGRATION_DECODER_LAYOUT, None
+            )
+            integration_settings[OPTIONS_MENU_INTEGRATION_ADAPTIVE_POLLING] = user_input[
+                OPTIONS_MENU_INTEGRATION_ADAPTIVE_POLLING
+            ]
+            integration_settings[OPTIONS_MENU_INTEGRATION_ADAPTIVE_MIN_S] = user_input[
+                OPTIONS_MENU_INTEGRATION_ADAPTIVE_MIN_S
+            ]
+            integration_settings[OPTIONS_MENU_INTEGRATION_ADAPTIVE_MAX_S] = user_input[
+                OPTIONS_MENU_INTEGRATION_ADAPTIVE_MAX_S
+            ]
+            integration_settings[OPTIONS_MENU_INTEGRATION_INGEST_MODE] = user_input[
+                OPTIONS_MENU_INTEGRATION_INGEST_MODE
+            ]
+            integration_settings[OPTIONS_MENU_INTEGRATION_WEBHOOK_SECRET] = user_input[
+                OPTIONS_MENU_INTEGRATION_WEBHOOK_SECRET
+            ]
+            integration_settings[OPTIONS_MENU_INTEGRATION_MQTT_HOSTNAME] = user_input.get(
+                OPTIONS_MENU_INTEGRATION_MQTT_HOSTNAME, None
+            )
+            integration_settings[OPTIONS_MENU_INTEGRATION_MQTT_PORT] = user_input[
+                OPTIONS_MENU_INTEGRATION_MQTT_PORT
+            ]
+            integration_settings[OPTIONS_MENU_INTEGRATION_MQTT_TLS] = user_input[
+                OPTIONS_MENU_INTEGRATION_MQTT_TLS
+            ]
 
             # Return update
             return self._update_entry(self.options)
@@ -130,6 +195,64 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
         refresh_time_s = integration_settings.setdefault(
             OPTIONS_MENU_INTEGRATION_REFRESH_TIME_S, DEFAULT_API_REFRESH_PERIOD_S
         )
+        hot_refresh_time_s = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_HOT_REFRESH_TIME_S,
+            DEFAULT_API_HOT_REFRESH_PERIOD_S,
+        )
+        replay_history = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_REPLAY_HISTORY, DEFAULT_REPLAY_HISTORY
+        )
+        backfill_statistics = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_BACKFILL_STATISTICS, DEFAULT_BACKFILL_STATISTICS
+        )
+        signal_quality = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_SIGNAL_QUALITY, DEFAULT_SIGNAL_QUALITY
+        )
+        decoder = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_DECODER, OPTIONS_DECODER_NONE
+        )
+        decoder_layout = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_DECODER_LAYOUT, None
+        )
+        if errors:
+            # Show the layout to correct
+            decoder_layout = user_input.get(OPTIONS_MENU_INTEGRATION_DECODER_LAYOUT)
+        adaptive_polling = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_ADAPTIVE_POLLING, DEFAULT_ADAPTIVE_POLLING
+        )
+        adaptive_min_s = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_ADAPTIVE_MIN_S, DEFAULT_ADAPTIVE_MIN_S
+        )
+        adaptive_max_s = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_ADAPTIVE_MAX_S, DEFAULT_ADAPTIVE_MAX_S
+        )
+        ingest_mode = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_INGEST_MODE,
+            OPTIONS_MENU_INTEGRATION_INGEST_MODE_POLLING,
+        )
+        webhook_secret = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_WEBHOOK_SECRET, secrets.token_urlsafe(32)
+        )
+        mqtt_hostname = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_MQTT_HOSTNAME, None
+        )
+        mqtt_port = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_MQTT_PORT, DEFAULT_MQTT_PORT
+        )
+        mqtt_tls = integration_settings.setdefault(
+            OPTIONS_MENU_INTEGRATION_MQTT_TLS, True
+        )
+
+        decoders = [
+            OPTIONS_DECODER_NONE,
+            OPTIONS_DECODER_CAYENNE_LPP,
+            OPTIONS_DECODER_STRUCT,
+        ]
+        ingest_modes = [
+            OPTIONS_MENU_INTEGRATION_INGEST_MODE_POLLING,
+            OPTIONS_MENU_INTEGRATION_INGEST_MODE_MQTT,
+            OPTIONS_MENU_INTEGRATION_INGEST_MODE_WEBHOOK,
+        ]
 
         # Return form
         fields = OrderedDict()
@@ -143,9 +266,75 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
                 OPTIONS_MENU_INTEGRATION_REFRESH_TIME_S, default=refresh_time_s
             )
         ] = int
+        fields[
+            vol.Required(
+                OPTIONS_MENU_INTEGRATION_HOT_REFRESH_TIME_S, default=hot_refresh_time_s
+            )
+        ] = int
+        fields[
+            vol.Required(
+                OPTIONS_MENU_INTEGRATION_REPLAY_HISTORY, default=replay_history
+            )
+        ] = bool
+        fields[
+            vol.Required(
+                OPTIONS_MENU_INTEGRATION_BACKFILL_STATISTICS,
+                default=backfill_statistics,
+            )
+        ] = bool
+        fields[
+            vol.Required(
+                OPTIONS_MENU_INTEGRATION_SIGNAL_QUALITY, default=signal_quality
+            )
+        ] = bool
+        fields[
+            vol.Required(OPTIONS_MENU_INTEGRATION_DECODER, default=decoder)
+        ] = vol.In(decoders)
+        fields[
+            vol.Optional(
+                OPTIONS_MENU_INTEGRATION_DECODER_LAYOUT,
+                description={"suggested_value": decoder_layout},
+            )
+        ] = str
+        fields[
+            vol.Required(
+                OPTIONS_MENU_INTEGRATION_ADAPTIVE_POLLING, default=adaptive_polling
+            )
+        ] = bool
+        fields[
+            vol.Required(
+                OPTIONS_MENU_INTEGRATION_ADAPTIVE_MIN_S, default=adaptive_min_s
+            )
+        ] = int
+        fields[
+            vol.Required(
+                OPTIONS_MENU_INTEGRATION_ADAPTIVE_MAX_S, default=adaptive_max_s
+            )
+        ] = int
+        fields[
+            vol.Required(OPTIONS_MENU_INTEGRATION_INGEST_MODE, default=ingest_mode)
+        ] = vol.In(ingest_modes)
+        fields[
+            vol.Required(
+                OPTIONS_MENU_INTEGRATION_WEBHOOK_SECRET, default=webhook_secret
+            )
+        ] = str
+        fields[
+            vol.Optional(
+                OPTIONS_MENU_INTEGRATION_MQTT_HOSTNAME,
+                description={"suggested_value": mqtt_hostname},
+            )
+        ] = str
+        fields[
+            vol.Required(OPTIONS_MENU_INTEGRATION_MQTT_PORT, default=mqtt_port)
+        ] = int
+        fields[
+            vol.Required(OPTIONS_MENU_INTEGRATION_MQTT_TLS, default=mqtt_tls)
+        ] = bool
         return self.async_show_form(
             step_id="integration_settings",
             data_schema=vol.Schema(fields),
+            errors=errors,
         )
 
     async def async_step_device_select(self, user_input=None):
@@ -179,23 +368,60 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
             OPTIONS_MENU_EDIT_DEVICES, {}
         ).setdefault(self.selected_device, {})
 
+        errors = {}
         if user_input is not None:
+            errors = self._validate_decoder_layout(
+                user_input[OPTIONS_DEVICE_DECODER],
+                user_input.get(OPTIONS_DEVICE_DECODER_LAYOUT),
+                OPTIONS_DEVICE_DECODER_LAYOUT,
+            )
+
+        if user_input is not None and not errors:
             # Update options
             device_options[OPTIONS_DEVICE_NAME] = user_input[OPTIONS_DEVICE_NAME]
+            device_options[OPTIONS_DEVICE_HOT] = user_input[OPTIONS_DEVICE_HOT]
+            device_options[OPTIONS_DEVICE_DECODER] = user_input[OPTIONS_DEVICE_DECODER]
+            device_options[OPTIONS_DEVICE_DECODER_LAYOUT] = user_input.get(
+                OPTIONS_DEVICE_DECODER_LAYOUT, None
+            )
 
             # Return update
             return self._update_entry(self.options)
 
         # Get config for device
         name = device_options.setdefault(OPTIONS_DEVICE_NAME, self.selected_device)
+        hot = device_options.setdefault(OPTIONS_DEVICE_HOT, False)
+        decoder = device_options.setdefault(
+            OPTIONS_DEVICE_DECODER, OPTIONS_DECODER_DEFAULT
+        )
+        decoder_layout = device_options.setdefault(OPTIONS_DEVICE_DECODER_LAYOUT, None)
+        if errors:
+            # Show the layout to correct
+            decoder_layout = user_input.get(OPTIONS_DEVICE_DECODER_LAYOUT)
+
+        decoders = [
+            OPTIONS_DECODER_DEFAULT,
+            OPTIONS_DECODER_NONE,
+            OPTIONS_DECODER_CAYENNE_LPP,
+            OPTIONS_DECODER_STRUCT,
+        ]
 
         # Return form
         fields = OrderedDict()
         fields[vol.Required(OPTIONS_DEVICE_NAME, default=name)] = str
+        fields[vol.Required(OPTIONS_DEVICE_HOT, default=hot)] = bool
+        fields[vol.Required(OPTIONS_DEVICE_DECODER, default=decoder)] = vol.In(decoders)
+        fields[
+            vol.Optional(
+                OPTIONS_DEVICE_DECODER_LAYOUT,
+                description={"suggested_value": decoder_layout},
+            )
+        ] = str
         return self.async_show_form(
             step_id="device_edit",
             description_placeholders={OPTIONS_SELECTED_DEVICE: self.selected_device},
             data_schema=vol.Schema(fields),
+            errors=errors,
         )
 
     async def async_step_field_select(self, user_input=None):
@@ -260,6 +486,24 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
             field_options[OPTIONS_FIELD_CONTEXT_RECENT_TIME_S] = user_input.get(
                 OPTIONS_FIELD_CONTEXT_RECENT_TIME_S
             )
+            field_options[OPTIONS_FIELD_DEADBAND] = user_input.get(
+                OPTIONS_FIELD_DEADBAND
+            )
+            field_options[OPTIONS_FIELD_DEADBAND_MODE] = user_input.get(
+                OPTIONS_FIELD_DEADBAND_MODE
+            )
+            field_options[OPTIONS_FIELD_MIN_INTERVAL_S] = user_input.get(
+                OPTIONS_FIELD_MIN_INTERVAL_S
+            )
+            field_options[OPTIONS_FIELD_ONLY_ON_CHANGE] = user_input.get(
+                OPTIONS_FIELD_ONLY_ON_CHANGE
+            )
+            field_options[OPTIONS_FIELD_AGGREGATE_WINDOW_S] = user_input.get(
+                OPTIONS_FIELD_AGGREGATE_WINDOW_S
+            )
+            field_options[OPTIONS_FIELD_AGGREGATE] = user_input.get(
+                OPTIONS_FIELD_AGGREGATE
+            )
 
             # For auto type remove option
             if (
@@ -298,6 +542,18 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
         context_recent_time_s = field_options.setdefault(
             OPTIONS_FIELD_CONTEXT_RECENT_TIME_S, 5
         )
+        deadband = field_options.setdefault(OPTIONS_FIELD_DEADBAND, 0)
+        deadband_mode = field_options.setdefault(
+            OPTIONS_FIELD_DEADBAND_MODE, OPTIONS_FIELD_DEADBAND_MODE_ABSOLUTE
+        )
+        min_interval_s = field_options.setdefault(OPTIONS_FIELD_MIN_INTERVAL_S, 0)
+        only_on_change = field_options.setdefault(OPTIONS_FIELD_ONLY_ON_CHANGE, False)
+        aggregate_window_s = field_options.setdefault(
+            OPTIONS_FIELD_AGGREGATE_WINDOW_S, 0
+        )
+        aggregate = field_options.setdefault(
+            OPTIONS_FIELD_AGGREGATE, OPTIONS_FIELD_AGGREGATE_MEAN
+        )
 
         entity_types = [
             OPTIONS_FIELD_ENTITY_TYPE_AUTO,
@@ -349,6 +605,31 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
                 OPTIONS_FIELD_CONTEXT_RECENT_TIME_S, default=context_recent_time_s
             )
         ] = int
+        fields[vol.Required(OPTIONS_FIELD_DEADBAND, default=deadband)] = vol.Coerce(
+            float
+        )
+        fields[
+            vol.Required(OPTIONS_FIELD_DEADBAND_MODE, default=deadband_mode)
+        ] = vol.In(
+            [OPTIONS_FIELD_DEADBAND_MODE_ABSOLUTE, OPTIONS_FIELD_DEADBAND_MODE_RELATIVE]
+        )
+        fields[
+            vol.Required(OPTIONS_FIELD_MIN_INTERVAL_S, default=min_interval_s)
+        ] = int
+        fields[
+            vol.Required(OPTIONS_FIELD_ONLY_ON_CHANGE, default=only_on_change)
+        ] = bool
+        fields[
+            vol.Required(OPTIONS_FIELD_AGGREGATE_WINDOW_S, default=aggregate_window_s)
+        ] = int
+        fields[vol.Required(OPTIONS_FIELD_AGGREGATE, default=aggregate)] = vol.In(
+            [
+                OPTIONS_FIELD_AGGREGATE_MEAN,
+                OPTIONS_FIELD_AGGREGATE_MIN,
+                OPTIONS_FIELD_AGGREGATE_MAX,
+                OPTIONS_FIELD_AGGREGATE_LAST,
+            ]
+        )
         return self.async_show_form(
             step_id="field_edit",
             description_placeholders={OPTIONS_SELECTED_FIELD: self.selected_field},
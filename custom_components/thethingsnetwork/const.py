@@ -10,14 +10,69 @@ CONF_FOUND_DEVICES = "devices"
 DOMAIN = "thethingsnetwork"
 
 DEFAULT_TIMEOUT = 10
+DEFAULT_IDLE_READ_TIMEOUT_S = 30
+DEFAULT_FETCH_DEADLINE_S = 5 * 60
+DEFAULT_RETRY_ATTEMPTS = 3
+DEFAULT_RETRY_BACKOFF_S = 2
+DEFAULT_RETRY_MAX_BACKOFF_S = 30
+DEFAULT_CIRCUIT_BREAKER_FAILURES = 5
+DEFAULT_CIRCUIT_BREAKER_OPEN_S = 2 * 60
+DEFAULT_RATE_LIMIT_BURST = 10
+DEFAULT_RATE_LIMIT_PER_S = 1
+DEFAULT_RATE_LIMIT_MAX_WAIT_S = 60
+DEFAULT_RATE_LIMIT_RETRY_S = 30
 DEFAULT_API_REFRESH_PERIOD_S = 5 * 60
+DEFAULT_API_HOT_REFRESH_PERIOD_S = 30
 DEFAULT_FIRST_FETCH_LAST_H = 48
+DEFAULT_REPLAY_HISTORY = False
+DEFAULT_BACKFILL_STATISTICS = False
+DEFAULT_SIGNAL_QUALITY = False
+DEFAULT_ADAPTIVE_POLLING = False
+DEFAULT_ADAPTIVE_MIN_S = 60
+DEFAULT_ADAPTIVE_MAX_S = 60 * 60
+# Percentile of the device cadences the adaptive polling follows
+DEFAULT_ADAPTIVE_PERCENTILE = 0.5
+DEFAULT_ADAPTIVE_SAMPLES = 8
+DEFAULT_SCHEDULER_MAX_CONCURRENT_POLLS = 4
+DEFAULT_SCHEDULER_JITTER = 0.2
+DEFAULT_PUSH_QUEUE_SIZE = 1000
+DEFAULT_PIPELINE_CHUNK_QUEUE_SIZE = 8
+DEFAULT_PIPELINE_DISPATCH_QUEUE_SIZE = 1000
+DEFAULT_PIPELINE_DISPATCH_YIELD_EVERY = 100
+DEFAULT_TELEMETRY_SAMPLES = 100
+DEFAULT_TELEMETRY_WRITE_INTERVAL_S = 60
+DEFAULT_ZONE_CACHE_SIZE = 4096
+DEFAULT_DECODER_EXECUTOR_MIN_BATCH = 32
+DEFAULT_DEDUP_DEVICE_WINDOW = 64
+DEFAULT_DECOMPRESS_CHUNK_SIZE = 64 * 1024
+DEFAULT_WEBHOOK_RECONCILIATION_PERIOD_S = 60 * 60
+DEFAULT_MQTT_PORT = 8883
+DEFAULT_MQTT_RECONNECT_MAX_DELAY_S = 120
 
 TTN_API_HOSTNAME = "eu1.cloud.thethings.network"
 TTN_DATA_STORAGE_URL = "https://{hostname}/api/v3/as/applications/{app_id}/packages/storage/uplink_message{options}"
+TTN_DATA_STORAGE_DEVICE_URL = "https://{hostname}/api/v3/as/applications/{app_id}/devices/{device_id}/packages/storage/uplink_message{options}"
+WEBHOOK_URL = "/api/thethingsnetwork/webhook/{app_id}"
+WEBHOOK_SECRET_HEADER = "X-Webhook-Secret"
+TTN_MQTT_USERNAME = "{app_id}@ttn"
+TTN_MQTT_TOPIC_UPLINK = "v3/{app_id}/devices/+/up"
+
+STORE_KEY = "thethingsnetwork.{entry_id}"
+STORE_VERSION = 1
+STORE_SAVE_DELAY_S = 30
+STORE_WATERMARK = "watermark"
+STORE_HOT_WATERMARKS = "hot_watermarks"
+STORE_PUSH_WATERMARK = "push_watermark"
+STORE_ENTITIES = "entities"
 
 COMPONENT_TYPES = ["sensor", "binary_sensor", "device_tracker"]
 
+PIPELINE_STAGE_PUSH = "push"
+PIPELINE_STAGE_READER = "reader"
+PIPELINE_STAGE_PARSER = "parser"
+PIPELINE_STAGE_DECODER = "decoder"
+PIPELINE_STAGE_DISPATCHER = "dispatcher"
+
 # Init menu
 OPTIONS_SELECTED_MENU = "selected_menu"
 OPTIONS_MENU_EDIT_INTEGRATION = "integration settings"
@@ -29,8 +84,33 @@ OPTIONS_SELECTED_FIELD = "selected_field"
 # Global settings
 OPTIONS_MENU_INTEGRATION_FIRST_FETCH_TIME_H = "first_fetch_time"
 OPTIONS_MENU_INTEGRATION_REFRESH_TIME_S = "refresh_time"
+OPTIONS_MENU_INTEGRATION_HOT_REFRESH_TIME_S = "hot_refresh_time"
+OPTIONS_MENU_INTEGRATION_REPLAY_HISTORY = "replay_history"
+OPTIONS_MENU_INTEGRATION_BACKFILL_STATISTICS = "backfill_statistics"
+OPTIONS_MENU_INTEGRATION_SIGNAL_QUALITY = "signal_quality"
+OPTIONS_MENU_INTEGRATION_DECODER = "decoder"
+OPTIONS_MENU_INTEGRATION_DECODER_LAYOUT = "decoder_layout"
+OPTIONS_MENU_INTEGRATION_ADAPTIVE_POLLING = "adaptive_polling"
+OPTIONS_MENU_INTEGRATION_ADAPTIVE_MIN_S = "adaptive_min_time"
+OPTIONS_MENU_INTEGRATION_ADAPTIVE_MAX_S = "adaptive_max_time"
+OPTIONS_MENU_INTEGRATION_INGEST_MODE = "ingest_mode"
+OPTIONS_MENU_INTEGRATION_INGEST_MODE_POLLING = "polling"
+OPTIONS_MENU_INTEGRATION_INGEST_MODE_MQTT = "mqtt"
+OPTIONS_MENU_INTEGRATION_INGEST_MODE_WEBHOOK = "webhook"
+OPTIONS_MENU_INTEGRATION_WEBHOOK_SECRET = "webhook_secret"
+OPTIONS_MENU_INTEGRATION_MQTT_HOSTNAME = "mqtt_hostname"
+OPTIONS_MENU_INTEGRATION_MQTT_PORT = "mqtt_port"
+OPTIONS_MENU_INTEGRATION_MQTT_TLS = "mqtt_tls"
 # Device settings
 OPTIONS_DEVICE_NAME = "name"
+OPTIONS_DEVICE_HOT = "hot"
+OPTIONS_DEVICE_DECODER = "decoder"
+OPTIONS_DEVICE_DECODER_LAYOUT = "decoder_layout"
+# Local payload decoders
+OPTIONS_DECODER_DEFAULT = "default"
+OPTIONS_DECODER_NONE = "none"
+OPTIONS_DECODER_CAYENNE_LPP = "cayenne_lpp"
+OPTIONS_DECODER_STRUCT = "struct"
 # Field settings
 OPTIONS_FIELD_NAME = "name"
 OPTIONS_FIELD_ENTITY_TYPE = "entity_type"
@@ -44,6 +124,18 @@ OPTIONS_FIELD_ICON = "icon"
 OPTIONS_FIELD_PICTURE = "picture"
 OPTIONS_FIELD_SUPPORTED_FEATURES = "supported_features"
 OPTIONS_FIELD_CONTEXT_RECENT_TIME_S = "context_recent_time_s"
+OPTIONS_FIELD_DEADBAND = "deadband"
+OPTIONS_FIELD_DEADBAND_MODE = "deadband_mode"
+OPTIONS_FIELD_DEADBAND_MODE_ABSOLUTE = "absolute"
+OPTIONS_FIELD_DEADBAND_MODE_RELATIVE = "relative"
+OPTIONS_FIELD_MIN_INTERVAL_S = "min_interval_s"
+OPTIONS_FIELD_ONLY_ON_CHANGE = "only_on_change"
+OPTIONS_FIELD_AGGREGATE_WINDOW_S = "aggregate_window_s"
+OPTIONS_FIELD_AGGREGATE = "aggregate"
+OPTIONS_FIELD_AGGREGATE_MEAN = "mean"
+OPTIONS_FIELD_AGGREGATE_MIN = "min"
+OPTIONS_FIELD_AGGREGATE_MAX = "max"
+OPTIONS_FIELD_AGGREGATE_LAST = "last"
 OPTIONS_FIELD_DEVICE_SCOPE = "device_scope"
 OPTIONS_FIELD_DEVICE_SCOPE_GLOBAL = "GLOBAL"
 
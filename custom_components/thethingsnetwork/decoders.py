@@ -0,0 +1,164 @@
+"""Local decoding of the frm_payload of uplinks without decoded_payload."""
+import base64
+import binascii
+import struct
+from typing import Callable, List, Optional
+
+from .const import *
+
+
+class TtnDecodeError(ValueError):
+    """A payload does not match its decoder."""
+
+
+# Cayenne LPP data types: type -> (name, size, signed, scale)
+CAYENNE_LPP_TYPES = {
+    0: ("digital_in", 1, False, 1),
+    1: ("digital_out", 1, False, 1),
+    2: ("analog_in", 2, True, 100),
+    3: ("analog_out", 2, True, 100),
+    101: ("luminosity", 2, False, 1),
+    102: ("presence", 1, False, 1),
+    103: ("temperature", 2, True, 10),
+    104: ("relative_humidity", 1, False, 2),
+    115: ("barometric_pressure", 2, False, 10),
+}
+CAYENNE_LPP_ACCELEROMETER = 113
+CAYENNE_LPP_GYROMETER = 134
+CAYENNE_LPP_GPS = 136
+
+# struct codes of the numeric values a layout entry can have, and padding
+STRUCT_VALUE_CODES = "bBhHiIlLqQefd"
+STRUCT_PADDING_CODE = "x"
+
+
+def decode_cayenne_lpp(payload: bytes) -> dict:
+    """Decode a Cayenne LPP payload.
+
+    Fields are named {type}_{channel} like the Cayenne LPP formatter of TTN,
+    so switching from the formatter to local decoding keeps the entities.
+    """
+    decoded = {}
+    index = 0
+    size = len(payload)
+    try:
+        while index < size:
+            channel = payload[index]
+            lpp_type = payload[index + 1]
+            index += 2
+
+            if lpp_type in CAYENNE_LPP_TYPES:
+                name, length, signed, scale = CAYENNE_LPP_TYPES[lpp_type]
+                raw = payload[index : index + length]
+                if len(raw) != length:
+                    raise TtnDecodeError(f"Truncated {name} on channel {channel}")
+                value = int.from_bytes(raw, "big", signed=signed)
+                decoded[f"{name}_{channel}"] = value / scale if scale != 1 else value
+            elif lpp_type in (CAYENNE_LPP_ACCELEROMETER, CAYENNE_LPP_GYROMETER):
+                name = (
+                    "accelerometer"
+                    if lpp_type == CAYENNE_LPP_ACCELEROMETER
+                    else "gyrometer"
+                )
+                scale = 1000 if lpp_type == CAYENNE_LPP_ACCELEROMETER else 100
+                x, y, z = struct.unpack_from(">hhh", payload, index)
+                length = 6
+                decoded[f"{name}_{channel}"] = {
+                    "x": x / scale,
+                    "y": y / scale,
+                    "z": z / scale,
+                }
+            elif lpp_type == CAYENNE_LPP_GPS:
+                length = 9
+                raw = payload[index : index + length]
+                if len(raw) != length:
+                    raise TtnDecodeError(f"Truncated gps on channel {channel}")
+                decoded[f"gps_{channel}"] = {
+                    "latitude": int.from_bytes(raw[0:3], "big", signed=True) / 10000,
+                    "longitude": int.from_bytes(raw[3:6], "big", signed=True) / 10000,
+                    "altitude": int.from_bytes(raw[6:9], "big", signed=True) / 100,
+                }
+            else:
+                raise TtnDecodeError(f"Unknown Cayenne LPP type {lpp_type}")
+            index += length
+    except (IndexError, struct.error) as err:
+        raise TtnDecodeError(f"Truncated Cayenne LPP payload: {err}") from err
+    return decoded
+
+
+def compile_struct_layout(layout: str) -> Callable[[bytes], dict]:
+    """Compile a declarative byte layout into a decoder.
+
+    The layout is an optional struct byte order (< or >, default >) followed
+    by name:code[*scale] entries separated by spaces or commas, with code a
+    Python struct format code - for example
+    "> temperature:h*0.01 humidity:B*0.5 _:2x battery:H*0.001". Every entry
+    is one numeric value, except padding (x) which is skipped - strings,
+    bytes and booleans are rejected.
+    """
+    tokens = layout.replace(",", " ").split()
+    byte_order = ">"
+    if tokens and tokens[0] in ("<", ">", "!", "="):
+        byte_order = tokens.pop(0)
+
+    fields = []
+    codes = byte_order
+    for token in tokens:
+        try:
+            name, code = token.split(":", 1)
+            scale = None
+            if "*" in code:
+                code, scale = code.split("*", 1)
+                scale = float(scale)
+            entry = struct.Struct(byte_order + code)
+            values = len(entry.unpack(bytes(entry.size)))
+        except (ValueError, struct.error) as err:
+            raise TtnDecodeError(f"Invalid layout entry {token!r}") from err
+        kind = code.lstrip("0123456789")
+        if kind != STRUCT_PADDING_CODE and (
+            len(kind) != 1 or kind not in STRUCT_VALUE_CODES
+        ):
+            raise TtnDecodeError(f"Layout entry {token!r} is not numeric")
+        if values > 1:
+            raise TtnDecodeError(f"Layout entry {token!r} has {values} values")
+        codes += code
+        if values:
+            fields.append((name, scale))
+    if not fields:
+        raise TtnDecodeError("Layout without values")
+    layout_struct = struct.Struct(codes)
+
+    def decode_struct(payload: bytes) -> dict:
+        try:
+            values = layout_struct.unpack_from(payload)
+        except struct.error as err:
+            raise TtnDecodeError(f"Payload does not match layout: {err}") from err
+        decoded = {}
+        for (name, scale), value in zip(fields, values):
+            decoded[name] = value * scale if scale is not None else value
+        return decoded
+
+    return decode_struct
+
+
+def compile_decoder(decoder: str, layout: Optional[str] = None):
+    """Return the decoding function of a decoder option - None for none."""
+    if decoder == OPTIONS_DECODER_CAYENNE_LPP:
+        return decode_cayenne_lpp
+    if decoder == OPTIONS_DECODER_STRUCT and layout:
+        return compile_struct_layout(layout)
+    return None
+
+
+def decode_payloads(pending: List[tuple]) -> List[Optional[dict]]:
+    """Decode a batch of (decoder, frm_payload) - run in an executor.
+
+    Returns the decoded payload of each entry, None if it failed.
+    """
+    results = []
+    for decoder, frm_payload in pending:
+        try:
+            results.append(decoder(base64.b64decode(frm_payload, validate=True)))
+        except (TtnDecodeError, binascii.Error):
+            results.append(None)
+    return results
@@ -0,0 +1,62 @@
+"""Deduplication of the uplinks received more than once."""
+from collections import OrderedDict
+
+from .const import *
+from .watermark import is_received_after
+
+
+class TTN_uplink_dedup:
+    """Drop the uplinks already seen, by device, frame counter and received_at.
+
+    The same uplink can come from overlapping fetch windows, from the
+    Storage API more than once and from both a push and a fetch. The last
+    frame counters of each device are kept in a small LRU. received_at is
+    part of the key so the counters restarting after a rejoin are not
+    mistaken for duplicates.
+    """
+
+    def __init__(self, window=DEFAULT_DEDUP_DEVICE_WINDOW):
+        self.__window = window
+        # device_id -> OrderedDict of (f_cnt, received_at)
+        self.__seen = {}
+        # device_id -> (f_cnt, received_at) of the newest uplink
+        self.__newest = {}
+
+        self.uplinks = 0
+        self.duplicates = 0
+        self.resets = 0
+
+    def is_duplicate(self, uplink):
+        """Check an uplink and remember it - True if already seen."""
+        self.uplinks += 1
+        if uplink.received_at is None:
+            # Cannot tell apart
+            return False
+
+        key = (uplink.f_cnt, uplink.received_at)
+        seen = self.__seen.get(uplink.device_id)
+        if seen is None:
+            seen = self.__seen[uplink.device_id] = OrderedDict()
+        elif key in seen:
+            seen.move_to_end(key)
+            self.duplicates += 1
+            return True
+
+        seen[key] = None
+        if len(seen) > self.__window:
+            seen.popitem(last=False)
+
+        newest = self.__newest.get(uplink.device_id)
+        if newest is None or is_received_after(uplink.received_at, newest[1]):
+            if newest is not None and uplink.f_cnt < newest[0]:
+                self.resets += 1
+            self.__newest[uplink.device_id] = key
+        return False
+
+    def get_stats(self):
+        return {
+            "devices": len(self.__seen),
+            "uplinks": self.uplinks,
+            "duplicates": self.duplicates,
+            "frame_counter_resets": self.resets,
+        }
@@ -0,0 +1,29 @@
+"""Diagnostics download of The Things Network integration."""
+from homeassistant.components.diagnostics import async_redact_data
+
+from .const import *
+from .TTN_client import TTN_client
+from .zone_cache import TTN_zone_cache
+
+TO_REDACT = {CONF_ACCESS_KEY, OPTIONS_MENU_INTEGRATION_WEBHOOK_SECRET}
+
+
+async def async_get_config_entry_diagnostics(hass, entry):
+    """Return the settings and the performance statistics of an application."""
+    client = TTN_client.getInstance(entry)
+    return {
+        "data": async_redact_data(dict(entry.data), TO_REDACT),
+        "options": async_redact_data(dict(entry.options), TO_REDACT),
+        "telemetry": client.telemetry.get_stats(),
+        "hot_telemetry": client.hot_telemetry.get_stats(),
+        "pipeline": client.pipeline_stats,
+        "polls": client.poll_stats,
+        "cadence": client.cadence_stats,
+        "transport": client.transport_stats,
+        "backfill": client.backfill_stats,
+        "dedup": client.dedup_stats,
+        "write_filter": client.write_filter_stats,
+        "aggregation": client.aggregation_stats,
+        "push_latency_s": client.push_latency_s,
+        "zones": TTN_zone_cache.getInstance(hass).get_stats(),
+    }
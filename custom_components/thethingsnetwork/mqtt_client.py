@@ -0,0 +1,119 @@
+"""Push ingestion of uplinks through the MQTT server of The Things Stack."""
+import json
+import ssl
+
+import paho.mqtt.client as mqtt
+
+from . import LOGGER
+from .const import *
+
+
+class TTN_mqtt_client:
+    """Subscribe to the uplinks of an application and forward them to a handler.
+
+    paho runs its network loop in its own thread so every callback is handed
+    back to the Home Assistant event loop before touching the client.
+    """
+
+    def __init__(
+        self,
+        hass,
+        hostname,
+        port,
+        use_tls,
+        application_id,
+        access_key,
+        on_uplink,
+        on_connected,
+        on_disconnected,
+    ):
+        self.__hass = hass
+        self.__hostname = hostname
+        self.__port = port
+        self.__use_tls = use_tls
+        self.__application_id = application_id
+        self.__access_key = access_key
+        self.__on_uplink = on_uplink
+        self.__on_connected = on_connected
+        self.__on_disconnected = on_disconnected
+
+        self.__mqtt = None
+        self.__is_connected = False
+
+    @property
+    def is_connected(self):
+        return self.__is_connected
+
+    async def connect(self):
+        LOGGER.info(
+            f"Connecting to MQTT {self.__hostname}:{self.__port} for {self.__application_id}"
+        )
+        # TLS setup reads the CA bundle from disk
+        await self.__hass.async_add_executor_job(self.__start)
+
+    async def disconnect(self):
+        if self.__mqtt:
+            await self.__hass.async_add_executor_job(self.__stop)
+
+    def __start(self):
+        if hasattr(mqtt, "CallbackAPIVersion"):
+            # paho-mqtt 2 - keep the callback signatures of paho-mqtt 1
+            self.__mqtt = mqtt.Client(
+                mqtt.CallbackAPIVersion.VERSION1, protocol=mqtt.MQTTv311
+            )
+        else:
+            self.__mqtt = mqtt.Client(protocol=mqtt.MQTTv311)
+        self.__mqtt.username_pw_set(
+            TTN_MQTT_USERNAME.format(app_id=self.__application_id),
+            self.__access_key,
+        )
+        if self.__use_tls:
+            self.__mqtt.tls_set(tls_version=ssl.PROTOCOL_TLS_CLIENT)
+        self.__mqtt.on_connect = self.__on_connect
+        self.__mqtt.on_disconnect = self.__on_disconnect
+        self.__mqtt.on_message = self.__on_message
+        self.__mqtt.reconnect_delay_set(
+            min_delay=1, max_delay=DEFAULT_MQTT_RECONNECT_MAX_DELAY_S
+        )
+        self.__mqtt.connect_async(self.__hostname, self.__port)
+        self.__mqtt.loop_start()
+
+    def __stop(self):
+        self.__mqtt.disconnect()
+        self.__mqtt.loop_stop()
+        self.__mqtt = None
+        self.__is_connected = False
+
+    # ---------------
+    # paho callbacks - called from the paho network thread
+    # ---------------
+    def __on_connect(self, client, userdata, flags, rc):
+        if rc != mqtt.CONNACK_ACCEPTED:
+            LOGGER.error(
+                f"MQTT connection refused for {self.__application_id}: {mqtt.connack_string(rc)}"
+            )
+            return
+
+        topic = TTN_MQTT_TOPIC_UPLINK.format(app_id=self.__application_id)
+        LOGGER.debug(f"MQTT connected, subscribing to {topic}")
+        client.subscribe(topic)
+
+        self.__is_connected = True
+        self.__hass.add_job(self.__on_connected)
+
+    def __on_disconnect(self, client, userdata, rc):
+        self.__is_connected = False
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            LOGGER.warning(
+                f"MQTT connection lost for {self.__application_id}: {mqtt.error_string(rc)}"
+            )
+            self.__hass.add_job(self.__on_disconnected)
+
+    def __on_message(self, client, userdata, message):
+        try:
+            uplink = json.loads(message.payload)
+        except ValueError:
+            LOGGER.error(f"Invalid MQTT payload on {message.topic}: {message.payload}")
+            return
+
+        self.__hass.add_job(self.__on_uplink, uplink)
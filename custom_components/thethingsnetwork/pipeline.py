@@ -0,0 +1,109 @@
+"""Stages of the pipeline feeding the uplinks of an application to its entities."""
+import asyncio
+import time
+
+
+class TTN_pipeline_stage:
+    """Bounded input queues and throughput counters of one pipeline stage.
+
+    Producers await put() so a slow stage holds back the stages before it
+    instead of buffering without limit. A stage can have several queues at
+    a time, for example one per fetch in flight.
+    """
+
+    def __init__(self, name, maxsize=0):
+        self.name = name
+        self.maxsize = maxsize
+        self.__queues = []
+
+        self.items = 0
+        self.errors = 0
+        self.busy_s = 0.0
+        self.max_depth = 0
+
+    def open_queue(self):
+        queue = asyncio.Queue(maxsize=self.maxsize)
+        self.__queues.append(queue)
+        return queue
+
+    def close_queue(self, queue):
+        self.__queues.remove(queue)
+
+    async def put(self, queue, item):
+        """Queue an item - waits while the queue is full."""
+        await queue.put(item)
+        self.max_depth = max(self.max_depth, queue.qsize())
+
+    def put_nowait(self, queue, item):
+        """Queue an item - raises asyncio.QueueFull if the queue is full."""
+        queue.put_nowait(item)
+        self.max_depth = max(self.max_depth, queue.qsize())
+
+    def record(self, start, items=1):
+        """Account items processed since start, a time.monotonic() value."""
+        self.items += items
+        self.busy_s += time.monotonic() - start
+
+    def get_stats(self):
+        return {
+            "items": self.items,
+            "errors": self.errors,
+            "busy_s": round(self.busy_s, 3),
+            "items_per_s": round(self.items / self.busy_s, 1) if self.busy_s else None,
+            "queue_depth": sum(queue.qsize() for queue in self.__queues),
+            "queue_max_depth": self.max_depth,
+            "queue_size": self.maxsize,
+        }
+
+
+class TTN_fetch:
+    """Results of one Storage API fetch collected while it is dispatched."""
+
+    def __init__(self, device_id, coalesce, statistics=None):
+        # None for the application wide fetch
+        self.device_id = device_id
+        self.new_entities = {}
+        # Latest value per unique_id - None to write every value
+        self.updates = {} if coalesce else None
+        # TTN_statistics_backfill collecting the numeric values, if enabled
+        self.statistics = statistics
+        self.new_uplinks = 0
+        self.staleness_s = 0.0
+        self.lines = 0
+        self.errors = 0
+        self.duplicates = 0
+
+        # Telemetry
+        self.started_at = time.monotonic()
+        self.ttfb_s = None
+        # Body bytes on the wire and decompressed
+        self.wire_bytes = 0
+        self.bytes = 0
+        self.decompress_s = 0.0
+        self.entities_updated = 0
+        self.newest_received_at = None
+
+        # Set by the dispatcher once every uplink of the fetch is applied
+        self.done = asyncio.get_running_loop().create_future()
+
+    def get_metrics(self, now):
+        """Metrics of the fetch for TTN_telemetry - call once it is done.
+
+        The lag is how far the newest uplink fetched is behind now.
+        """
+        duration_s = time.monotonic() - self.started_at
+        return {
+            "ttfb_s": self.ttfb_s,
+            "duration_s": duration_s,
+            "wire_bytes": self.wire_bytes,
+            "bytes": self.bytes,
+            "decompress_s": self.decompress_s,
+            "lines": self.lines,
+            "duplicates": self.duplicates,
+            "messages_per_s": self.lines / duration_s if duration_s else None,
+            "entities_updated": self.entities_updated,
+            "entities_created": len(self.new_entities),
+            "lag_s": (now - self.newest_received_at).total_seconds()
+            if self.newest_received_at
+            else None,
+        }
@@ -0,0 +1,201 @@
+"""Process-wide scheduler for the Storage API polls of all applications."""
+import asyncio
+import math
+import random
+import time
+
+from homeassistant.helpers.event import async_call_later
+
+from . import LOGGER
+from .const import *
+
+
+class TTN_poll_job:
+    """Polling state and statistics of one application."""
+
+    def __init__(
+        self, name, get_interval_s, poll, get_next_delay_s=None, get_defer_s=None
+    ):
+        self.name = name
+        # Returns the poll period in seconds or None to not poll periodically
+        self.get_interval_s = get_interval_s
+        self.poll = poll
+        # Optional - returns the delay to the next poll to not use the period
+        self.get_next_delay_s = get_next_delay_s
+        # Optional - returns how long a due poll has to wait, such as for a
+        # rate limit
+        self.get_defer_s = get_defer_s
+
+        # Offset of the polls within the interval, as a fraction of it
+        self.phase = 0.0
+        self.cancel_timer = None
+        self.scheduled_at = None
+        self.immediate = False
+        self.queued = False
+        self.running = False
+
+        self.polls = 0
+        self.deferred = 0
+        self.last_lag_s = None
+        self.last_wait_s = None
+        self.last_duration_s = None
+
+    @property
+    def idle(self):
+        return not (self.immediate or self.queued or self.running)
+
+    def get_stats(self):
+        return {
+            "interval_s": self.get_interval_s(),
+            "queued": self.queued,
+            "running": self.running,
+            "polls": self.polls,
+            "deferred": self.deferred,
+            "next_poll_in_s": None
+            if self.scheduled_at is None
+            else round(self.scheduled_at - time.monotonic(), 3),
+            "last_lag_s": self.last_lag_s,
+            "last_wait_s": self.last_wait_s,
+            "last_duration_s": self.last_duration_s,
+        }
+
+
+class TTN_scheduler:
+    """Own the polling of every TTN_client.
+
+    Polls are spread evenly over the interval with some jitter so that many
+    applications do not hit TTN at the same time, and the number of Storage
+    API streams in flight is limited.
+    """
+
+    __instance = None
+
+    @staticmethod
+    def getInstance(hass):
+        """Static access method."""
+        if TTN_scheduler.__instance is None:
+            TTN_scheduler.__instance = TTN_scheduler(hass)
+        return TTN_scheduler.__instance
+
+    def __init__(self, hass):
+        self.__hass = hass
+        self.__jobs = {}
+        self.__semaphore = asyncio.Semaphore(DEFAULT_SCHEDULER_MAX_CONCURRENT_POLLS)
+        self.__epoch = time.monotonic()
+
+    def register(
+        self, name, get_interval_s, poll, get_next_delay_s=None, get_defer_s=None
+    ):
+        """Add a job - the first poll is done as soon as a slot is free."""
+        self.unregister(name)
+        job = TTN_poll_job(name, get_interval_s, poll, get_next_delay_s, get_defer_s)
+        self.__jobs[name] = job
+        self.__rebalance()
+        self.poll_now(name)
+        return job
+
+    def unregister(self, name):
+        job = self.__jobs.pop(name, None)
+        if job:
+            self.__cancel(job)
+            self.__rebalance()
+
+    def poll_now(self, name):
+        """Poll a job out of schedule, for example after an options change."""
+        job = self.__jobs.get(name)
+        if job is None or job.immediate or job.queued:
+            return
+        job.immediate = True
+        if not job.running:
+            self.__schedule(job, 0)
+        # Otherwise polled again once the running poll is done
+
+    def get_stats(self):
+        return {name: job.get_stats() for name, job in self.__jobs.items()}
+
+    def __rebalance(self):
+        # Give every job its own phase within its interval
+        jobs = sorted(self.__jobs.values(), key=lambda job: job.name)
+        for index, job in enumerate(jobs):
+            job.phase = (index + 1) / len(jobs)
+            if job.idle:
+                self.__schedule_next(job)
+
+    def __schedule_next(self, job):
+        interval_s = job.get_interval_s()
+        if interval_s is None:
+            self.__cancel(job)
+            return
+
+        if job.get_next_delay_s:
+            delay_s = job.get_next_delay_s()
+            if delay_s is not None:
+                self.__schedule(job, delay_s)
+                return
+
+        # Next time at the phase of the job, plus jitter within its slot
+        offset_s = job.phase * interval_s
+        elapsed_s = time.monotonic() - self.__epoch - offset_s
+        next_s = (math.floor(elapsed_s / interval_s) + 1) * interval_s - elapsed_s
+        slot_s = interval_s / len(self.__jobs)
+        jitter_s = random.uniform(-1, 1) * slot_s * DEFAULT_SCHEDULER_JITTER
+        self.__schedule(job, next_s + jitter_s)
+
+    def __cancel(self, job):
+        if job.cancel_timer:
+            job.cancel_timer()
+            job.cancel_timer = None
+        job.scheduled_at = None
+
+    def __schedule(self, job, delay_s):
+        self.__cancel(job)
+        delay_s = max(delay_s, 0)
+        job.scheduled_at = time.monotonic() + delay_s
+
+        async def run(now):
+            job.cancel_timer = None
+            await self.__run(job)
+
+        job.cancel_timer = async_call_later(self.__hass, delay_s, run)
+
+    async def __run(self, job):
+        defer_s = job.get_defer_s() if job.get_defer_s else 0
+        if defer_s > 0:
+            # Polled once the budget allows - out of schedule polls requested
+            # meanwhile are coalesced into it
+            job.deferred += 1
+            LOGGER.debug(f"Poll of {job.name} deferred by {defer_s:.1f}s")
+            self.__schedule(job, defer_s)
+            return
+
+        job.immediate = False
+        job.queued = True
+        queued_at = time.monotonic()
+        job.last_lag_s = round(queued_at - job.scheduled_at, 3)
+        job.scheduled_at = None
+        try:
+            async with self.__semaphore:
+                job.queued = False
+                job.running = True
+                start = time.monotonic()
+                job.last_wait_s = round(start - queued_at, 3)
+                try:
+                    await job.poll()
+                except Exception:  # pylint: disable=broad-except
+                    LOGGER.exception(f"Error polling {job.name}")
+                job.last_duration_s = round(time.monotonic() - start, 3)
+                job.polls += 1
+        finally:
+            job.queued = False
+            job.running = False
+
+        LOGGER.debug(f"Poll of {job.name}: {job.get_stats()}")
+
+        if self.__jobs.get(job.name) is not job:
+            # Unregistered while polling
+            return
+
+        if job.immediate:
+            self.__schedule(job, 0)
+        else:
+            self.__schedule_next(job)
@@ -7,6 +7,9 @@ async def async_setup_entry(hass, entry, async_add_entities):
     client = TTN_client.getInstance(entry)
     client.add_entities(async_add_sensor_entities=async_add_entities)
 
+    # Diagnostic sensors of the application
+    async_add_entities(client.get_telemetry_entities())
+
 
 
 async def async_unload_entry(hass, entry, async_remove_entity) -> None:
@@ -0,0 +1,133 @@
+"""Performance telemetry of the Storage API fetches of an application."""
+from collections import deque
+import math
+from typing import NamedTuple, Optional
+
+from homeassistant.helpers.entity import Entity, EntityCategory
+
+from .const import *
+
+
+class TtnMetric(NamedTuple):
+    key: str
+    name: str
+    unit: Optional[str]
+    icon: str
+
+
+TELEMETRY_METRICS = [
+    TtnMetric("ttfb_s", "time to first byte", "s", "mdi:timer-sand"),
+    TtnMetric("duration_s", "fetch duration", "s", "mdi:timer-outline"),
+    TtnMetric("wire_bytes", "bytes on the wire", "B", "mdi:download-network"),
+    TtnMetric("bytes", "bytes parsed", "B", "mdi:file-download-outline"),
+    TtnMetric("decompress_s", "decompression time", "s", "mdi:zip-box-outline"),
+    TtnMetric("lines", "lines parsed", None, "mdi:text-box-outline"),
+    TtnMetric("duplicates", "duplicates skipped", None, "mdi:content-duplicate"),
+    TtnMetric("messages_per_s", "messages per second", "msg/s", "mdi:speedometer"),
+    TtnMetric("entities_updated", "entities updated", None, "mdi:update"),
+    TtnMetric("entities_created", "entities created", None, "mdi:new-box"),
+    TtnMetric("lag_s", "lag", "s", "mdi:clock-alert-outline"),
+]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest rank percentile of already sorted values."""
+    index = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+class TTN_telemetry:
+    """Metrics of the last fetches with rolling p50/p95."""
+
+    def __init__(self):
+        self.fetches = 0
+        self.__samples = {
+            metric.key: deque(maxlen=DEFAULT_TELEMETRY_SAMPLES)
+            for metric in TELEMETRY_METRICS
+        }
+
+    def record_fetch(self, metrics):
+        """Record the metrics of one fetch - a dict keyed by metric key.
+
+        Metrics missing or None, such as the lag of a fetch without new
+        uplinks, are not sampled.
+        """
+        self.fetches += 1
+        for key, samples in self.__samples.items():
+            value = metrics.get(key)
+            if isinstance(value, float):
+                value = round(value, 3)
+            if value is not None:
+                samples.append(value)
+
+    def get_metric_stats(self, key):
+        samples = self.__samples[key]
+        if not samples:
+            return {"last": None, "p50": None, "p95": None}
+        sorted_samples = sorted(samples)
+        return {
+            "last": samples[-1],
+            "p50": percentile(sorted_samples, 0.5),
+            "p95": percentile(sorted_samples, 0.95),
+        }
+
+    def get_stats(self):
+        stats = {
+            metric.key: self.get_metric_stats(metric.key) for metric in TELEMETRY_METRICS
+        }
+        stats["fetches"] = self.fetches
+        return stats
+
+
+class TtnTelemetrySensor(Entity):
+    """Diagnostic sensor with the last value of a metric and its p50/p95."""
+
+    def __init__(self, client, metric: TtnMetric):
+        self.__client = client
+        self.__metric = metric
+        self.__application_id = client.entry.data[CONF_APP_ID]
+
+    @property
+    def should_poll(self) -> bool:
+        return False
+
+    @property
+    def unique_id(self) -> str:
+        return f"{self.__application_id}_telemetry_{self.__metric.key}"
+
+    @property
+    def name(self) -> str:
+        return f"{self.__application_id} {self.__metric.name}"
+
+    @property
+    def entity_category(self):
+        return EntityCategory.DIAGNOSTIC
+
+    @property
+    def icon(self) -> str:
+        return self.__metric.icon
+
+    @property
+    def unit_of_measurement(self) -> Optional[str]:
+        return self.__metric.unit
+
+    @property
+    def state(self):
+        return self.__client.telemetry.get_metric_stats(self.__metric.key)["last"]
+
+    @property
+    def extra_state_attributes(self):
+        stats = self.__client.telemetry.get_metric_stats(self.__metric.key)
+        return {
+            "p50": stats["p50"],
+            "p95": stats["p95"],
+            "fetches": self.__client.telemetry.fetches,
+        }
+
+    @property
+    def device_info(self):
+        return {
+            "identifiers": {(DOMAIN, f"application {self.__application_id}")},
+            "name": f"TTN application {self.__application_id}",
+            "manufacturer": "The Things Network",
+        }
@@ -0,0 +1,366 @@
+"""Resilient HTTP transport for the streamed Storage API responses."""
+import asyncio
+from email.utils import parsedate_to_datetime
+import random
+import time
+import zlib
+
+import aiohttp
+import async_timeout
+
+from . import LOGGER
+from .const import *
+
+
+class TtnStorageApiError(Exception):
+    """The Storage API could not be reached or did not complete a response."""
+
+
+class TTN_circuit_breaker:
+    """Stop calling a host for a while after repeated failures.
+
+    While open every call fails at once instead of waiting for a timeout.
+    After DEFAULT_CIRCUIT_BREAKER_OPEN_S one trial call is let through: it
+    closes the breaker if it succeeds and keeps it open otherwise.
+    """
+
+    __instances = {}
+
+    @staticmethod
+    def getInstance(hostname):
+        """Static access method - one breaker per host."""
+        if hostname not in TTN_circuit_breaker.__instances:
+            TTN_circuit_breaker.__instances[hostname] = TTN_circuit_breaker(hostname)
+        return TTN_circuit_breaker.__instances[hostname]
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.__opened_at = None
+
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def is_open(self):
+        return self.__opened_at is not None
+
+    def allow(self):
+        if self.__opened_at is None:
+            return True
+        if time.monotonic() - self.__opened_at >= DEFAULT_CIRCUIT_BREAKER_OPEN_S:
+            # Half open - let this call through, the others wait for its result
+            self.__opened_at = time.monotonic()
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.__opened_at is not None:
+            LOGGER.info(f"{self.hostname} is reachable again")
+        self.failures = 0
+        self.__opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.__opened_at is None and self.failures >= DEFAULT_CIRCUIT_BREAKER_FAILURES:
+            LOGGER.warning(
+                f"{self.hostname} failed {self.failures} times,"
+                f" pausing calls for {DEFAULT_CIRCUIT_BREAKER_OPEN_S}s"
+            )
+            self.trips += 1
+            self.__opened_at = time.monotonic()
+
+    def get_stats(self):
+        return {
+            "open": self.is_open,
+            "failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+class TTN_rate_limiter:
+    """Token bucket of the Storage API requests to a host.
+
+    Starts with DEFAULT_RATE_LIMIT_BURST tokens refilled at
+    DEFAULT_RATE_LIMIT_PER_S and follows the X-Rate-Limit-* headers of TTN
+    once it sent them. A 429 empties the bucket until its Retry-After or
+    X-Rate-Limit-Retry. Shared by every application on the host.
+    """
+
+    __instances = {}
+
+    @staticmethod
+    def getInstance(hostname):
+        """Static access method - one bucket per host."""
+        if hostname not in TTN_rate_limiter.__instances:
+            TTN_rate_limiter.__instances[hostname] = TTN_rate_limiter(hostname)
+        return TTN_rate_limiter.__instances[hostname]
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        self.capacity = DEFAULT_RATE_LIMIT_BURST
+        self.rate_per_s = DEFAULT_RATE_LIMIT_PER_S
+        self.__tokens = float(self.capacity)
+        self.__updated_at = time.monotonic()
+        self.__blocked_until = 0.0
+
+        self.requests = 0
+        self.throttled = 0
+        self.deferred = 0
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(
+            self.capacity, self.__tokens + (now - self.__updated_at) * self.rate_per_s
+        )
+        self.__updated_at = now
+        return now
+
+    def get_delay_s(self):
+        """Seconds until a request can be made - 0 if now."""
+        now = self.__refill()
+        delay_s = max(self.__blocked_until - now, 0)
+        if self.__tokens < 1:
+            delay_s = max(delay_s, (1 - self.__tokens) / self.rate_per_s)
+        return delay_s
+
+    async def acquire(self):
+        """Wait for a token - TtnStorageApiError if that takes too long."""
+        delay_s = self.get_delay_s()
+        if delay_s > DEFAULT_RATE_LIMIT_MAX_WAIT_S:
+            self.deferred += 1
+            raise TtnStorageApiError(
+                f"Rate limit of {self.hostname} reached, retry in {delay_s:.0f}s"
+            )
+        if delay_s > 0:
+            self.deferred += 1
+            LOGGER.debug(f"Waiting {delay_s:.1f}s for the rate limit of {self.hostname}")
+            await asyncio.sleep(delay_s)
+            self.__refill()
+        self.__tokens -= 1
+        self.requests += 1
+
+    def update(self, headers):
+        """Follow the rate limit headers of a response."""
+        limit = get_header_number(headers, "X-Rate-Limit-Limit")
+        available = get_header_number(headers, "X-Rate-Limit-Available")
+        reset_s = get_header_number(headers, "X-Rate-Limit-Reset")
+        self.__refill()
+        if limit:
+            self.capacity = int(limit)
+        if available is not None:
+            self.__tokens = min(available, self.capacity)
+            if reset_s and available < self.capacity:
+                # Full again after reset_s
+                self.rate_per_s = (self.capacity - available) / reset_s
+
+    def throttle(self, headers):
+        """A 429 - wait for the time TTN asks for before the next request."""
+        self.throttled += 1
+        retry_s = get_header_number(headers, "X-Rate-Limit-Retry")
+        if retry_s is None:
+            retry_s = get_retry_after_s(headers.get("Retry-After"))
+        if retry_s is None:
+            retry_s = DEFAULT_RATE_LIMIT_RETRY_S
+        self.__tokens = 0.0
+        self.__blocked_until = time.monotonic() + retry_s
+        LOGGER.warning(f"{self.hostname} is rate limiting, waiting {retry_s:.0f}s")
+
+    def get_stats(self):
+        self.__refill()
+        return {
+            "capacity": self.capacity,
+            "rate_per_s": round(self.rate_per_s, 3),
+            "tokens": round(self.__tokens, 1),
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "deferred": self.deferred,
+        }
+
+
+def get_header_number(headers, name):
+    """A numeric header - None if missing or invalid."""
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def get_retry_after_s(value):
+    """Seconds of a Retry-After header, given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_backoff_s(attempt):
+    """Exponential backoff with jitter for the given retry (0 based)."""
+    backoff_s = min(
+        DEFAULT_RETRY_BACKOFF_S * 2 ** attempt, DEFAULT_RETRY_MAX_BACKOFF_S
+    )
+    return random.uniform(0.5, 1.5) * backoff_s
+
+
+async def open_stream(session, hostname, url, headers):
+    """GET url and return the response once its status is OK.
+
+    Requests wait for the rate limiter of the host. Timeouts, connection
+    errors and 5xx responses are retried with backoff, 429 responses after
+    the time TTN asks for. Raises TtnStorageApiError when the retries are
+    exhausted, for other errors, while the circuit breaker of the host is
+    open and if the rate limit would hold the request for too long.
+    """
+    breaker = TTN_circuit_breaker.getInstance(hostname)
+    limiter = TTN_rate_limiter.getInstance(hostname)
+    throttled = False
+    for attempt in range(DEFAULT_RETRY_ATTEMPTS):
+        if attempt and not throttled:
+            await asyncio.sleep(get_backoff_s(attempt - 1))
+        throttled = False
+
+        if not breaker.allow():
+            raise TtnStorageApiError(f"Calls to {hostname} paused after failures")
+        await limiter.acquire()
+
+        try:
+            async with async_timeout.timeout(DEFAULT_TIMEOUT):
+                response = await session.get(url, headers=headers)
+        except (asyncio.TimeoutError, aiohttp.ClientError) as err:
+            breaker.record_failure()
+            error = f"Error while accessing {url}: {err!r}"
+            LOGGER.warning(f"{error} (attempt {attempt + 1})")
+            continue
+
+        status = response.status
+        limiter.update(response.headers)
+        if status == 200:
+            breaker.record_success()
+            return response
+
+        response.release()
+        if status == 429:
+            # The host works - the next attempt waits for the rate limiter
+            limiter.throttle(response.headers)
+            throttled = True
+            error = f"{url} is rate limited"
+            LOGGER.warning(f"{error} (attempt {attempt + 1})")
+            continue
+        if status >= 500:
+            breaker.record_failure()
+            error = f"{url} returned {status}"
+            LOGGER.warning(f"{error} (attempt {attempt + 1})")
+            continue
+
+        # The host works - the request is wrong
+        breaker.record_success()
+        if status == 401:
+            raise TtnStorageApiError(f"Not authorized for {url}")
+        if status == 404:
+            raise TtnStorageApiError(f"Not available: {url}")
+        raise TtnStorageApiError(f"{url} returned {status}")
+
+    raise TtnStorageApiError(error)
+
+
+async def iter_chunks(response, hostname):
+    """Yield the chunks of a streamed body as they arrive.
+
+    Raises TtnStorageApiError if no data arrives for
+    DEFAULT_IDLE_READ_TIMEOUT_S or the whole body takes longer than
+    DEFAULT_FETCH_DEADLINE_S. The response is released in any case.
+    """
+    breaker = TTN_circuit_breaker.getInstance(hostname)
+    deadline = time.monotonic() + DEFAULT_FETCH_DEADLINE_S
+    try:
+        while True:
+            remaining_s = deadline - time.monotonic()
+            try:
+                if remaining_s <= 0:
+                    raise asyncio.TimeoutError
+                async with async_timeout.timeout(
+                    min(DEFAULT_IDLE_READ_TIMEOUT_S, remaining_s)
+                ):
+                    chunk = await response.content.readany()
+            except asyncio.TimeoutError:
+                if time.monotonic() >= deadline:
+                    # Slow but not failing - the next fetch resumes from here
+                    raise TtnStorageApiError(
+                        f"Response of {hostname} not complete after"
+                        f" {DEFAULT_FETCH_DEADLINE_S}s"
+                    ) from None
+                breaker.record_failure()
+                raise TtnStorageApiError(f"Response of {hostname} stalled") from None
+            except aiohttp.ClientError as err:
+                breaker.record_failure()
+                raise TtnStorageApiError(
+                    f"Response of {hostname} interrupted: {err!r}"
+                ) from err
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        response.release()
+
+
+class TTN_stream_decompressor:
+    """Incremental gzip or deflate decoding of a streamed response body.
+
+    The output of every chunk is split in pieces of at most
+    DEFAULT_DECOMPRESS_CHUNK_SIZE, so a highly compressed chunk does not
+    expand at once in memory - the pieces go one by one through the bounded
+    parser queue. The CPU time spent decompressing is kept in cpu_s.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self.__decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            # zlib wrapped as per the RFC - some servers send it raw
+            self.__decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+        else:
+            raise TtnStorageApiError(f"Unsupported content encoding {encoding}")
+        self.__started = False
+        self.cpu_s = 0.0
+
+    def decompress(self, chunk):
+        """Yield the decompressed pieces of a chunk."""
+        data = chunk
+        while data:
+            start = time.thread_time()
+            try:
+                piece = self.__decompressor.decompress(
+                    data, DEFAULT_DECOMPRESS_CHUNK_SIZE
+                )
+            except zlib.error as err:
+                if self.encoding == "deflate" and not self.__started:
+                    # Raw deflate without the zlib header
+                    self.__decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                    self.__started = True
+                    continue
+                raise TtnStorageApiError(
+                    f"Invalid {self.encoding} response: {err}"
+                ) from err
+            finally:
+                self.cpu_s += time.thread_time() - start
+            self.__started = True
+            data = self.__decompressor.unconsumed_tail
+            if piece:
+                yield piece
+
+    def flush(self):
+        """Return what is left once the body is complete."""
+        start = time.thread_time()
+        try:
+            return self.__decompressor.flush()
+        finally:
+            self.cpu_s += time.thread_time() - start
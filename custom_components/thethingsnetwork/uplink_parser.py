@@ -0,0 +1,140 @@
+"""Streaming parser for the uplinks returned by the TTN Storage API."""
+import json
+from typing import Iterator, NamedTuple, Optional
+
+try:
+    import orjson
+
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+class Uplink(NamedTuple):
+    """The parts of an uplink used by the integration."""
+
+    device_id: str
+    # TTN leaves out a frame counter of 0
+    f_cnt: int
+    received_at: Optional[str]
+    decoded_payload: Optional[dict]
+    # Base64 - decoded locally if there is no decoded_payload
+    frm_payload: Optional[str]
+    # Only requested for the signal quality
+    rx_metadata: Optional[list]
+
+
+# Paths of the ApplicationUp messages read into an Uplink - end_device_ids
+# and received_at are always returned
+FIELD_MASK_PATHS = ["up.uplink_message.decoded_payload", "up.uplink_message.f_cnt"]
+FIELD_MASK_FRM_PAYLOAD = "up.uplink_message.frm_payload"
+FIELD_MASK_RX_METADATA = "up.uplink_message.rx_metadata"
+
+
+def get_field_mask(frm_payload: bool = False, rx_metadata: bool = False) -> str:
+    """Storage API field_mask of the paths used, with the optional ones requested.
+
+    Without it TTN returns the whole uplink, including the metadata of every
+    gateway that received it.
+    """
+    paths = list(FIELD_MASK_PATHS)
+    if frm_payload:
+        paths.append(FIELD_MASK_FRM_PAYLOAD)
+    if rx_metadata:
+        paths.append(FIELD_MASK_RX_METADATA)
+    return ",".join(paths)
+
+
+def get_signal_fields(rx_metadata: list) -> dict:
+    """Signal quality fields of an uplink: best RSSI, its SNR and gateway count."""
+    best = None
+    for gateway in rx_metadata:
+        rssi = gateway.get("rssi")
+        if rssi is not None and (best is None or rssi > best.get("rssi")):
+            best = gateway
+    fields = {"signal_gateways": len(rx_metadata)}
+    if best is not None:
+        fields["signal_rssi"] = best["rssi"]
+        if "snr" in best:
+            fields["signal_snr"] = best["snr"]
+    return fields
+
+
+def uplink_from_message(message: dict) -> Uplink:
+    """Extract the used parts from an uplink already parsed into a dict.
+
+    Used for the Storage API results and for the messages pushed by MQTT or
+    webhooks, which have the same format.
+    """
+    # With a field_mask, an uplink with no decoded_payload and an f_cnt of
+    # 0 comes without uplink_message
+    uplink_message = message.get("uplink_message") or {}
+    return Uplink(
+        message["end_device_ids"]["device_id"],
+        uplink_message.get("f_cnt", 0),
+        message.get("received_at"),
+        uplink_message.get("decoded_payload"),
+        uplink_message.get("frm_payload"),
+        uplink_message.get("rx_metadata"),
+    )
+
+
+class UplinkStreamParser:
+    """Parse a Storage API response chunk by chunk.
+
+    The response has one {"result": uplink} JSON object per line. The chunks
+    are appended to a single buffer which is consumed in place so no string
+    is built per line. orjson is used when available since it can parse
+    directly from the buffer.
+    """
+
+    def __init__(self, use_orjson: bool = HAS_ORJSON):
+        self.__buffer = bytearray()
+        self.__use_orjson = use_orjson
+        self.lines = 0
+        self.errors = 0
+
+    def feed(self, chunk: bytes) -> Iterator[Uplink]:
+        """Add a chunk and return the uplinks of every complete line in it."""
+        self.__buffer += chunk
+        return self.__drain()
+
+    def __drain(self) -> Iterator[Uplink]:
+        buffer = self.__buffer
+        start = 0
+        try:
+            while True:
+                end = buffer.find(b"\n", start)
+                if end < 0:
+                    break
+                uplink = self.__parse_line(buffer, start, end)
+                start = end + 1
+                if uplink is not None:
+                    yield uplink
+        finally:
+            del buffer[:start]
+
+    def close(self) -> Iterator[Uplink]:
+        """Parse what is left in the buffer after the last chunk."""
+        buffer = self.__buffer
+        uplink = self.__parse_line(buffer, 0, len(buffer))
+        buffer.clear()
+        if uplink is not None:
+            yield uplink
+
+    def __parse_line(self, buffer, start, end) -> Optional[Uplink]:
+        # Skip empty lines not containing a result
+        if end - start < len(b'{"result"'):
+            return None
+
+        self.lines += 1
+        try:
+            if self.__use_orjson:
+                with memoryview(buffer) as view:
+                    message = orjson.loads(view[start:end])
+            else:
+                message = json.loads(buffer[start:end])
+            return uplink_from_message(message["result"])
+        except (ValueError, KeyError, TypeError):
+            self.errors += 1
+            return None
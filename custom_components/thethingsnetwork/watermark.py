@@ -0,0 +1,45 @@
+"""Track the newest uplink processed from a Storage API source."""
+import homeassistant.util.dt as dt_util
+
+
+class TTN_watermark:
+    """Newest received_at processed, kept as sent by TTN and parsed."""
+
+    def __init__(self, raw=None):
+        self.raw = raw
+        self.value = dt_util.parse_datetime(raw or "")
+
+    def __bool__(self):
+        return self.value is not None
+
+    def is_after(self, received_at):
+        """Return True if an uplink received at received_at is new."""
+        if received_at is None or self.value is None:
+            return True
+        return received_at > self.value
+
+    def advance(self, received_at, received_at_raw):
+        """Move the watermark forward - returns True if it moved."""
+        if received_at is None or not self.is_after(received_at):
+            return False
+        self.value = received_at
+        self.raw = received_at_raw
+        return True
+
+
+def is_received_after(received_at_raw, other_raw):
+    """Compare two received_at as sent by TTN without parsing them.
+
+    They are RFC 3339 in UTC - up to the seconds the strings sort by time,
+    the fraction has a varying number of digits. True if either is unknown.
+    """
+    if not received_at_raw or not other_raw:
+        return True
+    if received_at_raw[:19] != other_raw[:19]:
+        return received_at_raw[:19] > other_raw[:19]
+    return _get_fraction(received_at_raw) > _get_fraction(other_raw)
+
+
+def _get_fraction(received_at_raw):
+    fraction = received_at_raw[19:].rstrip("Z")
+    return float(f"0{fraction}") if fraction.startswith(".") else 0.0
@@ -0,0 +1,48 @@
+"""Receive uplinks pushed by a TTN webhook integration."""
+import hmac
+from http import HTTPStatus
+
+from homeassistant.components.http import HomeAssistantView
+
+from . import LOGGER
+from .const import *
+from .TTN_client import TTN_client
+
+
+class TtnWebhookView(HomeAssistantView):
+    """Accept the uplink messages of a TTN webhook.
+
+    TTN cannot log into Home Assistant so each application is authenticated
+    with the webhook secret from its integration settings, which TTN sends
+    as an additional header.
+    """
+
+    url = WEBHOOK_URL
+    name = "api:thethingsnetwork:webhook"
+    requires_auth = False
+
+    async def post(self, request, app_id):
+        client = TTN_client.getInstanceByAppId(app_id)
+        if client is None:
+            return self.json_message("Unknown application", HTTPStatus.NOT_FOUND)
+
+        secret = client.get_webhook_secret()
+        # compare_digest only takes str if they are ASCII - aiohttp keeps
+        # undecodable header bytes as surrogates
+        header = request.headers.get(WEBHOOK_SECRET_HEADER, "")
+        if not secret or not hmac.compare_digest(
+            header.encode("utf-8", "surrogateescape"), secret.encode("utf-8")
+        ):
+            LOGGER.warning(f"Webhook for {app_id} with invalid secret")
+            return self.json_message("Invalid secret", HTTPStatus.UNAUTHORIZED)
+
+        try:
+            message = await request.json()
+        except ValueError:
+            return self.json_message("Invalid JSON", HTTPStatus.BAD_REQUEST)
+
+        if not client.queue_push_uplink(message):
+            # TTN retries failed webhooks
+            return self.json_message("Busy", HTTPStatus.SERVICE_UNAVAILABLE)
+
+        return self.json_message("Accepted", HTTPStatus.ACCEPTED)
@@ -0,0 +1,78 @@
+"""Per field filtering of the state writes that carry no information."""
+from .const import *
+
+
+class TTN_write_filter:
+    """Decide whether a new value of an entity is written.
+
+    Only fields with a deadband, a minimum interval or write on change only
+    are filtered. The last written value and its received_at are kept for
+    them - the other entities cost nothing. Values suppressed are not
+    written, the statistics backfill still gets them.
+    """
+
+    def __init__(self):
+        # unique_id -> (last written value, its received_at timestamp)
+        self.__last = {}
+
+        self.passed = 0
+        self.suppressed_interval = 0
+        self.suppressed_unchanged = 0
+        self.suppressed_deadband = 0
+
+    @staticmethod
+    def is_enabled(field):
+        """If the TtnFieldMetadata of an entity has any filter set."""
+        return bool(field.deadband or field.min_interval_s or field.only_on_change)
+
+    def accept(self, unique_id, field, value, timestamp, current=None):
+        """True to write value - current is the state when nothing was written yet.
+
+        timestamp is the received_at of the value in seconds, None if unknown.
+        """
+        last = self.__last.get(unique_id)
+        if last is None:
+            last_value, last_timestamp = current, None
+        else:
+            last_value, last_timestamp = last
+
+        if (
+            field.min_interval_s
+            and last_timestamp is not None
+            and timestamp is not None
+            and timestamp - last_timestamp < field.min_interval_s
+        ):
+            self.suppressed_interval += 1
+            return False
+
+        if last_value is not None:
+            if field.only_on_change and value == last_value:
+                self.suppressed_unchanged += 1
+                return False
+            if (
+                field.deadband
+                and type(value) in (int, float)
+                and type(last_value) in (int, float)
+            ):
+                band = field.deadband
+                if field.deadband_mode == OPTIONS_FIELD_DEADBAND_MODE_RELATIVE:
+                    band = abs(last_value) * field.deadband / 100
+                if abs(value - last_value) <= band:
+                    self.suppressed_deadband += 1
+                    return False
+
+        self.__last[unique_id] = (value, timestamp)
+        self.passed += 1
+        return True
+
+    def get_stats(self):
+        return {
+            "filtered_entities": len(self.__last),
+            "passed": self.passed,
+            "suppressed": self.suppressed_interval
+            + self.suppressed_unchanged
+            + self.suppressed_deadband,
+            "suppressed_interval": self.suppressed_interval,
+            "suppressed_unchanged": self.suppressed_unchanged,
+            "suppressed_deadband": self.suppressed_deadband,
+        }
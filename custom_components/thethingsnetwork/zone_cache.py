@@ -0,0 +1,82 @@
+"""Cache of the zone a position is in, shared by all device trackers."""
+from homeassistant.components import zone
+from homeassistant.const import STATE_HOME, STATE_NOT_HOME
+from homeassistant.core import callback
+from homeassistant.helpers.event import (
+    TrackStates,
+    async_track_state_change_filtered,
+)
+
+from .const import *
+
+
+class TTN_zone_cache:
+    """Resolve positions to a tracker state once until the zones change.
+
+    zone.async_active_zone scans every zone, and the state of a tracker is
+    read several times per write and by the frontend and templates. Any
+    state change of a zone entity clears the cache and increases the
+    generation, which invalidates the per tracker caches too.
+    """
+
+    __instance = None
+
+    @staticmethod
+    def getInstance(hass):
+        """Static access method."""
+        if TTN_zone_cache.__instance is None:
+            TTN_zone_cache.__instance = TTN_zone_cache(hass)
+        return TTN_zone_cache.__instance
+
+    def __init__(self, hass):
+        self.__hass = hass
+        # (latitude, longitude, accuracy) -> tracker state
+        self.__states = {}
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        # Only the zone domain - not every state change of the instance
+        async_track_state_change_filtered(
+            hass, TrackStates(False, set(), {zone.DOMAIN}), self.__on_zone_changed
+        )
+
+    @callback
+    def __on_zone_changed(self, event):
+        self.generation += 1
+        self.__states.clear()
+
+    def get_state(self, position):
+        """Tracker state for a (latitude, longitude, accuracy) position."""
+        state = self.__states.get(position)
+        if state is not None:
+            self.hits += 1
+            return state
+
+        self.misses += 1
+        zone_state = zone.async_active_zone(self.__hass, *position)
+        if zone_state is None:
+            state = STATE_NOT_HOME
+        elif zone_state.entity_id == zone.ENTITY_ID_HOME:
+            state = STATE_HOME
+        else:
+            state = zone_state.name
+
+        if len(self.__states) >= DEFAULT_ZONE_CACHE_SIZE:
+            self.__states.clear()
+        self.__states[position] = state
+        return state
+
+    def resolve(self, positions):
+        """Resolve the positions of many trackers at once, such as after a fetch."""
+        for position in set(positions):
+            self.get_state(position)
+
+    def get_stats(self):
+        return {
+            "positions": len(self.__states),
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+        }